@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure the time taken by vm-complete to answer the shell.
+
+A temporary home holds a completion index of DOMAINS watched domains, a
+resources file and the example templates. Each kind of name is completed
+REPEAT times and the best run is kept. The script fails when an answer
+takes more than BUDGET_MS, not counting the start of the interpreter.
+
+Run it with: python3 benchmarks/bench_completion.py
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+REPEAT = 10
+BUDGET_MS = 25
+DOMAINS = 2000
+KINDS = ("active", "inactive", "storage", "networks", "templates")
+
+RESOURCES = """
+storage:
+  pool:
+    driver: file
+    root: /tmp
+networks:
+  lan:
+    driver: bridge
+"""
+
+
+def setup_home(home):
+    """Write the configuration read by vm-complete in the home"""
+    etc = os.path.join(home, "ovm", "etc")
+    os.makedirs(os.path.join(home, "ovm", "var"))
+    shutil.copytree(
+        os.path.join(ROOT, "etc", "templates", "examples"),
+        os.path.join(etc, "templates"),
+    )
+    with open(os.path.join(etc, "resources.yml"), "w") as fd:
+        fd.write(RESOURCES)
+
+    code = (
+        "from ovm.vmcli.completion import CompletionIndex\n"
+        "index = CompletionIndex()\n"
+        "index.set_domains({'vm-%%05d' %% i: i %% 2 == 0 for i in range(%d)}, True)\n"
+        "index.save()\n" % DOMAINS
+    )
+    run(home, ["-c", code])
+
+
+def run(home, args):
+    env = dict(os.environ, PYTHONPATH=ROOT, HOME=home)
+    result = subprocess.run(
+        [sys.executable] + args, env=env, cwd=ROOT, capture_output=True, text=True
+    )
+    result.check_returncode()
+    return result.stdout
+
+
+def best_time(home, args):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        run(home, args)
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def main():
+    errors = []
+    with tempfile.TemporaryDirectory() as home:
+        setup_home(home)
+        interpreter = best_time(home, ["-c", "pass"])
+        print("interpreter            {:>7.2f} ms".format(interpreter))
+
+        for kind in KINDS:
+            # The first run fills the index
+            names = run(home, ["-m", "ovm.vmcli.completion", kind]).split()
+
+            best = best_time(home, ["-m", "ovm.vmcli.completion", kind]) - interpreter
+            print("{:<10} {:>5} names {:>7.2f} ms".format(kind, len(names), best))
+            if best > BUDGET_MS:
+                errors.append("%s is over the budget of %d ms" % (kind, BUDGET_MS))
+
+    for error in errors:
+        print("FAIL: " + error)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure the throughput of qemu-img convert for each set of options.
+
+A qcow2 image of SIZE_MB, half filled with random data, is converted into a
+raw file, a qcow2 file and, when run as root, a loop device backed by a file,
+with each set of OPTION_SETS. The best of REPEAT runs is kept, and the
+throughput is given for the virtual size of the image. "defaults" stands for
+the options OVM picks for the destination.
+
+Run it with: python3 benchmarks/bench_convert.py [directory]
+The directory should be on the file system of the pool.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(1, ROOT)
+
+from ovm.templates.image_template import get_convert_args  # noqa
+from ovm.templates.image_template import get_default_convert_options  # noqa
+
+
+SIZE_MB = 1024
+BLOCK = 1024**2
+REPEAT = 3
+OPTION_SETS = (
+    ("qemu-img", {}),
+    ("defaults", None),
+    ("-m 16", {"coroutines": 16}),
+    ("-m 16 -W", {"coroutines": 16, "out_of_order": True}),
+    ("-t none", {"cache": "none"}),
+    ("-m 16 -W -t none", {"coroutines": 16, "out_of_order": True, "cache": "none"}),
+    ("-S 0", {"sparse_size": 0}),
+    ("--target-is-zero", {"target_is_zero": True}),
+)
+
+
+def write_source(directory):
+    """Write the qcow2 image to convert, every other MB being random data"""
+    raw = os.path.join(directory, "source.raw")
+    with open(raw, "wb") as fd:
+        fd.truncate(SIZE_MB * BLOCK)
+        for offset in range(0, SIZE_MB, 2):
+            fd.seek(offset * BLOCK)
+            fd.write(os.urandom(BLOCK))
+
+    source = os.path.join(directory, "source.qcow2")
+    qemu_img("convert", "-f", "raw", "-O", "qcow2", raw, source)
+    os.remove(raw)
+    return source
+
+
+def qemu_img(*args):
+    subprocess.run(("qemu-img",) + args, check=True, stdout=subprocess.DEVNULL)
+
+
+def empty(path, size):
+    """Give a file of the size holding only zeros"""
+    with open(path, "wb") as fd:
+        fd.truncate(size)
+
+
+def attach_loop_device(backing):
+    """Return a loop device backed by the file, or None when not root"""
+    if os.geteuid() != 0 or shutil.which("losetup") is None:
+        return None
+    empty(backing, SIZE_MB * BLOCK)
+    output = subprocess.run(
+        ["losetup", "--find", "--show", backing],
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return output.stdout.decode("utf-8").strip()
+
+
+def convert(source, dest, dest_format, options, backing):
+    """Convert into a new empty file, or into a zeroed loop device"""
+    block_device = backing is not None
+    if block_device:
+        empty(backing, SIZE_MB * BLOCK)
+    else:
+        empty(dest, 0)
+    if options is None:
+        options = get_default_convert_options(dest, dest_format)
+    args = ["convert", "-f", "qcow2", "-O", dest_format]
+    args += get_convert_args(options, block_device)
+    start = time.perf_counter()
+    qemu_img(*(args + [source, dest]))
+    return time.perf_counter() - start
+
+
+def main():
+    if shutil.which("qemu-img") is None:
+        sys.exit("qemu-img is not installed.")
+
+    directory = tempfile.mkdtemp(dir=sys.argv[1] if len(sys.argv) > 1 else None)
+    loop_device = None
+    try:
+        source = write_source(directory)
+        targets = [
+            ("raw file", os.path.join(directory, "dest.raw"), "raw", None),
+            ("qcow2 file", os.path.join(directory, "dest.qcow2"), "qcow2", None),
+        ]
+        backing = os.path.join(directory, "loop.img")
+        loop_device = attach_loop_device(backing)
+        if loop_device is None:
+            print("Not root: the loop device is skipped.")
+        else:
+            targets.append(("loop device", loop_device, "raw", backing))
+
+        print(
+            "{:<12}{:<20}{:>10}{:>10}".format("target", "options", "time (s)", "MB/s")
+        )
+        for target, dest, dest_format, backing in targets:
+            for label, options in OPTION_SETS:
+                try:
+                    elapsed = min(
+                        convert(source, dest, dest_format, options, backing)
+                        for _ in range(REPEAT)
+                    )
+                except subprocess.CalledProcessError:
+                    print(
+                        "{:<12}{:<20}{:>10}{:>10}".format(target, label, "failed", "")
+                    )
+                    continue
+                print(
+                    "{:<12}{:<20}{:>10.2f}{:>10.0f}".format(
+                        target, label, elapsed, SIZE_MB / elapsed
+                    )
+                )
+    finally:
+        if loop_device is not None:
+            subprocess.run(["losetup", "--detach", loop_device])
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare the ways of copying a raw disk image of a file pool.
+
+Sparse raw images of SIZE_MB are written with a part of their blocks filled,
+then copied with a reflink, with copy_file_range and with sendfile over the
+data segments, and with qemu-img convert. The time of each copy and the
+space allocated to the copy are printed; a method the file system, the
+kernel or the host does not support is reported as n/a.
+
+Run it with: python3 benchmarks/bench_fastcopy.py [directory]
+The directory should be on the file system of the pool.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(1, ROOT)
+
+from ovm.utils import fastcopy  # noqa
+
+
+SIZE_MB = 512
+BLOCK = 1024**2
+FILL_RATIOS = (0, 10, 50, 100)
+METHODS = ("reflink",) + fastcopy.COPY_METHODS + ("qemu-img",)
+
+
+def write_image(path, ratio):
+    """Fill ratio percent of the blocks of the image, spread over the file"""
+    step = 100 / ratio if ratio else None
+    with open(path, "wb") as fd:
+        fd.truncate(SIZE_MB * BLOCK)
+        if step is None:
+            return
+        position = 0.0
+        while position < SIZE_MB:
+            fd.seek(int(position) * BLOCK)
+            fd.write(os.urandom(BLOCK))
+            position += step
+        fd.flush()
+        os.fsync(fd.fileno())
+
+
+def copy(method, source, dest):
+    """Copy the source with the method, False when it is not supported"""
+    if method == "qemu-img":
+        if shutil.which("qemu-img") is None:
+            return False
+        args = ["qemu-img", "convert", "-f", "raw", "-O", "raw", source, dest]
+        subprocess.run(args, check=True)
+        return True
+
+    with open(source, "rb") as src, open(dest, "r+b") as dst:
+        try:
+            if method == "reflink":
+                fastcopy.reflink(src.fileno(), dst.fileno())
+            elif hasattr(os, method):
+                fastcopy.copy_sparse(src.fileno(), dst.fileno(), method)
+            else:
+                return False
+        except OSError as err:
+            if err.errno not in fastcopy.UNSUPPORTED:
+                raise
+            return False
+    return True
+
+
+def main():
+    directory = tempfile.mkdtemp(dir=sys.argv[1] if len(sys.argv) > 1 else None)
+    source = os.path.join(directory, "source.raw")
+    dest = os.path.join(directory, "dest.raw")
+    print(
+        "{:>5}  {:<16}{:>10}{:>14}".format("fill", "method", "time (s)", "allocated MB")
+    )
+    try:
+        for ratio in FILL_RATIOS:
+            write_image(source, ratio)
+            for method in METHODS:
+                open(dest, "wb").close()
+                start = time.perf_counter()
+                supported = copy(method, source, dest)
+                elapsed = time.perf_counter() - start
+                if supported:
+                    allocated = os.stat(dest).st_blocks * 512 / BLOCK
+                    result = "{:>10.3f}{:>14.1f}".format(elapsed, allocated)
+                else:
+                    result = "{:>10}{:>14}".format("n/a", "n/a")
+                print("{:>4}%  {:<16}{}".format(ratio, method, result))
+                os.remove(dest)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
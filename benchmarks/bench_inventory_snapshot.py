@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare the per-domain queries of vm ls with the bulk inventory snapshot.
+
+A fake libvirt connection with N domains counts the RPCs and simulates the
+latency of the libvirt socket. The snapshot is also run with a watched
+inventory cache.
+
+Run it with: python3 benchmarks/bench_inventory_snapshot.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(1, ROOT)
+
+
+import libvirt  # noqa
+
+from ovm.configuration import Configuration  # noqa
+from ovm.inventory import Inventory  # noqa
+from ovm.inventory.cache import InventoryCache  # noqa
+from ovm.lvconnect import LibvirtConnect  # noqa
+
+
+SIZES = (10, 100, 400)
+RPC_LATENCY = 0.0002
+
+DOMAIN_XML = """<domain type="kvm">
+  <name>{name}</name>
+  <memory unit="KiB">1048576</memory>
+  <currentMemory unit="KiB">524288</currentMemory>
+  <vcpu>2</vcpu>
+  <metadata>
+    <ovm:metadata xmlns:ovm="uri://ovm">
+      <ovm:entry name="os_name" value="Debian"/>
+    </ovm:metadata>
+  </metadata>
+  <devices/>
+</domain>"""
+
+METADATA_XML = """<metadata>
+  <entry name="os_name" value="Debian"/>
+  <entry name="ipv4_addr" value="10.0.0.{num}"/>
+</metadata>"""
+
+
+class FakeDomain:
+    def __init__(self, connection, num):
+        self._connection = connection
+        self._num = num
+        self._name = "vm-%04d" % num
+        self.active = num % 2 == 0
+        self.autostart_enabled = num % 3 == 0
+
+    def _rpc(self):
+        self._connection.rpc()
+
+    def name(self):
+        return self._name
+
+    def UUIDString(self):
+        return "00000000-0000-0000-0000-%012d" % self._num
+
+    def isActive(self):
+        self._rpc()
+        return self.active
+
+    def state(self):
+        self._rpc()
+        return [libvirt.VIR_DOMAIN_RUNNING if self.active else 5, 0]
+
+    def autostart(self):
+        self._rpc()
+        return self.autostart_enabled
+
+    def metadata(self, *args):
+        self._rpc()
+        return METADATA_XML.format(num=self._num % 250)
+
+    def XMLDesc(self, flags=0):
+        self._rpc()
+        return DOMAIN_XML.format(name=self._name)
+
+    def stats(self):
+        return {
+            "state.state": libvirt.VIR_DOMAIN_RUNNING if self.active else 5,
+            "vcpu.current": 2,
+            "vcpu.maximum": 2,
+            "balloon.current": 524288,
+            "balloon.maximum": 1048576,
+        }
+
+
+class FakeConnection:
+    def __init__(self, count):
+        self.rpc_count = 0
+        self._domains = [FakeDomain(self, i) for i in range(count)]
+
+    def rpc(self):
+        self.rpc_count += 1
+        time.sleep(RPC_LATENCY)
+
+    def listAllDomains(self, flags=0):
+        self.rpc()
+        domains = self._domains
+        if flags & libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE:
+            domains = [d for d in domains if d.active]
+        if flags & libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE:
+            domains = [d for d in domains if not d.active]
+        if flags & libvirt.VIR_CONNECT_LIST_DOMAINS_AUTOSTART:
+            domains = [d for d in domains if d.autostart_enabled]
+        return domains
+
+    def getAllDomainStats(self, stats=0, flags=0):
+        self.rpc()
+        return [(d, d.stats()) for d in self._domains]
+
+
+def collect(domains):
+    rows = []
+    for domain in domains:
+        domain.is_active()
+        rows.append(
+            (
+                domain.get_name(),
+                domain.get_vcpu_count(),
+                domain.get_current_memory(),
+                domain.get_autostart(),
+                domain.get_state_text(),
+                domain.get_main_ipv4(),
+                domain.get_os_string(),
+            )
+        )
+    return rows
+
+
+def run(name, func, count, cached=False):
+    connection = FakeConnection(count)
+    LibvirtConnect._conn = connection
+
+    if cached:
+        cache = InventoryCache(Configuration.INVENTORY_CACHE)
+        cache.refresh()
+        cache.save()
+        cache.heartbeat()
+        connection.rpc_count = 0
+
+    start = time.perf_counter()
+    rows = collect(func())
+    elapsed = time.perf_counter() - start
+
+    assert len(rows) == count
+    print(
+        "{:<10} N={:<5} {:>9.1f} ms  {:>6} RPCs".format(
+            name, count, elapsed * 1000, connection.rpc_count
+        )
+    )
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        Configuration.SAVED_VMS = tmpdir
+        Configuration.INVENTORY_CACHE = os.path.join(tmpdir, "inventory-cache.json")
+        for count in SIZES:
+            run("per-domain", Inventory.get_domains, count)
+            run("snapshot", Inventory.get_snapshot, count)
+            run("cached", Inventory.get_snapshot, count, cached=True)
+            InventoryCache(Configuration.INVENTORY_CACHE).clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare the cost per allocation of hold_ip and hold_ips.
+
+The parallel run shares the hold_ip allocations between PROCESSES processes
+holding the lock of the database in turn.
+
+Run it with: python3 benchmarks/bench_ip_allocation.py
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(1, ROOT)
+
+
+from ovm.configuration import Configuration  # noqa
+from ovm.drivers.network.bridge import BridgeDriver  # noqa
+from ovm.resources.network import Network  # noqa
+
+
+SIZES = (10, 100, 1000, 10000)
+SINGLE_MAX = 1000
+PROCESSES = 8
+
+
+def new_network():
+    pool = {"ip_start": "10.0.0.1", "ip_end": "10.0.255.254"}
+    return Network("bench", BridgeDriver, ipv4_pool=pool, ipv4_allocation="static")
+
+
+def bench_single(network, count):
+    start = time.perf_counter()
+    for i in range(count):
+        network.new_ipv4_allocation().hold_ip("vm-%d" % i)
+    return time.perf_counter() - start
+
+
+def bench_bulk(network, count):
+    start = time.perf_counter()
+    network.new_ipv4_allocation().hold_ips(["vm-%d" % i for i in range(count)])
+    return time.perf_counter() - start
+
+
+def _allocate(path, count, start, done):
+    Configuration.IP_DATABASE = path
+    network = new_network()
+    start.wait()
+    for i in range(count):
+        network.new_ipv4_allocation().hold_ip("vm-%d-%d" % (os.getpid(), i))
+    done.put(count)
+
+
+def bench_parallel(network, count):
+    ctx = multiprocessing.get_context("fork")
+    start, done = ctx.Event(), ctx.Queue()
+    # The first workers take the remainder of the division
+    counts = [count // PROCESSES + (i < count % PROCESSES) for i in range(PROCESSES)]
+    workers = [
+        ctx.Process(target=_allocate, args=(Configuration.IP_DATABASE, n, start, done))
+        for n in counts
+    ]
+    for worker in workers:
+        worker.start()
+
+    begin = time.perf_counter()
+    start.set()
+    for _ in workers:
+        done.get()
+    elapsed = time.perf_counter() - begin
+    for worker in workers:
+        worker.join()
+    return elapsed
+
+
+def run(name, func, count):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        Configuration.IP_DATABASE = os.path.join(tmpdir, "ipdatabase.db")
+        elapsed = func(new_network(), count)
+    print(
+        "{:<8} N={:<6} total={:>9.3f} ms  per allocation={:>8.1f} us".format(
+            name, count, elapsed * 1000, elapsed * 10**6 / count
+        )
+    )
+
+
+def main():
+    for count in SIZES:
+        if count <= SINGLE_MAX:
+            run("hold_ip", bench_single, count)
+            run("parallel", bench_parallel, count)
+        run("hold_ips", bench_bulk, count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Measure the startup of the vm command.
+
+The import of the CLI is measured with python -X importtime, and the whole
+run of "vm --help" with the wall clock. The best of REPEAT runs is kept.
+The script fails when the import takes more than IMPORT_BUDGET_MS or when a
+module only needed by some commands is imported.
+
+Run it with: python3 benchmarks/bench_startup.py
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+REPEAT = 10
+IMPORT_BUDGET_MS = 50
+HEAVY_MODULES = (
+    "curses",
+    "termios",
+    "sqlite3",
+    "yaml",
+    "libvirt",
+    "http.server",
+    "ovm.vmcli.management",
+)
+
+
+def run(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [sys.executable] + args, env=env, cwd=ROOT, capture_output=True, text=True
+    )
+
+
+def import_times():
+    """Return the self and cumulative import time of each module, in ms"""
+    result = run(["-X", "importtime", "-c", "import ovm.vmcli.__main__"])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+    return times
+
+
+def main():
+    runs = [import_times() for _ in range(REPEAT)]
+    best = min(runs, key=lambda times: times["ovm.vmcli.__main__"][1])
+    import_ms = best["ovm.vmcli.__main__"][1]
+
+    help_ms = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        run(["-m", "ovm.vmcli", "--help"])
+        help_ms.append((time.perf_counter() - start) * 1000)
+
+    print("Slowest modules (self time):")
+    slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)
+    for name, (self_ms, cumulative_ms) in slowest[:10]:
+        print("  {:<40} {:>7.2f} ms {:>7.2f} ms".format(name, self_ms, cumulative_ms))
+
+    print("import ovm.vmcli.__main__ {:>7.2f} ms".format(import_ms))
+    print("vm --help                 {:>7.2f} ms".format(min(help_ms)))
+
+    errors = []
+    if import_ms > IMPORT_BUDGET_MS:
+        errors.append("the import is over the budget of %d ms" % IMPORT_BUDGET_MS)
+    for name in HEAVY_MODULES:
+        if name in best:
+            errors.append("%s is imported at startup" % name)
+
+    for error in errors:
+        print("FAIL: " + error)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
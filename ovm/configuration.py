@@ -20,3 +20,7 @@ class Configuration:
 
     SAVED_VMS = os.path.join(VAR, "saved-vms")
     IP_DATABASE = os.path.join(VAR, "ipdatabase.db")
+    INVENTORY_CACHE = os.path.join(VAR, "inventory-cache.json")
+    TEMPLATES_CACHE = os.path.join(VAR, "templates-cache.pickle")
+    COMPLETION_INDEX = os.path.join(VAR, "completion-index")
+    DAEMON_SOCKET = os.path.join(VAR, "ovmd.sock")
@@ -5,7 +5,11 @@ import os.path
 from subprocess import PIPE
 
 from ovm.drivers.storage.generic import StorageDriver
+from ovm.drivers.storage.image_cache import ImageCache
 from ovm.exceptions import DriverError
+from ovm.templates.image_template import get_convert_args
+from ovm.templates.image_template import get_default_convert_options
+from ovm.utils.fastcopy import clone_file
 from ovm.utils.logger import logger
 from ovm.utils.compat23 import Popen, etree
 
@@ -14,9 +18,11 @@ __all__ = ["FileDriver"]
 
 
 class FileDriver(StorageDriver):
+    CLONE_MODES = ("copy", "overlay")
+
     def __init__(self):
         super(FileDriver, self).__init__()
-        self._params = {"disk_format": "qcow2"}
+        self._params = {"disk_format": "qcow2", "clone_mode": "copy"}
 
     def set_params(self, **params):
         if "disk_format" in params:
@@ -25,8 +31,44 @@ class FileDriver(StorageDriver):
                 raise DriverError("Disk format not supported")
             params["disk_format"] = disk_format
 
+        if "clone_mode" in params:
+            clone_mode = str(params["clone_mode"])
+            if clone_mode not in FileDriver.CLONE_MODES:
+                raise DriverError("Clone mode not supported")
+            params["clone_mode"] = clone_mode
+
+        if "cache_size" in params:
+            try:
+                params["cache_size"] = float(params["cache_size"])
+            except ValueError:
+                raise DriverError("The cache size must be a number of GB")
+
+        merged = dict(self._params, **params)
+        if merged["clone_mode"] == "overlay" and merged["disk_format"] != "qcow2":
+            raise DriverError("Overlays need the qcow2 disk format")
+
         super(FileDriver, self).set_params(**params)
 
+    def get_image_cache(self):
+        """Cache of the converted images, for overlays or when it has a size"""
+        if self._params["clone_mode"] != "overlay" and "cache_size" not in self._params:
+            return None
+        size_limit = int(self._params.get("cache_size", 0) * 1024**3)
+        disk_format = self._params["disk_format"]
+        return ImageCache(
+            self._params.get("root"),
+            disk_format,
+            size_limit,
+            self._params.get("convert_options"),
+        )
+
+    @staticmethod
+    def _qemu_img(*args):
+        with Popen(("qemu-img",) + args, stdout=PIPE, stderr=PIPE) as process:
+            process.wait()
+            if process.returncode != 0:
+                raise DriverError(process.stderr.read().decode("utf-8"))
+
     def generate_xml(self, disk):
         disktree = etree.Element("disk")
         disktree.set("type", "file")
@@ -46,24 +88,76 @@ class FileDriver(StorageDriver):
         if not os.path.exists(disk.path):
             raise DriverError('Path "{0}" does not exists'.format(disk.path))
 
-        args = ["qemu-img", "resize", disk.path, "{}G".format(new_size)]
-        with Popen(args, stdout=PIPE, stderr=PIPE) as process:
-            process.wait()
-            if process.returncode != 0:
-                raise DriverError(process.stderr.read().decode("utf-8"))
+        self._qemu_img("resize", disk.path, "{}G".format(new_size))
 
     def import_image(self, image, name):
         path = os.path.join(self._params.get("root"), name)
+        cache = self.get_image_cache()
+        if self._params["clone_mode"] == "overlay":
+            self._create_overlay(cache, image, path)
+            return path
+
         try:
             fd = open(path, "w+")
         finally:
             fd.close()
-        image.copy_on_device(path, self._params["disk_format"])
+
+        disk_format = self._params["disk_format"]
+        if cache is not None:
+            # Kept while copied, other processes may evict it meanwhile
+            cached = cache.acquire(image, overlay=path)
+            try:
+                self._clone(cached, disk_format, path)
+            finally:
+                cache.release(path)
+        elif image.format == disk_format:
+            self._clone(image.path, disk_format, path)
+        else:
+            image.copy_on_device(path, disk_format, self._params.get("convert_options"))
         return path
 
+    def _clone(self, source, disk_format, dest):
+        """Copy a disk of the same format, sharing its extents when possible
+
+        qemu-img, the last resort, is given the convert_options of the pool.
+        """
+        method = clone_file(source, dest)
+        if method is None:
+            method = "qemu-img"
+            options = get_default_convert_options(dest, disk_format)
+            options.update(self._params.get("convert_options") or {})
+            args = ["convert", "-f", disk_format, "-O", disk_format]
+            args += get_convert_args(options, False)
+            self._qemu_img(*(args + [source, dest]))
+        logger.debug('Copy "%s" to "%s" with %s.', source, dest, method)
+
+    def _create_overlay(self, cache, image, path):
+        base = cache.acquire(image, overlay=path)
+        logger.debug('Create the overlay "%s" of "%s".', path, base)
+        try:
+            self._qemu_img("create", "-f", "qcow2", "-F", "qcow2", "-b", base, path)
+        except DriverError:
+            cache.release(path)
+            raise
+
+    def flatten_disk(self, disk):
+        cache = self.get_image_cache()
+        if cache is None or cache.get_entry_path(disk.path) is None:
+            return False
+
+        # Without a backing file, rebase copies the data of the base
+        logger.debug('Flatten the overlay "%s".', disk.path)
+        self._qemu_img("rebase", "-f", "qcow2", "-b", "", disk.path)
+        cache.release(disk.path)
+        return True
+
     def remove_disk(self, disk):
         logger.debug('Trying to remove disk "%s".', disk.path)
         try:
             os.remove(disk.path)
         except OSError as err:
             raise DriverError('Cannot remove disk "{}": {}'.format(disk.path, err))
+
+        cache = self.get_image_cache()
+        if cache is not None:
+            cache.release(disk.path)
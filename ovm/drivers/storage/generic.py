@@ -5,9 +5,23 @@ import os
 from abc import abstractmethod
 
 from ovm.drivers.driver import Driver
+from ovm.exceptions import DriverError, OVMError
+from ovm.templates.image_template import check_convert_options
 
 
 class StorageDriver(Driver):
+    def set_params(self, **params):
+        # Checked with the pool, rather than when a disk is written
+        if "convert_options" in params:
+            try:
+                params["convert_options"] = check_convert_options(
+                    params["convert_options"] or {}
+                )
+            except OVMError as err:
+                raise DriverError(err.message)
+
+        super(StorageDriver, self).set_params(**params)
+
     @abstractmethod
     def generate_xml(self, disk):
         pass
@@ -24,6 +38,14 @@ class StorageDriver(Driver):
     def import_image(self, image, name):
         pass
 
+    def get_image_cache(self):
+        """Return the cache of the converted images of the pool, or None"""
+        return None
+
+    def flatten_disk(self, disk):
+        """Detach the disk from its base image, return False if it has none"""
+        return False
+
     def disk_real_size(self, disk):
         """Get the file size by seeking at end"""
         try:
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from ovm.exceptions import DriverError
+from ovm.utils.logger import logger
+
+
+__all__ = ["ImageCache"]
+
+
+class ImageCache:
+    """Template images of a pool, converted once to the format of its disks
+
+    An entry is keyed by the path, the mtime and the size of the image and by
+    the format of the disks. Entries are read-only: new disks are copied from
+    them, or are overlays backed by them. An entry is never evicted while
+    overlays use it; the others are evicted, least recently used first, once
+    the cache is over its size limit.
+
+    The index of the entries is updated under a lock, since VMs may be
+    created and removed by several processes at the same time.
+    """
+
+    DIRECTORY = ".image-cache"
+    VERSION = 1
+
+    def __init__(self, root, target_format, size_limit=0, convert_options=None):
+        self.directory = os.path.join(root, self.DIRECTORY)
+        self.target_format = target_format
+        self.size_limit = size_limit
+        self.convert_options = convert_options
+        self._index_path = os.path.join(self.directory, "index.json")
+        self._lock_path = os.path.join(self.directory, ".lock")
+
+    def get_name(self, image):
+        stat = os.stat(image.path)
+        key = "{}:{}:{}:{}".format(
+            os.path.abspath(image.path),
+            stat.st_mtime_ns,
+            stat.st_size,
+            self.target_format,
+        )
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(image.path))[0]
+        return "{}-{}.{}".format(stem, digest, self.target_format)
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self, operation):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    @contextmanager
+    def _entries(self):
+        """Give the entries of the cache, saved at the end of the block"""
+        with self._locked(fcntl.LOCK_EX):
+            entries = self._read()
+            yield entries
+            self._write(entries)
+
+    def _read(self):
+        try:
+            with open(self._index_path) as fd:
+                content = json.load(fd)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            raise DriverError("Cannot read the image cache index: %s" % err)
+
+        if content.get("version") != self.VERSION:
+            raise DriverError("Unknown version of %s." % self._index_path)
+        return content["entries"]
+
+    def _write(self, entries):
+        content = {"version": self.VERSION, "entries": entries}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".index-")
+        try:
+            with os.fdopen(fd, "w") as tmp:
+                json.dump(content, tmp, indent=2, sort_keys=True)
+            os.replace(tmp_path, self._index_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get_entries(self):
+        """Map the name of each entry to its image, size, users and last use"""
+        with self._locked(fcntl.LOCK_SH):
+            return self._read()
+
+    def acquire(self, image, overlay=None):
+        """Return the path of the entry of the image, converted if needed
+
+        When an overlay, or a disk being copied from the entry, is given, the
+        entry is kept until it is released.
+        """
+        name = self.get_name(image)
+        path = self.get_path(name)
+        with self._entries() as entries:
+            if self._use(entries, name, overlay):
+                return path
+
+        # Converted without the lock, which the other disks of the pool need
+        tmp_path = self._convert(image)
+        try:
+            with self._entries() as entries:
+                if not self._use(entries, name, overlay):
+                    os.replace(tmp_path, path)
+                    entries[name] = {
+                        "image": image.path,
+                        "size": self._get_size(path),
+                        "users": [],
+                    }
+                    self._use(entries, name, overlay)
+        finally:
+            # Left when another process converted the image meanwhile
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def _use(self, entries, name, overlay):
+        """Mark the entry as used, return False if it does not exist"""
+        entry = entries.get(name)
+        if entry is None or not os.path.exists(self.get_path(name)):
+            return False
+
+        entry["last_used"] = time.time()
+        if overlay is not None and overlay not in entry["users"]:
+            entry["users"].append(overlay)
+        self._evict(entries, self.size_limit, keep=name)
+        return True
+
+    def release(self, overlay):
+        """Forget the overlay, its entry may then be evicted"""
+        with self._entries() as entries:
+            for entry in entries.values():
+                if overlay in entry["users"]:
+                    entry["users"].remove(overlay)
+            self._evict(entries, self.size_limit)
+
+    def get_entry_path(self, overlay):
+        """Return the path of the entry used by the overlay, or None"""
+        for name, entry in self.get_entries().items():
+            if overlay in entry["users"]:
+                return self.get_path(name)
+        return None
+
+    def purge(self):
+        """Remove all the entries no overlay uses, return their names"""
+        with self._entries() as entries:
+            return self._evict(entries, 0)
+
+    def _evict(self, entries, size_limit, keep=None):
+        total = sum(entry["size"] for entry in entries.values())
+        unused = [
+            (entry["last_used"], name)
+            for name, entry in entries.items()
+            if not entry["users"] and name != keep
+        ]
+
+        evicted = []
+        for _, name in sorted(unused):
+            if total <= size_limit:
+                break
+            logger.debug('Evict "%s" from the image cache.', name)
+            try:
+                os.remove(self.get_path(name))
+            except FileNotFoundError:
+                pass
+            total -= entries.pop(name)["size"]
+            evicted.append(name)
+        return evicted
+
+    def _convert(self, image):
+        """Convert the image into a read-only temporary file of the cache"""
+        logger.info('Convert "%s" into the image cache.', image.path)
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".image-")
+        os.close(fd)
+        try:
+            image.copy_on_device(tmp_path, self.target_format, self.convert_options)
+            os.chmod(tmp_path, 0o444)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    @staticmethod
+    def _get_size(path):
+        # Space really used, entries may be sparse
+        return os.stat(path).st_blocks * 512
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
 import os.path
+import re
 from subprocess import PIPE
 
 from ovm.drivers.storage.generic import StorageDriver
@@ -19,18 +21,37 @@ class LvmDriver(StorageDriver):
     def __init__(self):
         super(LvmDriver, self).__init__()
 
-    def _create_logical_volume(self, name, size):
-        size = "{}G".format(size)
-        vgname = self._params.get("volume_group")
+    @staticmethod
+    def _lvm(*args):
+        with Popen(args, stdout=PIPE, stderr=PIPE) as process:
+            stdout, stderr = process.communicate()
+            if process.returncode != 0:
+                raise DriverError(stderr.decode("utf-8"))
+        return stdout.decode("utf-8")
 
+    def _get_volume_group(self):
+        vgname = self._params.get("volume_group")
         if not vgname:
-            DriverError("Volume Groupe not set.")
+            raise DriverError("Volume Groupe not set.")
+        return vgname
 
-        args = ["lvcreate", "--size", size, "--name", str(name), vgname]
-        with Popen(args, stdout=PIPE, stderr=PIPE) as process:
-            process.wait()
-            if process.returncode != 0:
-                DriverError(process.stderr.read().decode("utf-8"))
+    def _create_logical_volume(self, name, size):
+        size = "{}G".format(size)
+        vgname = self._get_volume_group()
+        thin_pool = self._params.get("thin_pool")
+
+        if thin_pool:
+            self._lvm(
+                "lvcreate",
+                "--thin",
+                "--virtualsize",
+                size,
+                "--name",
+                str(name),
+                "{}/{}".format(vgname, thin_pool),
+            )
+        else:
+            self._lvm("lvcreate", "--size", size, "--name", str(name), vgname)
 
     def generate_xml(self, disk):
         disktree = etree.Element("disk")
@@ -48,27 +69,245 @@ class LvmDriver(StorageDriver):
         return disktree
 
     def resize_disk(self, disk, new_size):
-        args = ["lvresize", "--size", "{}G".format(new_size), disk.path]
-        with Popen(args, stdout=PIPE, stderr=PIPE) as process:
-            process.wait()
-            if process.returncode != 0:
-                DriverError(process.stderr.read().decode("utf-8"))
+        self._lvm("lvresize", "--size", "{}G".format(new_size), disk.path)
 
     def import_image(self, image, name):
         path = os.path.join(self._params.get("root"), name)
+
+        volumes = self.get_image_cache()
+        if volumes is not None:
+            golden = os.path.basename(volumes.acquire(image))
+            logger.debug('Create the snapshot "%s" of "%s".', name, golden)
+            self._lvm(
+                "lvcreate",
+                "--snapshot",
+                "--setactivationskip",
+                "n",
+                "--permission",
+                "rw",
+                "--name",
+                str(name),
+                "{}/{}".format(self._get_volume_group(), golden),
+            )
+            return path
+
         self._create_logical_volume(name, image.size)
 
         if not os.path.exists(path):
             raise DriverError("Volume group not created.")
 
-        image.copy_on_device(path, LvmDriver.DISK_FORMAT)
+        image.copy_on_device(
+            path, LvmDriver.DISK_FORMAT, self._params.get("convert_options")
+        )
 
         return path
 
+    def get_image_cache(self):
+        """Golden volumes of the template images, for thin pools"""
+        if not self._params.get("thin_pool"):
+            return None
+        return GoldenVolumes(self)
+
     def remove_disk(self, disk):
         logger.debug('Trying to remove disk "%s".', disk.path)
-        args = ["lvremove", "--force", disk.path]
-        with Popen(args, stdout=PIPE, stderr=PIPE) as process:
-            process.wait()
-            if process.returncode != 0:
-                DriverError(process.stderr.read().decode("utf-8"))
+        volumes = self.get_image_cache()
+        origin = volumes.get_origin(disk.path) if volumes is not None else None
+        self._lvm("lvremove", "--force", disk.path)
+        if origin:
+            # The golden LV is no longer needed if its image changed since
+            volumes.remove_stale(origin)
+
+    def disk_real_size(self, disk):
+        """Get the space allocated in the thin pool, else the size of the LV"""
+        if not self._params.get("thin_pool"):
+            return super(LvmDriver, self).disk_real_size(disk)
+
+        try:
+            output = self._lvm(
+                "lvs",
+                "--noheadings",
+                "--nosuffix",
+                "--units",
+                "b",
+                "--options",
+                "lv_size,data_percent",
+                disk.path,
+            )
+            size, percent = output.split()
+            return int(int(size) * float(percent) / 100)
+        except (DriverError, OSError, ValueError):
+            # Thick LV in a thin pool, or no such LV
+            return super(LvmDriver, self).disk_real_size(disk)
+
+
+class GoldenVolumes:
+    """Template images written once in read-only thin LVs of a pool
+
+    The disks of new VMs are thin snapshots of the golden LV of their image,
+    which is named after the path, the mtime and the size of the image and
+    tagged with its path. A golden LV no snapshot uses is removed once its
+    image changed, and by purge.
+    """
+
+    PREFIX = "ovm-golden-"
+    TAG_PREFIX = "ovm_image:"
+    REPORT_FIELDS = "lv_name,origin,lv_size,data_percent,lv_tags,lv_time"
+
+    def __init__(self, driver):
+        self._driver = driver
+        self._root = driver._params.get("root")
+        self._vgname = driver._get_volume_group()
+
+    def get_name(self, path):
+        """Name of the golden LV of the image, changed with the image"""
+        stat = os.stat(path)
+        key = "{}:{}:{}".format(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(path))[0]
+        stem = re.sub(r"[^a-zA-Z0-9+_.-]", "_", stem)
+        return "{}{}-{}".format(self.PREFIX, stem, digest)
+
+    def get_path(self, name):
+        return os.path.join(self._root, name)
+
+    def _report(self):
+        """Return the name, origin, allocated size, tags and time of the LVs"""
+        output = self._driver._lvm(
+            "lvs",
+            "--noheadings",
+            "--nosuffix",
+            "--units",
+            "b",
+            "--separator",
+            "|",
+            "--config",
+            'report/time_format="%s"',
+            "--options",
+            self.REPORT_FIELDS,
+            self._vgname,
+        )
+        volumes = []
+        for line in output.splitlines():
+            fields = line.strip().split("|")
+            if len(fields) != 6:
+                continue
+            name, origin, size, percent, tags, created = fields
+            try:
+                size = int(int(size) * float(percent or 100) / 100)
+                created = int(created)
+            except ValueError:
+                size, created = 0, 0
+            volumes.append((name, origin, size, tags.split(","), created))
+        return volumes
+
+    def get_entries(self):
+        """Map the name of each golden LV to its image, size, users and time"""
+        volumes = self._report()
+        entries = {}
+        for name, _, size, tags, created in volumes:
+            if not name.startswith(self.PREFIX) or ".tmp" in name:
+                continue
+            images = [
+                t[len(self.TAG_PREFIX) :] for t in tags if t.startswith(self.TAG_PREFIX)
+            ]
+            entries[name] = {
+                "image": images[0] if images else "",
+                "size": size,
+                "users": [v[0] for v in volumes if v[1] == name],
+                "last_used": created,
+            }
+        return entries
+
+    def get_origin(self, path):
+        """Return the name of the golden LV the disk is a snapshot of"""
+        try:
+            output = self._driver._lvm(
+                "lvs", "--noheadings", "--options", "origin", path
+            )
+        except DriverError:
+            return None
+        origin = output.strip()
+        return origin if origin.startswith(self.PREFIX) else None
+
+    def _exists(self, name):
+        try:
+            self._driver._lvm("lvs", "{}/{}".format(self._vgname, name))
+        except DriverError:
+            return False
+        return True
+
+    def acquire(self, image, overlay=None):
+        """Return the path of the golden LV of the image, written if needed"""
+        name = self.get_name(image.path)
+        if not self._exists(name):
+            self._create(image, name)
+            self.remove_stale(image_path=image.path)
+        return self.get_path(name)
+
+    def _create(self, image, name):
+        # Built under a temporary name, another process may build it too
+        tmp_name = "{}.tmp{}".format(name, os.getpid())
+        tmp_path = self.get_path(tmp_name)
+        driver = self._driver
+
+        logger.info('Write "%s" in the golden volume "%s".', image.path, name)
+        driver._create_logical_volume(tmp_name, image.size)
+
+        # The blocks of a new thin LV are read as zeros
+        options = {"target_is_zero": True}
+        options.update(driver._params.get("convert_options") or {})
+        try:
+            image.copy_on_device(tmp_path, LvmDriver.DISK_FORMAT, options)
+            driver._lvm("lvchange", "--permission", "r", tmp_path)
+            tag = self.TAG_PREFIX + os.path.abspath(image.path)
+            if re.match(r"^[A-Za-z0-9_+./=!:#&-]+$", tag):
+                driver._lvm("lvchange", "--addtag", tag, tmp_path)
+        except BaseException:
+            self._remove_quietly(tmp_path)
+            raise
+
+        try:
+            driver._lvm("lvrename", self._vgname, tmp_name, name)
+        except DriverError:
+            self._remove_quietly(tmp_path)
+            if not self._exists(name):
+                raise
+
+    def _remove_quietly(self, path):
+        # Keep the error which made the volume useless
+        try:
+            self._driver._lvm("lvremove", "--force", path)
+        except DriverError as err:
+            logger.warning('Cannot remove "%s": %s', path, err)
+
+    def remove_stale(self, name=None, image_path=None):
+        """Remove the unused golden LVs of an image which changed since
+
+        The image is the one of the golden LV name, or the one at image_path.
+        """
+        removed = []
+        for entry_name, entry in self.get_entries().items():
+            if entry["users"] or not entry["image"]:
+                continue
+            if name is not None and entry_name != name:
+                continue
+            if image_path is not None and entry["image"] != os.path.abspath(image_path):
+                continue
+            try:
+                current = self.get_name(entry["image"])
+            except OSError:
+                current = None
+            if entry_name != current:
+                logger.debug('Remove the stale golden volume "%s".', entry_name)
+                self._driver._lvm("lvremove", "--force", self.get_path(entry_name))
+                removed.append(entry_name)
+        return removed
+
+    def purge(self):
+        """Remove all the golden LVs no disk is a snapshot of"""
+        removed = []
+        for name, entry in sorted(self.get_entries().items()):
+            if not entry["users"]:
+                self._driver._lvm("lvremove", "--force", self.get_path(name))
+                removed.append(name)
+        return removed
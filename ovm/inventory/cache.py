@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import libvirt
+
+from ovm.configuration import Configuration
+from ovm.inventory.domain import Domain
+from ovm.lvconnect import LibvirtConnect
+from ovm.utils.logger import logger
+
+
+__all__ = ["InventoryCache", "InventoryWatcher"]
+
+
+class InventoryCache:
+    """Facts about the domains kept on disk between two invocations
+
+    Entries are keyed by the domain UUID and hold the hash of the inactive
+    and of the live XML they were parsed from. While an InventoryWatcher
+    keeps the cache up to date, entries are trusted as is. Otherwise, each
+    entry is checked against the hash of the current XML, which costs two
+    calls to libvirt but no parsing; the XML is then kept by the Domain
+    returned by get_domain.
+
+    Processes only write the entries they changed, merged under a lock into
+    the file, and leave it to the watcher while one is running.
+
+    The cache is optional: it is only used once its file exists.
+    """
+
+    VERSION = 3
+    HEARTBEAT_TIMEOUT = 30
+
+    def __init__(self, path):
+        self.path = path
+        self.heartbeat_path = path + ".watch"
+        self._lock_path = path + ".lock"
+        # Set by the InventoryWatcher owning the cache
+        self.watching = False
+        self._entries = {}
+        self._updated = set()
+        self._removed = set()
+        self._rebuilt = False
+        self._dirty = False
+        self._watched = self._check_heartbeat()
+        self._entries = self._read()
+
+    @classmethod
+    def open(cls):
+        """Return the cache if it is enabled, None otherwise"""
+        path = Configuration.INVENTORY_CACHE
+        if not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def _read(self):
+        try:
+            with open(self.path) as fd:
+                content = json.load(fd)
+        except (OSError, ValueError) as err:
+            logger.debug("Ignore the inventory cache: %s", err)
+            return {}
+
+        if isinstance(content, dict) and content.get("version") == self.VERSION:
+            return content.get("domains", {})
+        return {}
+
+    def _check_heartbeat(self):
+        try:
+            mtime = os.path.getmtime(self.heartbeat_path)
+        except OSError:
+            return False
+        return time.time() - mtime < self.HEARTBEAT_TIMEOUT
+
+    def is_watched(self):
+        return self._watched
+
+    def heartbeat(self):
+        """Tell the other processes that the cache is being watched"""
+        with open(self.heartbeat_path, "a"):
+            os.utime(self.heartbeat_path)
+        self._watched = True
+
+    @staticmethod
+    def _get_descs(vir_domain):
+        """Return the inactive and the live XML of the domain
+
+        The live XML of a stopped domain is its configuration: it is read
+        anyway, rather than asking libvirt if the domain is running.
+        """
+        xml = vir_domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
+        return xml, vir_domain.XMLDesc()
+
+    @staticmethod
+    def _hash(xml, lived_xml):
+        digest = hashlib.sha1(xml.encode("utf-8"))
+        if lived_xml is not None:
+            digest.update(lived_xml.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_facts(self, vir_domain):
+        return self._lookup(vir_domain)[0]
+
+    def get_domain(self, vir_domain):
+        """Return the Domain built from the facts and the XML read to check them"""
+        facts, descs = self._lookup(vir_domain)
+        return Domain(vir_domain, facts, *descs)
+
+    def _lookup(self, vir_domain):
+        """Return the facts of the domain, and the XML read to get them"""
+        uuid = vir_domain.UUIDString()
+        entry = self._entries.get(uuid)
+        if entry is not None and self._watched:
+            return entry["facts"], (None, None)
+
+        descs = self._get_descs(vir_domain)
+        if entry is not None and entry["xml_hash"] == self._hash(*descs):
+            return entry["facts"], descs
+
+        return self._store(vir_domain, *descs), descs
+
+    def update(self, vir_domain):
+        """Parse again the domain, whatever the state of its entry"""
+        return self._store(vir_domain, *self._get_descs(vir_domain))
+
+    def _store(self, vir_domain, xml, lived_xml):
+        domain = Domain(vir_domain, saved_desc=xml, lived_desc=lived_xml)
+        facts = domain.get_facts()
+        uuid = facts["uuid"]
+        self._entries[uuid] = {"xml_hash": self._hash(xml, lived_xml), "facts": facts}
+        self._updated.add(uuid)
+        self._removed.discard(uuid)
+        self._dirty = True
+        return facts
+
+    def remove(self, uuid):
+        if self._entries.pop(uuid, None) is not None:
+            self._removed.add(uuid)
+            self._updated.discard(uuid)
+            self._dirty = True
+
+    def refresh(self, connection=None):
+        """Rebuild the entries of all the domains and forget the others"""
+        if connection is None:
+            connection = LibvirtConnect.get_connection()
+
+        uuids = set()
+        for vir_domain in connection.listAllDomains():
+            uuids.add(self.update(vir_domain)["uuid"])
+
+        for uuid in set(self._entries) - uuids:
+            self.remove(uuid)
+
+        # Replace the file, even if there is no domain to enable the cache
+        self._rebuilt = True
+        self._dirty = True
+
+    def clear(self):
+        for path in (self.path, self.heartbeat_path, self._lock_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._entries = {}
+        self._updated.clear()
+        self._removed.clear()
+        self._dirty = False
+
+    def save(self):
+        """Merge the entries changed by this process into the file"""
+        if not self._dirty:
+            return
+
+        try:
+            with open(self._lock_path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not self.watching and self._check_heartbeat():
+                    # The watcher keeps the file up to date, with fresher
+                    # entries than the ones read by this process
+                    logger.debug("Leave the inventory cache to the watcher.")
+                else:
+                    self._write()
+        except OSError as err:
+            logger.debug("Cannot save the inventory cache: %s", err)
+            return
+
+        self._updated.clear()
+        self._removed.clear()
+        self._rebuilt = False
+        self._dirty = False
+
+    def _write(self):
+        entries = {} if self._rebuilt else self._read()
+        for uuid in self._removed:
+            entries.pop(uuid, None)
+        for uuid in self._updated:
+            entries[uuid] = self._entries[uuid]
+
+        content = {"version": self.VERSION, "domains": entries}
+        directory = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".inventory-")
+        try:
+            with os.fdopen(fd, "w") as tmp:
+                json.dump(content, tmp)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+
+
+class InventoryWatcher:
+    """Keep the inventory cache and the completion index fresh from libvirt"""
+
+    HEARTBEAT_INTERVAL = 10
+
+    EVENTS = (
+        libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+        libvirt.VIR_DOMAIN_EVENT_ID_METADATA_CHANGE,
+        libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED,
+        libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED,
+    )
+
+    def __init__(self, cache, index=None):
+        self.cache = cache
+        # The CompletionIndex of the names completed by the shell, if any
+        self.index = index
+        # The connection whose events are followed
+        self._connection = None
+
+    def run(self):
+        # The event loop must be registered before opening the connection
+        libvirt.virEventRegisterDefaultImpl()
+        self.start(LibvirtConnect.get_connection())
+
+        logger.info("Watching the libvirt events to update the inventory cache.")
+        self.loop()
+
+    def start(self, connection):
+        """Refresh the cache and follow the events of the connection
+
+        The default event loop must have been registered before opening the
+        connection, and must be run by the caller.
+        """
+        self.cache.watching = True
+        self._follow(connection)
+        libvirt.virEventAddTimeout(
+            self.HEARTBEAT_INTERVAL * 1000, self._on_timeout, None
+        )
+
+    def _follow(self, connection):
+        self.cache.refresh(connection)
+        self._commit()
+        self._update_index(connection)
+
+        for event_id in self.EVENTS:
+            if event_id == libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE:
+                callback = self._on_lifecycle
+            else:
+                callback = self._on_change
+            connection.domainEventRegisterAny(None, event_id, callback, None)
+        self._connection = connection
+
+    def _is_following(self):
+        """Tell if the events of the live connection to libvirt are followed"""
+        connection = self._connection
+        return LibvirtConnect.is_current(connection) and LibvirtConnect.is_alive(
+            connection
+        )
+
+    def _reconnect(self):
+        """Follow a new connection, after libvirtd was restarted
+
+        The connection may have been replaced already by another user of
+        LibvirtConnect. On failure, the next heartbeat tries again.
+        """
+        LibvirtConnect.reset(self._connection)
+        self._connection = None
+        try:
+            connection = LibvirtConnect.get_connection()
+        except libvirt.libvirtError as err:
+            logger.debug("Cannot reconnect to libvirt: %s", err)
+            return
+        try:
+            self._follow(connection)
+        except libvirt.libvirtError as err:
+            logger.debug("Cannot follow the events of libvirt: %s", err)
+            # Some events may be registered already: start from a new one
+            LibvirtConnect.reset(connection)
+            return
+        logger.info("Reconnected to libvirt.")
+
+    @staticmethod
+    def loop():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    def _commit(self):
+        self.cache.save()
+        self.cache.heartbeat()
+
+    def _update_index(self, connection):
+        if self.index is None:
+            return
+        try:
+            domains = self.index.list_domains(connection)
+        except libvirt.libvirtError as err:
+            logger.debug("Cannot list the domains: %s", err)
+            return
+        self.index.set_domains(domains, watched=True)
+        self.index.save()
+
+    def _on_lifecycle(self, connection, vir_domain, event, detail, opaque):
+        if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            self.cache.remove(vir_domain.UUIDString())
+            self._commit()
+        else:
+            self._on_change(connection, vir_domain)
+        self._update_index(connection)
+
+    def _on_change(self, connection, vir_domain, *args):
+        try:
+            self.cache.update(vir_domain)
+        except libvirt.libvirtError as err:
+            # The domain may have been undefined in the meantime
+            logger.debug("Cannot update %s: %s", vir_domain.name(), err)
+            self.cache.remove(vir_domain.UUIDString())
+        self._commit()
+
+    def _on_timeout(self, timer, opaque):
+        if not self._is_following():
+            # No heartbeat until the events are followed again: the other
+            # processes stop trusting the cache in the meantime
+            self._reconnect()
+            return
+        self.cache.heartbeat()
+        if self.index is not None:
+            self.index.heartbeat()
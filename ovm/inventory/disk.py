@@ -76,6 +76,9 @@ class Disk:
     def remove(self):
         self._driver.remove_disk(self)
 
+    def flatten(self):
+        return self._driver.flatten_disk(self)
+
     @property
     def size(self):
         return self._driver.disk_real_size(self)
@@ -8,7 +8,6 @@ from ovm.configuration import Configuration
 from ovm.exceptions import DomainException, DriverError
 from ovm.inventory.disk import Disk
 from ovm.inventory.domain_metadata import DomainMetadata
-from ovm.inventory.ip_allocation import IpAllocation
 from ovm.inventory.network_interface import NetworkInterface
 from ovm.lvconnect import LibvirtConnect
 from ovm.utils.compat23 import etree
@@ -18,22 +17,88 @@ from ovm.utils.logger import logger
 class Domain:
     STATES = {1: "Running", 3: "Paused", 5: "Stopped"}
 
-    def __init__(self, vir_domain):
+    def __init__(self, vir_domain, facts=None, saved_desc=None, lived_desc=None):
         self.vir_domain = vir_domain
         self._cached_metadata = None
+        self._cached_saved_tree = None
+        self._cached_lived_tree = None
+        self._cached_facts = facts
         self._libvirt_conn = LibvirtConnect.get_connection()
 
-        saved_desc = self.vir_domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
-        self._saved_tree = etree.fromstring(saved_desc)
-        lived_desc = self.vir_domain.XMLDesc()
-        self._lived_tree = etree.fromstring(lived_desc)
+        if saved_desc is not None:
+            self._cached_saved_tree = etree.fromstring(saved_desc)
+        if lived_desc is not None:
+            self._cached_lived_tree = etree.fromstring(lived_desc)
+
+    @property
+    def _saved_tree(self):
+        if self._cached_saved_tree is None:
+            saved_desc = self.vir_domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
+            self._cached_saved_tree = etree.fromstring(saved_desc)
+        return self._cached_saved_tree
+
+    @property
+    def _lived_tree(self):
+        if self._cached_lived_tree is None:
+            lived_desc = self.vir_domain.XMLDesc()
+            self._cached_lived_tree = etree.fromstring(lived_desc)
+        return self._cached_lived_tree
 
     @property
     def metadata(self):
         if not self._cached_metadata:
-            self._cached_metadata = DomainMetadata(self.vir_domain)
+            entries = None
+            if self._cached_facts is not None:
+                entries = self._cached_facts["metadata"]
+            self._cached_metadata = DomainMetadata(self.vir_domain, entries)
         return self._cached_metadata
 
+    def get_facts(self):
+        """Return the configuration of the domain as plain data
+
+        The devices of a running domain are the live ones, which include the
+        hot-plugged disks and interfaces. When the domain was built from
+        cached facts, they are returned as is.
+        """
+        if self._cached_facts is not None:
+            return self._cached_facts
+
+        tree = self._saved_tree
+        if self.is_active():
+            devices = self._lived_tree.find("devices")
+        else:
+            devices = tree.find("devices")
+
+        metadata = {}
+        root = tree.find("metadata/{%s}metadata" % DomainMetadata.NAMESPACE)
+        if root is not None:
+            for entry in root:
+                if entry.get("name") is not None:
+                    metadata[entry.get("name")] = entry.get("value")
+
+        disks = []
+        interfaces = []
+        displays = []
+        for device in devices if devices is not None else ():
+            if device.tag == "disk" and device.get("device") == "disk":
+                disks.append(etree.tostring(device).decode("utf-8"))
+            elif device.tag == "interface" and device.get("type") == "bridge":
+                interfaces.append(etree.tostring(device).decode("utf-8"))
+            elif device.tag == "graphics" and device.get("type") == "vnc":
+                displays.append(device)
+
+        return {
+            "name": self.get_name(),
+            "uuid": self.vir_domain.UUIDString(),
+            "vcpu": int(tree.find("vcpu").text),
+            "memory": self._mem_extract_value(tree.find("memory")),
+            "current_memory": self._mem_extract_value(tree.find("currentMemory")),
+            "metadata": metadata,
+            "disks": disks,
+            "interfaces": interfaces,
+            "vnc_port": self._get_vnc_port(displays),
+        }
+
     def is_active(self):
         return self.vir_domain.isActive()
 
@@ -50,7 +115,9 @@ class Domain:
         if snapshots:
             raise DomainException(
                 'The VM "{0}" cannot be removed. \
-                Delete snapshots first.'.format(self.get_name())
+                Delete snapshots first.'.format(
+                    self.get_name()
+                )
             )
 
         if self.vir_domain.isActive():
@@ -62,6 +129,8 @@ class Domain:
             except DriverError as e:
                 logger.warning(e)
 
+        from ovm.inventory.ip_allocation import IpAllocation
+
         IpAllocation.remove_domain(self.get_name())
 
         self.remove_save()
@@ -132,24 +201,31 @@ class Domain:
             return "Unknown (%d)" % num
 
     def get_vcpu_count(self):
+        if self._cached_facts is not None:
+            return self._cached_facts["vcpu"]
         vcpu = self._saved_tree.find("vcpu")
         return int(vcpu.text)
 
     def get_vnc_info(self):
-        vncport = None
-
+        if self._cached_facts is not None:
+            return dict(port=self._cached_facts["vnc_port"])
         devices = list(self.find_device("graphics", type="vnc"))
+        return dict(port=self._get_vnc_port(devices))
+
+    @staticmethod
+    def _get_vnc_port(devices):
+        vncport = None
 
-        if devices > 0:
+        if devices:
             vncport = devices[0].attrib.get("port")
 
         if vncport is not None:
             vncport = int(vncport)
+            # -1 until a running domain is given its port
+            if vncport < 0:
+                vncport = None
 
-        if vncport < 0:
-            vncport = None
-
-        return dict(port=vncport)
+        return vncport
 
     def get_autostart(self):
         return self.vir_domain.autostart()
@@ -158,10 +234,14 @@ class Domain:
         self.vir_domain.setAutostart(bool(boolean))
 
     def get_memory(self):
+        if self._cached_facts is not None:
+            return self._cached_facts["memory"]
         memory = self._saved_tree.find("memory")
         return self._mem_extract_value(memory)
 
     def get_current_memory(self):
+        if self._cached_facts is not None:
+            return self._cached_facts["current_memory"]
         memory = self._saved_tree.find("currentMemory")
         return self._mem_extract_value(memory)
 
@@ -180,16 +260,18 @@ class Domain:
                     yield device
 
     def get_interfaces(self):
-        interfaces = []
-        for iface in self.find_device("interface", type="bridge"):
-            interfaces.append(NetworkInterface(iface))
-        return interfaces
+        if self._cached_facts is not None:
+            xmldefs = map(etree.fromstring, self._cached_facts["interfaces"])
+        else:
+            xmldefs = self.find_device("interface", type="bridge")
+        return [NetworkInterface(iface) for iface in xmldefs]
 
     def get_disks(self):
-        disks = []
-        for disk in self.find_device("disk", device="disk"):
-            disks.append(Disk(xmldef=disk))
-        return disks
+        if self._cached_facts is not None:
+            xmldefs = map(etree.fromstring, self._cached_facts["disks"])
+        else:
+            xmldefs = self.find_device("disk", device="disk")
+        return [Disk(xmldef=disk) for disk in xmldefs]
 
     def get_os_info(self):
         # os-type : linux/windows/bsd/...
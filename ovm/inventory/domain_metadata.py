@@ -6,14 +6,20 @@ import xml.etree.ElementTree as ET
 
 
 class DomainMetadata:
-    def __init__(self, domain):
+    NAMESPACE = "uri://ovm"
+
+    def __init__(self, domain, entries=None):
         self._metadata = {}
         self._domain = domain
 
+        if entries is not None:
+            self._metadata.update(entries)
+            return
+
         try:
             xml = domain.metadata(
                 libvirt.VIR_DOMAIN_METADATA_ELEMENT,
-                "uri://ovm",
+                self.NAMESPACE,
                 libvirt.VIR_DOMAIN_XML_INACTIVE,
             )
         except libvirt.libvirtError:
@@ -64,6 +70,6 @@ class DomainMetadata:
             libvirt.VIR_DOMAIN_METADATA_ELEMENT,
             xml,
             "ovm",
-            "uri://ovm",
+            self.NAMESPACE,
             libvirt.VIR_DOMAIN_XML_INACTIVE,
         )
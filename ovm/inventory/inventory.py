@@ -1,11 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import libvirt
+
+from ovm.inventory.cache import InventoryCache
 from ovm.inventory.domain import Domain
+from ovm.inventory.snapshot import InventorySnapshot
 from ovm.lvconnect import LibvirtConnect
 
 
 class Inventory:
+    @classmethod
+    def get_domain_names(cls, active=False, inactive=False):
+        """Return the names of the domains without building Domain objects"""
+        flags = 0
+        if active:
+            flags |= libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE
+        if inactive:
+            flags |= libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE
+
+        connection = LibvirtConnect.get_connection()
+        return [domain.name() for domain in connection.listAllDomains(flags)]
+
     @classmethod
     def get_domains(cls):
         connection = LibvirtConnect.get_connection()
@@ -13,10 +29,29 @@ class Inventory:
             yield Domain(domain)
 
     @classmethod
-    def get_domain(cls, name):
+    def get_snapshot(cls, active=False, inactive=False, workers=1):
+        """Return the domains with their state gathered in bulk"""
+        return InventorySnapshot(
+            active, inactive, cache=InventoryCache.open(), workers=workers
+        )
+
+    @classmethod
+    def get_domain(cls, name, cached=False):
+        """Return the domain named name
+
+        With cached, its configuration may come from the inventory cache: use
+        it only to read the domain.
+        """
         connection = LibvirtConnect.get_connection()
         domain = connection.lookupByName(name)
-        return Domain(domain)
+
+        cache = InventoryCache.open() if cached else None
+        if cache is None:
+            return Domain(domain)
+
+        domain = cache.get_domain(domain)
+        cache.save()
+        return domain
 
     @classmethod
     def add_domain(cls, domain):
@@ -3,8 +3,9 @@
 
 import sqlite3
 
-from ovm.configuration import Configuration
 from ovm.exceptions import OVMError
+from ovm.inventory.ip_database import IpDatabase
+from ovm.inventory.ip_index import FreeIpIndex
 from ovm.utils.logger import logger
 
 
@@ -16,18 +17,31 @@ def is_ipv4_valid(ip):
     return len(ip) == 4
 
 
+def ip_to_int(ip):
+    if not is_ipv4_valid(ip):
+        raise ValueError("Bad IP address")
+    value = 0
+    for byte in ip.split("."):
+        value = (value << 8) | int(byte)
+    return value
+
+
+def int_to_ip(value):
+    return ".".join([str(value >> (8 * i) & 255) for i in range(3, -1, -1)])
+
+
 def iprange(a, b):
-    if not is_ipv4_valid(a) or not is_ipv4_valid(b):
-        raise ValueError("Bap IP address")
-    a = int("".join(["{0:08b}".format(int(i)) for i in a.split(".")]), 2)
-    b = int("".join(["{0:08b}".format(int(i)) for i in b.split(".")]), 2)
+    a = ip_to_int(a)
+    b = ip_to_int(b)
     if a > b:
         raise ValueError("Invalid range")
     for ip in range(a, b + 1):
-        yield ".".join([str(ip >> (8 * i) & 255) for i in range(3, -1, -1)])
+        yield int_to_ip(ip)
 
 
 class IpAllocation:
+    ALLOCATION_RETRIES = 5
+
     def __init__(self, network):
         self.address = None
         self.domain = None
@@ -36,21 +50,35 @@ class IpAllocation:
         if network:
             self.pool = network.ipv4_pool
 
-        self._connection = self.get_connection()
+    @property
+    def _connection(self):
+        return IpDatabase.get_connection()
 
-    def __del__(self):
-        if self._connection:
-            self._connection.close()
+    def _get_index(self, cur=None):
+        start = ip_to_int(self.pool["ip_start"])
+        end = ip_to_int(self.pool["ip_end"])
 
-    def _get_used_ips(self):
-        cur = self._connection.cursor()
-        cur.execute("SELECT address FROM ipv4 WHERE network=?", (self._network.name,))
-        return [e[0] for e in cur.fetchall()]
+        if cur is None:
+            cur = self._connection.cursor()
+        cur.execute(
+            "SELECT address_int FROM ipv4 WHERE network=? "
+            "AND address_int BETWEEN ? AND ? ORDER BY address_int",
+            (self._network.name, start, end),
+        )
+        return FreeIpIndex(start, end, [e[0] for e in cur])
+
+    def _insert(self, cur, allocations):
+        cur.executemany(
+            "INSERT INTO ipv4(domain, network, address, address_int) "
+            "VALUES(?,?,?,?)",
+            [(d, self._network.name, a, ip_to_int(a)) for d, a in allocations],
+        )
 
     def get_allocations(self):
         cur = self._connection.cursor()
         cur.execute(
-            "SELECT domain, address FROM ipv4 WHERE network=?", (self._network.name,)
+            "SELECT domain, address FROM ipv4 WHERE network=? ORDER BY address_int",
+            (self._network.name,),
         )
         for domain, address in cur:
             alloc = IpAllocation(self._network)
@@ -60,98 +88,133 @@ class IpAllocation:
 
     @staticmethod
     def remove_domain(domain):
-        alloc = IpAllocation(None)
-        cur = alloc._connection.cursor()
-        cur.execute("DELETE FROM ipv4 WHERE domain=?", (domain,))
-        alloc._connection.commit()
+        with IpDatabase.transaction() as cur:
+            cur.execute("DELETE FROM ipv4 WHERE domain=?", (domain,))
 
     def remove_allocation(self, address):
-        cur = self._connection.cursor()
-        cur.execute(
-            "DELETE FROM ipv4 WHERE network=? AND address=?",
-            (self._network.name, address),
-        )
-        self._connection.commit()
+        with IpDatabase.transaction() as cur:
+            cur.execute(
+                "DELETE FROM ipv4 WHERE network=? AND address=?",
+                (self._network.name, address),
+            )
 
     @staticmethod
     def get_connection():
-        logger.debug("Connect to the IP database (%s)", Configuration.IP_DATABASE)
-        connection = sqlite3.connect(Configuration.IP_DATABASE)
-        cur = connection.cursor()
-        cur.execute(
-            "CREATE TABLE IF NOT EXISTS ipv4 "
-            "(domain text, network text, address text)"
-        )
-        connection.commit()
-        return connection
+        return IpDatabase.get_connection()
 
-    def new_ip(self):
-        used_ips = self._get_used_ips()
-        ipstart = self.pool["ip_start"]
-        ipend = self.pool["ip_end"]
-        for ip in iprange(ipstart, ipend):
-            if ip not in used_ips:
-                return ip
+    def new_ip(self, index=None):
+        if index is None:
+            index = self._get_index()
 
-        raise OVMError("No IPs available in your IP pool")
+        value = index.first_free()
+        if value is None:
+            raise OVMError("No IPs available in your IP pool")
+        return int_to_ip(value)
 
-    def check_ip(self, address):
+    def check_ip(self, address, index=None):
         if not is_ipv4_valid(address):
             raise OVMError('The IP address "{}" is not valid.'.format(address))
 
-        if address not in iprange(self.pool["ip_start"], self.pool["ip_end"]):
-            raise OVMError("This IP is not in " "the defined range".format(address))
+        if index is None:
+            index = self._get_index()
+
+        value = ip_to_int(address)
+        if not index.in_range(value):
+            raise OVMError(
+                'The IP address "{}" is not in the defined range.'.format(address)
+            )
 
-        if address in self._get_used_ips():
+        if value in index:
             raise OVMError(
                 'The IP address "{}" has ' "already been attributed".format(address)
             )
 
     def hold_ip(self, domain, address=None):
-        if address:
-            self.check_ip(address)
+        # The write lock is taken before reading the used addresses, so two
+        # processes cannot pick the same one. The UNIQUE constraint is still
+        # there for writers which do not take it: retry on conflicts.
+        for _ in range(self.ALLOCATION_RETRIES):
+            try:
+                with IpDatabase.transaction("IMMEDIATE") as cur:
+                    index = self._get_index(cur)
+                    if address:
+                        self.check_ip(address, index)
+                        new_address = int_to_ip(ip_to_int(address))
+                    else:
+                        new_address = self.new_ip(index)
+
+                    self._insert(cur, [(domain, new_address)])
+            except sqlite3.IntegrityError:
+                if address:
+                    raise OVMError(
+                        'The IP address "{}" has '
+                        "already been attributed".format(address)
+                    )
+                logger.debug('Conflict on "%s", retrying', new_address)
+            else:
+                break
         else:
-            address = self.new_ip()
+            raise OVMError("Cannot allocate an IP: too many concurrent allocations")
 
-        self.address = address
-
-        cur = self._connection.cursor()
-        cur.execute(
-            "INSERT INTO ipv4(domain, network, address) VALUES(?,?,?)",
-            (domain, self._network.name, self.address),
-        )
-        self._connection.commit()
+        self.address = new_address
 
         logger.debug("New allocation saved: %s -> %s", domain, self.address)
 
+    def hold_ips(self, domains):
+        """Allocate a new address for each domain in a single transaction
+
+        Return the list of allocations, in the same order as domains.
+        """
+        for _ in range(self.ALLOCATION_RETRIES):
+            allocations = []
+            try:
+                with IpDatabase.transaction("IMMEDIATE") as cur:
+                    index = self._get_index(cur)
+
+                    for domain in domains:
+                        value = index.take()
+                        if value is None:
+                            raise OVMError("No IPs available in your IP pool")
+
+                        alloc = IpAllocation(self._network)
+                        alloc.address = int_to_ip(value)
+                        alloc.domain = domain
+                        allocations.append(alloc)
+
+                    self._insert(cur, [(a.domain, a.address) for a in allocations])
+            except sqlite3.IntegrityError:
+                logger.debug("Conflict on a bulk allocation, retrying")
+            else:
+                break
+        else:
+            raise OVMError("Cannot allocate IPs: too many concurrent allocations")
+
+        logger.debug("%d new allocations saved", len(allocations))
+        return allocations
+
     def release_ips(self, domain):
-        cur = self._connection.cursor()
-        cur.execute(
-            "DELETE FROM ipv4 WHERE network=? AND domain=?",
-            (self._network.name, domain),
-        )
-        self._connection.commit()
+        with IpDatabase.transaction() as cur:
+            cur.execute(
+                "DELETE FROM ipv4 WHERE network=? AND domain=?",
+                (self._network.name, domain),
+            )
 
         logger.debug('Release IP allocation for domain "%s"', domain)
 
     @staticmethod
     def flush_network(network):
-        connection = IpAllocation.get_connection()
-        cur = connection.cursor()
-        cur.execute("DELETE FROM ipv4 WHERE network=?", (network,))
-        connection.commit()
-        connection.close()
+        with IpDatabase.transaction() as cur:
+            cur.execute("DELETE FROM ipv4 WHERE network=?", (network,))
 
     def remove(self):
         if not self.address:
             return
 
-        cur = self._connection.cursor()
-        cur.execute(
-            "DELETE FROM ipv4 WHERE network=? AND address=?",
-            (self._network.name, self.address),
-        )
-        self._connection.commit()
+        with IpDatabase.transaction() as cur:
+            cur.execute(
+                "DELETE FROM ipv4 WHERE network=? AND address=?",
+                (self._network.name, self.address),
+            )
 
         logger.debug(
             'Realease IP "%s" from network "%s"', self.address, self._network.name
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from ovm.configuration import Configuration
+from ovm.utils.logger import logger
+
+
+__all__ = ["IpDatabase"]
+
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS ipv4 ("
+    "domain text NOT NULL, "
+    "network text NOT NULL, "
+    "address text NOT NULL, "
+    "address_int integer NOT NULL, "
+    "UNIQUE (network, address))",
+    "CREATE INDEX IF NOT EXISTS ipv4_network_address_int "
+    "ON ipv4 (network, address_int)",
+    "CREATE INDEX IF NOT EXISTS ipv4_domain ON ipv4 (domain)",
+)
+
+
+class IpDatabase:
+    """Connections to the IP database shared in the process
+
+    Each thread gets its own connection, opened once and reused by all the
+    allocations. Connections are not inherited by forked processes.
+    """
+
+    SCHEMA_VERSION = 1
+    TIMEOUT = 30
+
+    _local = threading.local()
+
+    @classmethod
+    def get_connection(cls):
+        path = Configuration.IP_DATABASE
+        local = cls._local
+        if getattr(local, "key", None) == (os.getpid(), path):
+            return local.connection
+
+        logger.debug("Connect to the IP database (%s)", path)
+        connection = sqlite3.connect(path, timeout=cls.TIMEOUT, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        cls._upgrade(connection)
+
+        local.connection = connection
+        local.key = (os.getpid(), path)
+        return connection
+
+    @classmethod
+    @contextmanager
+    def transaction(cls, mode="DEFERRED"):
+        """Run the statements of the block in one transaction"""
+        connection = cls.get_connection()
+        connection.execute("BEGIN %s" % mode)
+        try:
+            yield connection.cursor()
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+
+    @classmethod
+    def _upgrade(cls, connection):
+        if cls._get_version(connection) == cls.SCHEMA_VERSION:
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have done the job while we were waiting
+            if cls._get_version(connection) != cls.SCHEMA_VERSION:
+                cls._migrate(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+
+    @staticmethod
+    def _get_version(connection):
+        return connection.execute("PRAGMA user_version").fetchone()[0]
+
+    @classmethod
+    def _migrate(cls, connection):
+        from ovm.inventory.ip_allocation import int_to_ip, ip_to_int, is_ipv4_valid
+
+        cur = connection.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ipv4'")
+        legacy = cur.fetchone() is not None
+
+        if legacy:
+            logger.debug("Migrate the IP database to schema %d", cls.SCHEMA_VERSION)
+            cur.execute("ALTER TABLE ipv4 RENAME TO ipv4_legacy")
+
+        for statement in SCHEMA:
+            cur.execute(statement)
+
+        if legacy:
+            cur.execute("SELECT domain, network, address FROM ipv4_legacy")
+            for domain, network, address in cur.fetchall():
+                if not is_ipv4_valid(str(address)):
+                    logger.warning('Drop the invalid allocation "%s".', address)
+                    continue
+
+                value = ip_to_int(address)
+                address = int_to_ip(value)
+                inserted = connection.execute(
+                    "INSERT OR IGNORE INTO ipv4(domain, network, address, address_int) "
+                    "VALUES(?,?,?,?)",
+                    (domain, network, address, value),
+                ).rowcount
+                if not inserted:
+                    logger.warning(
+                        'Drop the duplicated allocation of "%s" on "%s" for "%s".',
+                        address,
+                        network,
+                        domain,
+                    )
+            cur.execute("DROP TABLE ipv4_legacy")
+
+        cur.execute("PRAGMA user_version=%d" % cls.SCHEMA_VERSION)
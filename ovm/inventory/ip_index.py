@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_right
+
+
+__all__ = ["FreeIpIndex"]
+
+
+class FreeIpIndex:
+    """Index of the free addresses of an IPv4 pool.
+
+    Addresses are integer-encoded. The used ones are kept as sorted and
+    disjoint intervals, so lookups are done by bisection and the first free
+    address never requires to walk the pool.
+    """
+
+    def __init__(self, start, end, used=()):
+        if start > end:
+            raise ValueError("Invalid range")
+
+        self.start = start
+        self.end = end
+
+        # Bounds of the used intervals, both inclusive
+        self._starts = []
+        self._ends = []
+
+        for value in sorted(used):
+            if not self.start <= value <= self.end:
+                continue
+            if self._ends and value <= self._ends[-1] + 1:
+                self._ends[-1] = max(self._ends[-1], value)
+            else:
+                self._starts.append(value)
+                self._ends.append(value)
+
+    def __contains__(self, value):
+        return self.is_used(value)
+
+    def _find(self, value):
+        """Return the position of the interval which may contain value"""
+        return bisect_right(self._starts, value) - 1
+
+    def in_range(self, value):
+        return self.start <= value <= self.end
+
+    def is_used(self, value):
+        i = self._find(value)
+        return i >= 0 and value <= self._ends[i]
+
+    def used_count(self):
+        return sum(e - s + 1 for s, e in zip(self._starts, self._ends))
+
+    def free_count(self):
+        return self.end - self.start + 1 - self.used_count()
+
+    def first_free(self):
+        """Return the lowest free address or None if the pool is full"""
+        if not self._starts or self._starts[0] > self.start:
+            return self.start
+
+        # Intervals are merged, the first one ends just before a hole
+        value = self._ends[0] + 1
+        if value > self.end:
+            return None
+        return value
+
+    def add(self, value):
+        if not self.in_range(value):
+            raise ValueError("Address out of range")
+
+        i = self._find(value)
+        if i >= 0 and value <= self._ends[i]:
+            return
+
+        join_left = i >= 0 and self._ends[i] == value - 1
+        join_right = i + 1 < len(self._starts) and self._starts[i + 1] == value + 1
+
+        if join_left and join_right:
+            self._ends[i] = self._ends[i + 1]
+            del self._starts[i + 1]
+            del self._ends[i + 1]
+        elif join_left:
+            self._ends[i] = value
+        elif join_right:
+            self._starts[i + 1] = value
+        else:
+            self._starts.insert(i + 1, value)
+            self._ends.insert(i + 1, value)
+
+    def remove(self, value):
+        i = self._find(value)
+        if i < 0 or value > self._ends[i]:
+            return
+
+        start, end = self._starts[i], self._ends[i]
+        if start == end:
+            del self._starts[i]
+            del self._ends[i]
+        elif value == start:
+            self._starts[i] = value + 1
+        elif value == end:
+            self._ends[i] = value - 1
+        else:
+            self._ends[i] = value - 1
+            self._starts.insert(i + 1, value + 1)
+            self._ends.insert(i + 1, end)
+
+    def take(self):
+        """Mark the lowest free address as used and return it"""
+        value = self.first_free()
+        if value is not None:
+            self.add(value)
+        return value
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import libvirt
+
+from ovm.configuration import Configuration
+from ovm.inventory.domain import Domain
+from ovm.lvconnect import LibvirtConnect
+
+
+__all__ = ["InventorySnapshot", "DomainSnapshot"]
+
+
+class DomainSnapshot(Domain):
+    """Domain whose state, vCPU, memory and autostart come from a snapshot
+
+    These values are read when the snapshot is taken and are not refreshed
+    afterwards. Other properties are fetched from libvirt on demand.
+    """
+
+    def __init__(self, vir_domain, stats, active, autostart, saved, facts=None):
+        super(DomainSnapshot, self).__init__(vir_domain, facts)
+        self._name = vir_domain.name()
+        self._stats = stats
+        self._active = active
+        self._autostart = autostart
+        self._saved = saved
+
+    def get_name(self):
+        return self._name
+
+    def is_active(self):
+        return self._active
+
+    def is_saved(self):
+        return self._saved
+
+    def get_autostart(self):
+        return self._autostart
+
+    def _get_libvirt_state(self):
+        return self._stats.get("state.state", libvirt.VIR_DOMAIN_NOSTATE)
+
+    def get_vcpu_count(self):
+        if "vcpu.maximum" in self._stats:
+            return self._stats["vcpu.maximum"]
+        return super(DomainSnapshot, self).get_vcpu_count()
+
+    def get_memory(self):
+        if "balloon.maximum" in self._stats:
+            return self._stats["balloon.maximum"] * 1024
+        return super(DomainSnapshot, self).get_memory()
+
+    def get_current_memory(self):
+        if "balloon.current" in self._stats:
+            return self._stats["balloon.current"] * 1024
+        return super(DomainSnapshot, self).get_current_memory()
+
+
+class InventorySnapshot:
+    """State of all the domains gathered in a few bulk calls
+
+    One getAllDomainStats call gives the state, vCPU and memory of all the
+    domains, two listAllDomains calls the active and autostarted ones and a
+    single directory listing the saved ones. When an inventory cache is
+    given, the other facts of the domains come from it.
+    """
+
+    STATS = (
+        libvirt.VIR_DOMAIN_STATS_STATE
+        | libvirt.VIR_DOMAIN_STATS_BALLOON
+        | libvirt.VIR_DOMAIN_STATS_VCPU
+    )
+
+    def __init__(
+        self, active=False, inactive=False, connection=None, cache=None, workers=1
+    ):
+        if connection is None:
+            connection = LibvirtConnect.get_connection()
+
+        flags = 0
+        if active:
+            flags |= libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE
+        if inactive:
+            flags |= libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_INACTIVE
+
+        active_names = self._list_names(
+            connection, libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE
+        )
+        autostart_names = self._list_names(
+            connection, libvirt.VIR_CONNECT_LIST_DOMAINS_AUTOSTART
+        )
+        try:
+            saved_names = set(os.listdir(Configuration.SAVED_VMS))
+        except OSError:
+            saved_names = set()
+
+        all_stats = connection.getAllDomainStats(self.STATS, flags)
+
+        # Checking the cache may cost one call per domain: run them in parallel
+        facts = [None] * len(all_stats)
+        if cache:
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                facts = list(executor.map(cache.get_facts, (d for d, _ in all_stats)))
+            cache.save()
+
+        self.domains = []
+        for (vir_domain, stats), domain_facts in zip(all_stats, facts):
+            name = vir_domain.name()
+            self.domains.append(
+                DomainSnapshot(
+                    vir_domain,
+                    stats,
+                    name in active_names,
+                    name in autostart_names,
+                    name in saved_names,
+                    domain_facts,
+                )
+            )
+
+    def __iter__(self):
+        return iter(self.domains)
+
+    def __len__(self):
+        return len(self.domains)
+
+    @staticmethod
+    def _list_names(connection, flags):
+        return set(domain.name() for domain in connection.listAllDomains(flags))
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import threading
+
 import libvirt
 
 from ovm.utils.logger import logger
@@ -9,10 +11,50 @@ from ovm.utils.logger import logger
 class LibvirtConnect:
     _conn = None
     _connection_string = "qemu:///system"
+    _lock = threading.Lock()
 
     @classmethod
     def get_connection(cls):
-        if cls._conn is None:
-            cls._conn = libvirt.open(cls._connection_string)
-            logger.debug("New connection to libvirt opened.")
-        return cls._conn
+        with cls._lock:
+            if cls._conn is None:
+                cls._conn = libvirt.open(cls._connection_string)
+                logger.debug("New connection to libvirt opened.")
+            return cls._conn
+
+    @classmethod
+    def is_alive(cls, connection=None):
+        """Tell if the connection, by default the opened one, reaches libvirtd
+
+        A connection which was closed raises instead of answering: it is
+        taken as dead.
+        """
+        if connection is None:
+            connection = cls._conn
+            if connection is None:
+                return True
+        try:
+            return bool(connection.isAlive())
+        except libvirt.libvirtError:
+            return False
+
+    @classmethod
+    def is_current(cls, connection):
+        """Tell if the connection is the one given by get_connection"""
+        return connection is not None and connection is cls._conn
+
+    @classmethod
+    def reset(cls, connection=None):
+        """Forget the connection, unless it was replaced by another one
+
+        The next call to get_connection opens a new one, when libvirtd was
+        restarted for example.
+        """
+        with cls._lock:
+            if cls._conn is None or connection not in (None, cls._conn):
+                return
+            connection, cls._conn = cls._conn, None
+        try:
+            connection.close()
+        except libvirt.libvirtError:
+            pass
+        logger.debug("Connection to libvirt closed.")
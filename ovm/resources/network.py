@@ -3,7 +3,6 @@
 
 from ovm.utils.compat23 import etree
 from ovm.exceptions import OVMError
-from ovm.inventory.ip_allocation import IpAllocation
 
 
 ALLOCATION_STATIC, ALLOCATION_DHCP = 0, 1
@@ -31,6 +30,8 @@ class Network:
         self._driver.set_params(**params)
 
     def new_ipv4_allocation(self):
+        from ovm.inventory.ip_allocation import IpAllocation
+
         return IpAllocation(self)
 
     def create_interface(self, template_params):
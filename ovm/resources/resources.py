@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import yaml
-
 from ovm.exceptions import OVMError
 from ovm.drivers.driver_loader import DriverLoader
 from ovm.resources.network import Network
@@ -11,13 +9,24 @@ from ovm.resources.storage_pool import StoragePool
 
 class Resources:
     resources = None
+    _path = None
     _cache = {}
 
     @classmethod
     def __init__(cls, path):
+        # The file is only read by the commands using the resources
+        cls._path = path
+        cls.resources = None
+        cls._cache = {}
+
+    @classmethod
+    def _load(cls):
+        import yaml
+
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
         try:
-            with open(path) as fd:
-                cls.resources = yaml.load(fd)
+            with open(cls._path) as fd:
+                cls.resources = yaml.load(fd, Loader=loader)
         except OSError:
             raise OVMError("Cannot access to resources configuration file.")
 
@@ -35,6 +44,9 @@ class Resources:
         if resource_type in cls._cache:
             return cls._cache[resource_type]
 
+        if cls.resources is None:
+            cls._load()
+
         resources_list = []
 
         dl = DriverLoader(driver_loader_type)
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import stat
 from subprocess import PIPE
 
 from ovm.exceptions import OVMError
@@ -9,33 +10,89 @@ from ovm.utils.compat23 import Popen
 from ovm.utils.copyprogress import CopyProgress
 
 
+# Options of the conversion, and the flag of qemu-img convert setting them
+CONVERT_OPTIONS = {
+    "coroutines": "-m",
+    "out_of_order": "-W",
+    "cache": "-t",
+    "source_cache": "-T",
+    "sparse_size": "-S",
+    "target_is_zero": "--target-is-zero",
+}
+SWITCH_OPTIONS = ("out_of_order", "target_is_zero")
+
+
+def check_convert_options(options):
+    if not isinstance(options, dict):
+        raise OVMError("The conversion options must be a dictionary.")
+    unknown = set(options) - set(CONVERT_OPTIONS)
+    if unknown:
+        raise OVMError(
+            "Unknown conversion options: {}.".format(", ".join(sorted(unknown)))
+        )
+    return dict(options)
+
+
+def get_default_convert_options(dest, dest_format):
+    """Options suited to the destination: a block device, or a raw or qcow2 file"""
+    if stat.S_ISBLK(os.stat(dest).st_mode):
+        # Direct, parallel writes in any order: nothing to keep in order
+        return {"coroutines": 16, "out_of_order": True, "cache": "none"}
+    if dest_format == "raw":
+        return {"coroutines": 16}
+    # qcow2 allocates its clusters in the order of the writes
+    return {}
+
+
+def get_convert_args(options, block_device):
+    args = []
+    for name, value in sorted(check_convert_options(options).items()):
+        flag = CONVERT_OPTIONS[name]
+        if name == "target_is_zero":
+            # Files are created again by qemu-img, so already empty
+            if value and block_device:
+                args += ["-n", flag]
+        elif name in SWITCH_OPTIONS:
+            if value:
+                args.append(flag)
+        elif value is not None:
+            args += [flag, str(value)]
+    return args
+
+
 class ImageTemplate:
     def __init__(self, config):
         self.path = config.get("path")
         self.format = config.get("format")
         self.size = int(config.get("size"))
+        self.convert_options = check_convert_options(
+            config.get("convert_options") or {}
+        )
+
+    def copy_on_device(self, dest, dest_format, options=None):
+        """Convert the image into dest
 
-    def copy_on_device(self, dest, dest_format):
+        The options of the destination are applied over its defaults, then
+        the options of the template over them.
+        """
         if not os.path.exists(dest):
             raise OVMError("copy_on_device: destination must exists.")
 
+        merged = get_default_convert_options(dest, dest_format)
+        merged.update(options or {})
+        merged.update(self.convert_options)
+        block_device = stat.S_ISBLK(os.stat(dest).st_mode)
+
+        args = ["qemu-img", "convert", "-f", str(self.format), "-O", str(dest_format)]
+        args += get_convert_args(merged, block_device)
+        args += [self.path, dest]
+
         cp = CopyProgress(self.path, dest, "Copy image file")
         cp.start()
-
-        args = [
-            "qemu-img",
-            "convert",
-            "-f",
-            str(self.format),
-            "-O",
-            str(dest_format),
-            self.path,
-            dest,
-        ]
-
-        with Popen(args, stderr=PIPE) as process:
-            process.wait()
-            if process.returncode != 0:
-                raise OVMError(process.stderr.read().decode("utf-8"))
-
-        cp.finish()
+        try:
+            with Popen(args, stderr=PIPE) as process:
+                process.wait()
+                if process.returncode != 0:
+                    raise OVMError(process.stderr.read().decode("utf-8"))
+        finally:
+            cp.finish()
@@ -3,15 +3,19 @@
 
 import glob
 import os.path
-import yaml
+import pickle
+import tempfile
 
 from ovm.configuration import Configuration
 from ovm.exceptions import OVMError
 from ovm.templates.image_template import ImageTemplate
+from ovm.utils.logger import logger
 
 
 class Template:
     TEMPLATES_PATH = Configuration.ETC_TEMPLATES
+    CACHE_PATH = Configuration.TEMPLATES_CACHE
+    CACHE_VERSION = 1
     DEFAULT_VCPU = 1
     DEFAULT_MEMORY = 256
     DEFAULT_ABILITIES = {"resizeDisk": False}
@@ -51,24 +55,87 @@ class Template:
     def get_os_version(self):
         return self.metadata.get("os_version")
 
-    @classmethod
-    def load_from_file(cls, path):
+    @staticmethod
+    def _parse(path):
+        # Imported here: yaml is not needed when the catalog is up to date
+        import yaml
+
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
         try:
             with open(path, "r") as fd:
-                config = yaml.load(fd.read())
-                return cls(config)
+                return yaml.load(fd, Loader=loader)
         except IOError as err:
             raise OVMError('Template "{0}" cannot be load: {1}.'.format(path, err))
 
+    @classmethod
+    def load_from_file(cls, path):
+        return cls(cls._parse(path))
+
+    @classmethod
+    def _read_catalog(cls):
+        """Return the parsed templates cached by path, with their mtime and size"""
+        try:
+            with open(cls.CACHE_PATH, "rb") as fd:
+                catalog = pickle.load(fd)
+        except Exception as err:
+            # A damaged pickle may raise almost anything
+            logger.debug("Ignore the templates cache: %s", err)
+            return {}
+
+        if not isinstance(catalog, dict) or catalog.get("version") != cls.CACHE_VERSION:
+            return {}
+        entries = catalog.get("entries")
+        return entries if isinstance(entries, dict) else {}
+
+    @classmethod
+    def _write_catalog(cls, entries):
+        catalog = {"version": cls.CACHE_VERSION, "entries": entries}
+        directory = os.path.dirname(cls.CACHE_PATH)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".templates-")
+        except OSError as err:
+            logger.debug("Cannot save the templates cache: %s", err)
+            return
+
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                pickle.dump(catalog, tmp, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cls.CACHE_PATH)
+        except OSError as err:
+            logger.debug("Cannot save the templates cache: %s", err)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
     @classmethod
     def _load_templates(cls):
-        templates = {}
+        cached = cls._read_catalog()
+
+        # Parse again only the files whose mtime or size changed
+        entries = {}
         for path in glob.iglob(os.path.join(cls.TEMPLATES_PATH, "*.yml")):
-            template = cls.load_from_file(path)
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            key = (stat.st_mtime_ns, stat.st_size)
+            entry = cached.get(path)
+            if entry is None or entry[0] != key:
+                entry = (key, cls._parse(path))
+            entries[path] = entry
+
+        if entries != cached:
+            cls._write_catalog(entries)
+
+        templates = {}
+        for _, config in entries.values():
+            template = cls(config)
             templates[template.uid] = template
 
         cls._templates_cache = templates
 
+    @classmethod
+    def invalidate(cls):
+        """Load the templates again on the next access"""
+        cls._templates_cache = None
+
     @classmethod
     def get_templates(cls):
         if cls._templates_cache is None:
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import errno
+import fcntl
+import os
+import stat
+
+
+__all__ = ["clone_file", "reflink", "copy_sparse", "COPY_METHODS"]
+
+
+# ioctl sharing the extents of a file, from linux/fs.h
+FICLONE = 0x40049409
+
+# Errors telling that a file system or a kernel does not support a method
+UNSUPPORTED = (
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+)
+
+COPY_METHODS = ("copy_file_range", "sendfile")
+
+# Bytes copied by one system call
+CHUNK_SIZE = 64 * 1024**2
+
+
+def reflink(src_fd, dst_fd):
+    """Share the extents of the source, without copying any data"""
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def data_segments(fd, size):
+    """Yield the offset and the length of the data segments of the file"""
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as err:
+            if err.errno == errno.ENXIO:
+                # Only a hole until the end of the file
+                return
+            if err.errno not in UNSUPPORTED:
+                raise
+            # No hole detection: the whole file is data
+            yield offset, size - offset
+            return
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, end - start
+        offset = end
+
+
+def _copy_file_range(src_fd, dst_fd, offset, length):
+    while length > 0:
+        count = os.copy_file_range(
+            src_fd, dst_fd, min(length, CHUNK_SIZE), offset, offset
+        )
+        if count == 0:
+            break
+        offset += count
+        length -= count
+
+
+def _sendfile(src_fd, dst_fd, offset, length):
+    # sendfile writes at the position of the destination
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while length > 0:
+        count = os.sendfile(dst_fd, src_fd, offset, min(length, CHUNK_SIZE))
+        if count == 0:
+            break
+        offset += count
+        length -= count
+
+
+def copy_sparse(src_fd, dst_fd, method):
+    """Copy the data segments of the source in the kernel, keeping the holes"""
+    copy = {"copy_file_range": _copy_file_range, "sendfile": _sendfile}[method]
+    size = os.fstat(src_fd).st_size
+    os.ftruncate(dst_fd, 0)
+    for offset, length in data_segments(src_fd, size):
+        copy(src_fd, dst_fd, offset, length)
+    os.ftruncate(dst_fd, size)
+
+
+def clone_file(source, dest):
+    """Copy the source to the regular file dest, in the fastest way available
+
+    A reflink is tried first, then the in-kernel copies of the data segments.
+    Return the name of the method used, or None when none is supported, the
+    caller must then copy the file itself.
+    """
+    with open(source, "rb") as src, open(dest, "r+b") as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        if not stat.S_ISREG(os.fstat(dst_fd).st_mode):
+            # Holes would leave the old content of a block device
+            return None
+
+        try:
+            reflink(src_fd, dst_fd)
+            return "reflink"
+        except OSError as err:
+            if err.errno not in UNSUPPORTED:
+                raise
+
+        for method in COPY_METHODS:
+            if not hasattr(os, method):
+                continue
+            try:
+                copy_sparse(src_fd, dst_fd, method)
+                return method
+            except OSError as err:
+                if err.errno not in UNSUPPORTED:
+                    raise
+        return None
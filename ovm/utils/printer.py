@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import csv
+import json
+import sys
 from math import log
 
 
 TABLE_PADDING = " " * 3
 
+OUTPUT_FORMATS = ("table", "json", "jsonl", "csv")
+
 
 class bcolors:
     HEADER = "\033[95m"
@@ -87,6 +92,61 @@ def print_table(headers, rows, align=None):
         print(row)
 
 
+class RecordPrinter:
+    """Print records in a machine-readable format as soon as they come
+
+    Records are dicts whose keys are in fields. Nothing is buffered: each
+    record is written and flushed by write.
+    """
+
+    def __init__(self, output_format, fields, output=None):
+        if output_format not in ("json", "jsonl", "csv"):
+            raise ValueError("Unknown output format: %s" % output_format)
+
+        self.format = output_format
+        self.fields = list(fields)
+        self.output = output or sys.stdout
+        self._count = 0
+
+        if self.format == "csv":
+            self._csv = csv.writer(self.output)
+            self._csv.writerow(self.fields)
+        elif self.format == "json":
+            self.output.write("[")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, record):
+        values = [record.get(field) for field in self.fields]
+
+        if self.format == "csv":
+            self._csv.writerow(
+                [
+                    json.dumps(v) if isinstance(v, (list, dict)) else default(v)
+                    for v in values
+                ]
+            )
+        else:
+            text = json.dumps(dict(zip(self.fields, values)))
+            if self.format == "json":
+                text = ("," if self._count else "") + "\n  " + text
+            else:
+                text += "\n"
+            self.output.write(text)
+
+        self._count += 1
+        self.output.flush()
+
+    def close(self):
+        if self.format == "json":
+            self.output.write("\n]\n" if self._count else "]\n")
+            self.output.flush()
+
+
 def si_unit(x, binary=False):
     x = abs(float(x))
     if x <= 0:
@@ -2,12 +2,31 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import libvirt
+import importlib
 import logging
+import sys
 
 from ovm.configuration import Configuration
 from ovm.utils.logger import logger
-from ovm.vmcli.management import *  # noqa
+from ovm.utils.printer import OUTPUT_FORMATS
+
+
+# Handlers are named and only imported once the command is known, to keep
+# the startup fast.
+HANDLERS_MODULE = "ovm.vmcli.management"
+
+
+def get_handler(name):
+    return getattr(importlib.import_module(HANDLERS_MODULE), name)
+
+
+def add_format_argument(parser):
+    parser.add_argument(
+        "--format",
+        choices=OUTPUT_FORMATS,
+        default="table",
+        help="print a table or stream machine-readable records",
+    )
 
 
 def add_subparsers(parser):
@@ -16,11 +35,13 @@ def add_subparsers(parser):
     # console
     subcommand = subparsers.add_parser("console", help="enter in the VM console")
     subcommand.add_argument("name", help="name of the VM")
-    subcommand.set_defaults(func=vm_console)
+    subcommand.set_defaults(func="vm_console")
 
     # create
     subcommand = subparsers.add_parser("create", help="create a new VM")
-    subcommand.add_argument("name", help="set the name of the VM")
+    subcommand.add_argument(
+        "names", nargs="+", metavar="name", help="set the names of the VMs"
+    )
     subcommand.add_argument("--template", required=True)
     subcommand.add_argument("--network", required=True)
     subcommand.add_argument("--storage", required=True)
@@ -28,21 +49,23 @@ def add_subparsers(parser):
     subcommand.add_argument("--size", nargs="?")
     subcommand.add_argument("--vcpu", nargs="?")
     subcommand.add_argument("--memory", nargs="?")
-    subcommand.set_defaults(func=vm_create)
+    subcommand.set_defaults(func="vm_create")
 
     # templates
     subcommand = subparsers.add_parser("templates", help="list templates")
     subcommand.add_argument(
         "--short", action="store_true", help="print only the list of templates names"
     )
-    subcommand.set_defaults(func=vm_templates)
+    add_format_argument(subcommand)
+    subcommand.set_defaults(func="vm_templates")
 
     # storage
     subcommand = subparsers.add_parser("storage", help="list storage")
     subcommand.add_argument(
         "--short", action="store_true", help="print only the list of storage names"
     )
-    subcommand.set_defaults(func=vm_storage)
+    subcommand.set_defaults(func="vm_storage")
+    add_storage_subparsers(subcommand)
 
     # list
     subcommand = subparsers.add_parser("ls", help="list VMs")
@@ -55,7 +78,8 @@ def add_subparsers(parser):
     subcommand.add_argument(
         "--inactive", action="store_true", help="print only the list of inactive VM"
     )
-    subcommand.set_defaults(func=vm_list)
+    add_format_argument(subcommand)
+    subcommand.set_defaults(func="vm_list")
 
     # set
     subcommand = subparsers.add_parser("set", help="set a metadata on a vm")
@@ -63,13 +87,13 @@ def add_subparsers(parser):
     subcommand.add_argument(
         "metadata", nargs="+", help="enter metadata as <key>=<value>"
     )
-    subcommand.set_defaults(func=vm_set)
+    subcommand.set_defaults(func="vm_set")
 
     # unset
     subcommand = subparsers.add_parser("unset", help="unset a metadata on a vm")
     subcommand.add_argument("name", help="name of the VM")
     subcommand.add_argument("key", nargs="+")
-    subcommand.set_defaults(func=vm_unset)
+    subcommand.set_defaults(func="vm_unset")
 
     # autostart
     subcommand = subparsers.add_parser(
@@ -77,32 +101,33 @@ def add_subparsers(parser):
     )
     subcommand.add_argument("name", help="name of the VM")
     subcommand.add_argument("value", choices=["on", "off"])
-    subcommand.set_defaults(func=vm_autostart)
+    subcommand.set_defaults(func="vm_autostart")
 
     # start
     subcommand = subparsers.add_parser("start", help="start one or many VMs")
     subcommand.add_argument("name", nargs="+", help="name of VMs")
-    subcommand.set_defaults(func=vm_start)
+    subcommand.set_defaults(func="vm_start")
 
     # info
     subcommand = subparsers.add_parser("info", help="show information about a VM")
     subcommand.add_argument("name", help="name of the VM")
-    subcommand.set_defaults(func=vm_info)
+    add_format_argument(subcommand)
+    subcommand.set_defaults(func="vm_info")
 
     # reboot
     subcommand = subparsers.add_parser("reboot", help="reboot a VM")
     subcommand.add_argument("name", help="name of the VM")
-    subcommand.set_defaults(func=vm_reboot)
+    subcommand.set_defaults(func="vm_reboot")
 
     # save
     subcommand = subparsers.add_parser("save", help="save a VM")
     subcommand.add_argument("name", nargs="+", help="name of VMs")
-    subcommand.set_defaults(func=vm_save)
+    subcommand.set_defaults(func="vm_save")
 
     # restore
     subcommand = subparsers.add_parser("restore", help="restore a VM")
     subcommand.add_argument("name", nargs="+", help="name of VMs")
-    subcommand.set_defaults(func=vm_restore)
+    subcommand.set_defaults(func="vm_restore")
 
     # stop
     subcommand = subparsers.add_parser("stop", help="stop one or many VMs")
@@ -110,7 +135,7 @@ def add_subparsers(parser):
     subcommand.add_argument(
         "-f", "--force", action="store_true", help="force the VM shutdown"
     )
-    subcommand.set_defaults(func=vm_stop)
+    subcommand.set_defaults(func="vm_stop")
 
     # remove
     subcommand = subparsers.add_parser("rm", help="remove one or many VMs")
@@ -122,26 +147,100 @@ def add_subparsers(parser):
         dest="force",
         help="Remove VM without asking confirmation.",
     )
-    subcommand.set_defaults(func=vm_remove)
+    subcommand.set_defaults(func="vm_remove")
 
     # ssh
     subcommand = subparsers.add_parser("ssh", help="ssh a VM")
     subcommand.add_argument("name", help="name of the VM")
-    subcommand.set_defaults(func=vm_ssh)
+    subcommand.set_defaults(func="vm_ssh")
 
     # ping
     subcommand = subparsers.add_parser("ping", help="ping a VM")
     subcommand.add_argument("name", help="name of the VM")
-    subcommand.set_defaults(func=vm_ping)
+    subcommand.set_defaults(func="vm_ping")
 
     # top
     subcommand = subparsers.add_parser("top", help="show all VMs and their states")
-    subcommand.set_defaults(func=vm_top)
+    subcommand.add_argument(
+        "-b", "--batch", action="store_true", help="print samples without curses"
+    )
+    subcommand.add_argument(
+        "-d",
+        "--interval",
+        default=1,
+        type=float,
+        help="set the seconds between two samples in batch mode",
+    )
+    subcommand.add_argument(
+        "-n", "--count", type=int, help="stop after this many samples in batch mode"
+    )
+    add_format_argument(subcommand)
+    subcommand.set_defaults(func="vm_top")
+
+    # exporter
+    subcommand = subparsers.add_parser(
+        "exporter", help="serve the stats of the VMs to Prometheus"
+    )
+    subcommand.add_argument(
+        "--address", default="", help="set the listen address (default: all)"
+    )
+    subcommand.add_argument(
+        "--port", default=9178, type=int, help="set the listen port (default: 9178)"
+    )
+    subcommand.add_argument(
+        "--interval",
+        default=15,
+        type=float,
+        help="set the seconds between two samples (default: 15)",
+    )
+    subcommand.set_defaults(func="vm_exporter")
+
+    # disks
+    subcommand = subparsers.add_parser("disk", help="manage the disks of the VMs")
+    add_disk_subparsers(subcommand)
 
     # networks
     subcommand = subparsers.add_parser("network")
     add_network_subparsers(subcommand)
 
+    # inventory
+    subcommand = subparsers.add_parser("inventory", help="manage the inventory cache")
+    add_inventory_subparsers(subcommand)
+
+
+def add_storage_subparsers(parser):
+    subparsers = parser.add_subparsers()
+
+    cmd = subparsers.add_parser("cache", help="manage the image cache of the pools")
+    cache_subparsers = cmd.add_subparsers()
+
+    cmd = cache_subparsers.add_parser("list", help="list the cached images")
+    cmd.add_argument("pool", nargs="?", help="name of the storage pool")
+    cmd.set_defaults(func="storage_cache_list")
+
+    cmd = cache_subparsers.add_parser(
+        "warm", help="convert the images of templates into the cache of a pool"
+    )
+    cmd.add_argument("pool", help="name of the storage pool")
+    cmd.add_argument("template", nargs="+", help="uid of the templates")
+    cmd.set_defaults(func="storage_cache_warm")
+
+    cmd = cache_subparsers.add_parser(
+        "purge", help="remove the cached images no disk is based on"
+    )
+    cmd.add_argument("pool", nargs="?", help="name of the storage pool")
+    cmd.set_defaults(func="storage_cache_purge")
+
+
+def add_disk_subparsers(parser):
+    subparsers = parser.add_subparsers()
+
+    cmd = subparsers.add_parser(
+        "flatten", help="copy the base images into the overlays of an inactive VM"
+    )
+    cmd.add_argument("name", help="name of the VM")
+    cmd.set_defaults(func="disk_flatten")
+
 
 def add_network_subparsers(parser):
     subparsers = parser.add_subparsers()
@@ -150,18 +249,19 @@ def add_network_subparsers(parser):
     cmd.add_argument(
         "--short", action="store_true", help="print only the list of networks names"
     )
-    cmd.set_defaults(func=network_list)
+    cmd.set_defaults(func="network_list")
 
     cmd = subparsers.add_parser("ipv4-list", help="show IPv4 allocated to a network")
     cmd.add_argument("network")
-    cmd.set_defaults(func=network_ipv4_list)
+    add_format_argument(cmd)
+    cmd.set_defaults(func="network_ipv4_list")
 
     cmd = subparsers.add_parser(
         "ipv4-del", help="delete an IPv4 associated with a network"
     )
     cmd.add_argument("network")
     cmd.add_argument("address", nargs="+")
-    cmd.set_defaults(func=network_ipv4_delete)
+    cmd.set_defaults(func="network_ipv4_delete")
 
     cmd = subparsers.add_parser(
         "ipv4-add", help="add a new association between a domain and an IP address"
@@ -169,17 +269,37 @@ def add_network_subparsers(parser):
     cmd.add_argument("network")
     cmd.add_argument("domain")
     cmd.add_argument("address", nargs="?")
-    cmd.set_defaults(func=network_ipv4_add)
+    cmd.add_argument(
+        "--count",
+        type=int,
+        default=1,
+        help="reserve COUNT addresses for domains named <domain>-1 to <domain>-COUNT",
+    )
+    cmd.set_defaults(func="network_ipv4_add")
 
     cmd = subparsers.add_parser("ipv4-flush", help="remove all ip address in a network")
     cmd.add_argument("network")
-    cmd.set_defaults(func=network_ipv4_flush)
+    cmd.set_defaults(func="network_ipv4_flush")
 
 
-def main():
-    # Ignore text error from libvirt
-    libvirt.registerErrorHandler(lambda: 1, None)
+def add_inventory_subparsers(parser):
+    subparsers = parser.add_subparsers()
+
+    cmd = subparsers.add_parser(
+        "watch", help="keep the inventory cache up to date from libvirt events"
+    )
+    cmd.set_defaults(func="inventory_watch")
+
+    cmd = subparsers.add_parser(
+        "refresh", help="rebuild the inventory cache and enable it"
+    )
+    cmd.set_defaults(func="inventory_refresh")
 
+    cmd = subparsers.add_parser("flush", help="remove the inventory cache")
+    cmd.set_defaults(func="inventory_flush")
+
+
+def main():
     parser = argparse.ArgumentParser(
         description="Provide functions to create and manage VMs on KVM.", prog="vm"
     )
@@ -188,6 +308,11 @@ def main():
     parser.add_argument(
         "--fork", default=4, type=int, help="set how many tasks launch parallelly"
     )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="run the command in this process, even if ovmd is running",
+    )
 
     add_subparsers(parser)
 
@@ -196,14 +321,29 @@ def main():
     if args.verbose:
         logger.setLevel(logging.DEBUG)
 
-    Resources(Configuration.RESOURCE_CONFIG)
-
-    if hasattr(args, "func"):
-        getattr(args, "func")(args)
-    else:
+    if not hasattr(args, "func"):
         parser.print_help()
         sys.exit(0)
 
+    from ovm.vmcli.daemon import forward, is_forwardable
+
+    if not args.local and is_forwardable(args):
+        status = forward(args)
+        if status is not None:
+            sys.exit(status)
+
+    handler = get_handler(args.func)
+
+    import libvirt
+    from ovm.resources import Resources
+
+    # Ignore text error from libvirt
+    libvirt.registerErrorHandler(lambda: 1, None)
+
+    Resources(Configuration.RESOURCE_CONFIG)
+
+    handler(args)
+
 
 if __name__ == "__main__":
     main()
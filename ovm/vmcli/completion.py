@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import marshal
+import os
+import sys
+import time
+
+from ovm.configuration import Configuration
+
+
+__all__ = ["CompletionIndex"]
+
+
+DOMAIN_KINDS = ("domains", "active", "inactive")
+RESOURCE_KINDS = ("storage", "networks")
+KINDS = DOMAIN_KINDS + RESOURCE_KINDS + ("templates",)
+
+
+def _files_state(paths):
+    state = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        state.append([path, stat.st_mtime_ns, stat.st_size])
+    return state
+
+
+class CompletionIndex:
+    """Names completed by bin/vm-completion, kept in a small file
+
+    The names of the domains are written by the InventoryWatcher and trusted
+    while it renews their heartbeat. Otherwise, they are listed again from
+    libvirt, by name only. The names of the templates and of the resources
+    are read again when their files change.
+
+    Each process only writes the entries it changed, merged under a lock into
+    the file, so the watcher and the helpers of the shell do not erase the
+    entries of each other.
+    """
+
+    VERSION = 2
+    WATCH_TIMEOUT = 30
+
+    def __init__(self, path=None):
+        self.path = path or Configuration.COMPLETION_INDEX
+        self._content = self._read()
+        self._changed = set()
+        if time.time() - self._content.get("watched_at", 0) >= self.WATCH_TIMEOUT:
+            self._content["watched"] = False
+
+    def _read(self):
+        # marshal is built in, while json and pickle import the re module which
+        # doubles the time taken to answer the shell
+        try:
+            with open(self.path, "rb") as fd:
+                content = marshal.load(fd)
+        except (OSError, EOFError, ValueError, TypeError):
+            return {}
+
+        if isinstance(content, dict) and content.get("version") == self.VERSION:
+            return content
+        return {}
+
+    def _update(self, entries):
+        self._content.update(entries)
+        self._changed.update(entries)
+
+    def get_names(self, kind):
+        if kind in DOMAIN_KINDS:
+            if not self._content.get("watched"):
+                self.set_domains(self.list_domains())
+            domains = self._content["domains"]
+            if kind == "domains":
+                return sorted(domains)
+            active = kind == "active"
+            return sorted(name for name, state in domains.items() if state == active)
+
+        if kind == "templates":
+            self._check("templates", self._load_templates, self._templates_paths())
+        else:
+            self._check(
+                "resources", self._load_resources, [Configuration.RESOURCE_CONFIG]
+            )
+        return self._content[kind]
+
+    def _check(self, name, loader, paths):
+        state = _files_state(paths)
+        key = name + "_state"
+        if self._content.get(key) != state:
+            self._update(dict(loader(), **{key: state}))
+
+    @staticmethod
+    def _templates_paths():
+        # Like the glob of Template, without importing the re module
+        directory = Configuration.ETC_TEMPLATES
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        return [
+            os.path.join(directory, name)
+            for name in names
+            if name.endswith(".yml") and not name.startswith(".")
+        ]
+
+    @staticmethod
+    def _load_templates():
+        from ovm.templates.template import Template
+
+        Template.invalidate()
+        return {"templates": sorted(t.uid for t in Template.get_templates())}
+
+    @staticmethod
+    def _load_resources():
+        import yaml
+
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        try:
+            with open(Configuration.RESOURCE_CONFIG) as fd:
+                resources = yaml.load(fd, Loader=loader) or {}
+        except OSError:
+            resources = {}
+        return {
+            "storage": sorted(resources.get("storage") or ()),
+            "networks": sorted(resources.get("networks") or ()),
+        }
+
+    @staticmethod
+    def list_domains(connection=None):
+        """Map the names of the domains to their active state"""
+        import libvirt
+
+        from ovm.lvconnect import LibvirtConnect
+
+        if connection is None:
+            # Ignore text error from libvirt
+            libvirt.registerErrorHandler(lambda: 1, None)
+            connection = LibvirtConnect.get_connection()
+
+        domains = {}
+        for flags, active in (
+            (libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE, True),
+            (libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE, False),
+        ):
+            for domain in connection.listAllDomains(flags):
+                domains[domain.name()] = active
+        return domains
+
+    def set_domains(self, domains, watched=False):
+        entries = {"domains": domains, "watched": watched}
+        if watched:
+            entries["watched_at"] = time.time()
+        self._update(entries)
+
+    def heartbeat(self):
+        """Write the domains again to tell they are still watched"""
+        self.set_domains(self._content.get("domains", {}), watched=True)
+        self.save()
+
+    def save(self):
+        """Merge the changed entries into the file"""
+        if not self._changed:
+            return
+
+        import fcntl
+        import tempfile
+
+        directory = os.path.dirname(self.path)
+        try:
+            with open(self.path + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                content = self._read()
+                content.update((key, self._content[key]) for key in self._changed)
+                content["version"] = self.VERSION
+
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".completion-")
+                try:
+                    with os.fdopen(fd, "wb") as tmp:
+                        marshal.dump(content, tmp)
+                    os.replace(tmp_path, self.path)
+                except OSError:
+                    os.remove(tmp_path)
+                    raise
+        except OSError:
+            return
+        self._changed.clear()
+
+
+def main():
+    # argparse is not used to answer the shell faster
+    if len(sys.argv) != 2 or sys.argv[1] not in KINDS:
+        sys.exit("usage: vm-complete {%s}" % ",".join(KINDS))
+
+    index = CompletionIndex()
+    try:
+        names = index.get_names(sys.argv[1])
+    except Exception:
+        # Never print an error in the middle of the command line
+        return
+    index.save()
+    print("\n".join(names))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import os
 import sys
 import tempfile
@@ -57,7 +58,14 @@ class VMCreation:
         "print_domain",
     )
 
-    def __init__(self, args):
+    def __init__(self, args, alloc=None):
+        if alloc is not None and alloc.domain != args.name:
+            # vm rm would never release it
+            raise OVMError(
+                'The IP "{}" is reserved for "{}", not for "{}".'.format(
+                    alloc.address, alloc.domain, args.name
+                )
+            )
         self._args = args
         self._network = None
         self._storage = None
@@ -66,7 +74,57 @@ class VMCreation:
         self._template = None
         self._params = None
         self._domain = None
-        self._alloc = None
+        self._alloc = alloc
+
+    @staticmethod
+    def reserve_ips(network_name, names):
+        """Reserve the addresses of several VMs in one go
+
+        Return a dict mapping each name to its allocation, which can then be
+        given to the VMCreation of the VM.
+        """
+        network = Resources.get_network(network_name)
+        if network.allocation_method != ALLOCATION_STATIC:
+            raise OVMError("Cannot reserve IPs on a DHCP network.")
+
+        allocations = network.new_ipv4_allocation().hold_ips(names)
+        return {alloc.domain: alloc for alloc in allocations}
+
+    @classmethod
+    def create_all(cls, args, names):
+        """Create a VM named after each name, with the options of args
+
+        On a static network, the addresses of all the VMs are reserved at
+        once. When a creation fails, the addresses of the next VMs are
+        released and the process exits.
+        """
+        if len(set(names)) != len(names):
+            logger.error("The names of the VMs must be different.")
+            sys.exit(1)
+
+        allocations = {}
+        if len(names) > 1:
+            if args.ip:
+                logger.error("Cannot use --ip with several VMs.")
+                sys.exit(1)
+            try:
+                network = Resources.get_network(args.network)
+                if network.allocation_method == ALLOCATION_STATIC:
+                    allocations = cls.reserve_ips(args.network, names)
+            except OVMError as e:
+                logger.error("Cannot create the VMs: %s", e.message)
+                sys.exit(1)
+
+        for num, name in enumerate(names):
+            vm_args = argparse.Namespace(**vars(args))
+            vm_args.name = name
+            try:
+                cls(vm_args, allocations.get(name)).start()
+            except SystemExit:
+                for next_name in names[num + 1 :]:
+                    if next_name in allocations:
+                        allocations[next_name].remove()
+                raise
 
     def start(self):
         for num, step in enumerate(self.STEPS, 1):
@@ -84,8 +142,7 @@ class VMCreation:
             self._alloc.remove()
 
     def check_domain_name(self, args):
-        domains = [domain.get_name() for domain in Inventory.get_domains()]
-        if args.name in domains:
+        if args.name in Inventory.get_domain_names():
             raise OVMError("this name is already taken by another VM.")
 
     def process_network_args(self, args):
@@ -94,8 +151,15 @@ class VMCreation:
         if self._network.allocation_method == ALLOCATION_DHCP:
             if args.ip:
                 raise OVMError("You cannot use --ip with a DHCP network.")
+            if self._alloc:
+                raise OVMError("Cannot use a reserved IP on a DHCP network.")
 
         elif self._network.allocation_method == ALLOCATION_STATIC:
+            if self._alloc:
+                if args.ip and args.ip != self._alloc.address:
+                    raise OVMError("--ip differs from the reserved IP.")
+                return
+
             self._alloc = self._network.new_ipv4_allocation()
             self._alloc.hold_ip(args.name, args.ip)
 
@@ -189,4 +253,4 @@ class VMCreation:
         from ovm.vmcli.management import print_vm_info
 
         print("\n")
-        print_vm_info(self._domain)
+        print_vm_info(self._domain, args.fork)
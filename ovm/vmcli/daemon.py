@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import glob
+import importlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+
+from ovm.configuration import Configuration
+from ovm.utils.logger import logger
+
+
+__all__ = ["Daemon", "forward", "is_forwardable"]
+
+
+HANDLERS_MODULE = "ovm.vmcli.management"
+
+# Commands run by ovmd. The others use the terminal of the user or run until
+# interrupted, like console, top or inventory watch, or spend their time
+# copying disks, like create, disk flatten and storage cache warm.
+FORWARDED_HANDLERS = frozenset(
+    (
+        "vm_autostart",
+        "vm_info",
+        "vm_list",
+        "vm_reboot",
+        "vm_remove",
+        "vm_restore",
+        "vm_save",
+        "vm_set",
+        "vm_start",
+        "vm_stop",
+        "vm_storage",
+        "vm_templates",
+        "vm_unset",
+        "network_list",
+        "network_ipv4_list",
+        "network_ipv4_add",
+        "network_ipv4_delete",
+        "network_ipv4_flush",
+        "storage_cache_list",
+        "storage_cache_purge",
+        "inventory_refresh",
+        "inventory_flush",
+    )
+)
+
+# Commands asking for a confirmation unless --force is given
+CONFIRM_HANDLERS = frozenset(("vm_remove",))
+
+
+def is_forwardable(args, handlers=FORWARDED_HANDLERS):
+    """Tell if the command can be run by ovmd"""
+    if args.func not in handlers:
+        return False
+    return args.func not in CONFIRM_HANDLERS or getattr(args, "force", False)
+
+
+def forward(args, path=None):
+    """Run the command in ovmd and return its exit status
+
+    None is returned when no daemon is listening, or when it cannot run the
+    command, so that the caller runs it by itself.
+    """
+    # Keep the streams of the caller: ovmd may redirect them when it runs in
+    # the same process, like in the tests.
+    stdout, stderr = sys.stdout, sys.stderr
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path or Configuration.DAEMON_SOCKET)
+    except OSError as err:
+        logger.debug("Run the command without ovmd: %s", err)
+        client.close()
+        return None
+
+    request = {
+        "version": Configuration.VERSION,
+        "func": args.func,
+        "args": vars(args),
+        "tty": stdout.isatty(),
+    }
+    with client, client.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode("utf-8") + b"\n")
+        stream.flush()
+
+        for line in stream:
+            message = json.loads(line.decode("utf-8"))
+            if "status" in message:
+                return message["status"]
+            for name, output in (("stdout", stdout), ("stderr", stderr)):
+                if name in message:
+                    output.write(message[name])
+                    output.flush()
+
+    logger.error("The connection to ovmd was lost.")
+    return 1
+
+
+class _Channel:
+    """Messages sent to the client, ignored once it is gone"""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        data = json.dumps(message).encode("utf-8") + b"\n"
+        with self._lock:
+            if self.closed:
+                return
+            try:
+                self._wfile.write(data)
+                self._wfile.flush()
+            except OSError:
+                # Let the command finish anyway
+                self.closed = True
+
+
+class _ClientStream(io.TextIOBase):
+    """Line-buffered text stream written to the terminal of the client"""
+
+    def __init__(self, channel, name, tty):
+        self._channel = channel
+        self._name = name
+        self._tty = tty
+        self._buffer = ""
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self._tty
+
+    def write(self, text):
+        self._buffer += text
+        if "\n" in self._buffer:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            self._channel.send({self._name: self._buffer})
+            self._buffer = ""
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+        except ValueError:
+            return
+
+        channel = _Channel(self.wfile)
+        if request.get("version") != Configuration.VERSION:
+            # Let a client of another version run the command by itself
+            channel.send({"status": None})
+            return
+
+        status = self.server.ovmd.run(request, channel)
+        channel.send({"status": status})
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _files_state():
+    """Modification times of the files read by the commands"""
+    paths = [Configuration.RESOURCE_CONFIG]
+    paths += glob.glob(os.path.join(Configuration.ETC_TEMPLATES, "*.yml"))
+
+    state = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        state.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(state)
+
+
+def _is_listening(path):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client:
+        try:
+            client.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def _exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write("{}\n".format(code))
+    return 1
+
+
+@contextlib.contextmanager
+def _redirect(stdout, stderr, verbose):
+    """Send the output and the logs of the command to the client"""
+    handlers = [h for h in logger.handlers if isinstance(h, logging.StreamHandler)]
+    streams = [handler.setStream(stderr) for handler in handlers]
+    level = logger.level
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            yield
+    finally:
+        stdout.flush()
+        stderr.flush()
+        for handler, stream in zip(handlers, streams):
+            handler.setStream(stream)
+        logger.setLevel(level)
+
+
+class Daemon:
+    """Run the commands of vm in a long-lived process
+
+    The libvirt connection, the resources and the templates are loaded once,
+    and an InventoryWatcher keeps the inventory cache up to date. The
+    resources and the templates are loaded again when their files change.
+
+    Commands run one after another since their output is redirected for the
+    whole process.
+    """
+
+    def __init__(
+        self, path=None, handlers_module=HANDLERS_MODULE, handlers=FORWARDED_HANDLERS
+    ):
+        self.path = path or Configuration.DAEMON_SOCKET
+        self.handlers_module = handlers_module
+        self.handlers = handlers
+        self._lock = threading.Lock()
+        self._server = None
+        self._files_state = None
+
+    def warm_up(self):
+        import libvirt
+
+        from ovm.inventory.cache import InventoryCache, InventoryWatcher
+        from ovm.lvconnect import LibvirtConnect
+        from ovm.vmcli.completion import CompletionIndex
+
+        # Ignore text error from libvirt
+        libvirt.registerErrorHandler(lambda: 1, None)
+
+        # The event loop must be registered before opening the connection
+        libvirt.virEventRegisterDefaultImpl()
+        connection = LibvirtConnect.get_connection()
+
+        cache = InventoryCache(Configuration.INVENTORY_CACHE)
+        watcher = InventoryWatcher(cache, CompletionIndex())
+        watcher.start(connection)
+        threading.Thread(target=watcher.loop, daemon=True).start()
+
+        importlib.import_module(self.handlers_module)
+        self._load()
+
+    def _load(self):
+        from ovm.exceptions import OVMError
+        from ovm.resources import Resources
+        from ovm.templates.template import Template
+
+        self._files_state = _files_state()
+        Resources(Configuration.RESOURCE_CONFIG)
+        Template.invalidate()
+        try:
+            Resources.get_networks()
+            Resources.get_storage_pools()
+            Template.get_templates()
+        except OVMError as err:
+            logger.warning("Cannot load the resources: %s", err)
+
+    def _refresh(self):
+        # Nothing was loaded when the daemon is not warmed up
+        if self._files_state is None or self._files_state == _files_state():
+            return
+        logger.debug("The configuration changed: load it again.")
+        self._load()
+
+    def run(self, request, channel):
+        """Run a command and return its exit status"""
+        tty = bool(request.get("tty"))
+        stdout = _ClientStream(channel, "stdout", tty)
+        stderr = _ClientStream(channel, "stderr", tty)
+        args = argparse.Namespace(**request["args"])
+        args.func = request["func"]
+        if not is_forwardable(args, self.handlers):
+            stderr.write("ovmd does not run {}.\n".format(args.func))
+            stderr.flush()
+            return 1
+
+        with self._lock, _redirect(stdout, stderr, args.verbose):
+            try:
+                self._refresh()
+                self._call(args)
+            except SystemExit as err:
+                return _exit_status(err.code)
+            except Exception:
+                traceback.print_exc()
+                return 1
+        return 0
+
+    def _call(self, args):
+        from ovm.lvconnect import LibvirtConnect
+
+        handler = getattr(importlib.import_module(self.handlers_module), args.func)
+        if not LibvirtConnect.is_alive():
+            # libvirtd was restarted since the last command. A command failing
+            # while it runs is not run again: it may have done a part of its
+            # job and written its output already.
+            logger.debug("The connection to libvirt was lost: open a new one.")
+            LibvirtConnect.reset()
+        handler(args)
+
+    def serve(self):
+        if os.path.exists(self.path):
+            if _is_listening(self.path):
+                raise OSError("ovmd is already listening on %s" % self.path)
+            # Left by a daemon which did not stop properly
+            os.remove(self.path)
+
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.path, _RequestHandler)
+        finally:
+            os.umask(umask)
+        self._server.ovmd = self
+
+        logger.info("Listening on %s.", self.path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.remove(self.path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the commands of vm in a long-lived process.", prog="ovmd"
+    )
+    parser.add_argument("--version", action="version", version=Configuration.VERSION)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument(
+        "--socket",
+        default=Configuration.DAEMON_SOCKET,
+        help="set the path of the socket (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    daemon = Daemon(args.socket)
+    daemon.warm_up()
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import libvirt
+
+from ovm.inventory.domain_metadata import DomainMetadata
+from ovm.lvconnect import LibvirtConnect
+from ovm.utils.logger import logger
+from ovm.vmcli.vmtop import StatsCollector
+
+
+__all__ = ["MetricsExporter"]
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metadata entries added as labels to the metrics of the domains
+METADATA_LABELS = ("os_type", "os_name", "os_version", "ipv4_addr")
+
+HOST_METRICS = (
+    ("ovm_host_cpu_usage_ratio", "gauge", "CPU usage of the host", "cpu_usage"),
+    ("ovm_host_memory_total_bytes", "gauge", "Memory of the host", "mem_total"),
+    ("ovm_host_memory_os_bytes", "gauge", "Memory used by the host", "mem_os"),
+    ("ovm_host_memory_vms_bytes", "gauge", "Memory used by the VMs", "mem_vms_total"),
+    ("ovm_host_memory_cached_bytes", "gauge", "Memory of the cache", "mem_cached"),
+    ("ovm_domains_running", "gauge", "Number of running VMs", "domain_count"),
+)
+
+DOMAIN_METRICS = (
+    (
+        "ovm_domain_cpu_seconds_total",
+        "counter",
+        "CPU time used by the vCPUs of the VM",
+        lambda domain: domain.cpu_time / 10**9,
+    ),
+    (
+        "ovm_domain_cpu_usage_percent",
+        "gauge",
+        "CPU usage of the VM, in percent of the host CPUs",
+        lambda domain: domain.cpu_usage,
+    ),
+    (
+        "ovm_domain_memory_bytes",
+        "gauge",
+        "Maximum memory of the VM",
+        lambda domain: domain.guest_mem,
+    ),
+    (
+        "ovm_domain_memory_rss_bytes",
+        "gauge",
+        "Memory used by the VM on the host",
+        lambda domain: domain.host_mem,
+    ),
+)
+
+# Metrics of the devices: attribute holding the devices and byte counter
+DEVICE_METRICS = (
+    (
+        "ovm_domain_network_receive_bytes_total",
+        "Bytes received by a network interface",
+        "interfaces",
+        "rx_bytes",
+    ),
+    (
+        "ovm_domain_network_transmit_bytes_total",
+        "Bytes transmitted by a network interface",
+        "interfaces",
+        "tx_bytes",
+    ),
+    (
+        "ovm_domain_block_read_bytes_total",
+        "Bytes read from a disk",
+        "disks",
+        "rx_bytes",
+    ),
+    (
+        "ovm_domain_block_write_bytes_total",
+        "Bytes written to a disk",
+        "disks",
+        "tx_bytes",
+    ),
+)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, escape_label(value)) for name, value in labels
+    )
+
+
+def format_metric(name, metric_type, description, samples):
+    """Format a metric in the Prometheus text format
+
+    samples is a list of (labels, value) where labels is a list of
+    (name, value).
+    """
+    lines = ["# HELP %s %s" % (name, description), "# TYPE %s %s" % (name, metric_type)]
+    for labels, value in samples:
+        lines.append("%s%s %s" % (name, format_labels(labels), repr(float(value))))
+    return lines
+
+
+class MetricsExporter:
+    """Serve the stats of the host and of the VMs to Prometheus
+
+    A background StatsCollector samples the stats every interval and the
+    page is rendered once per sample. Scrapers all get the last rendered
+    page, so their number does not change the calls made to libvirt.
+
+    The labels of a VM are read from its metadata when it shows up, and
+    read again only when libvirt notifies a change of the metadata.
+    """
+
+    def __init__(self, interval):
+        # The event loop must be registered before opening the connection
+        libvirt.virEventRegisterDefaultImpl()
+        self._connection = LibvirtConnect.get_connection()
+
+        self.collector = StatsCollector(self._connection, interval)
+        self._labels = {}
+        # Labels are filled by the collector and dropped by the events
+        self._labels_lock = threading.Lock()
+        self._page = b""
+        self._lock = threading.Lock()
+
+    def get_page(self):
+        with self._lock:
+            return self._page
+
+    def _get_labels(self, domain):
+        # Called with the labels lock held
+        labels = self._labels.get(domain.name)
+        if labels is None:
+            metadata = DomainMetadata(domain.domain)
+            labels = [("name", domain.name)]
+            labels += [(key, metadata.get(key) or "") for key in METADATA_LABELS]
+            self._labels[domain.name] = labels
+        return labels
+
+    def render(self):
+        start = time.monotonic()
+        host = self.collector.host_stats
+        domains = sorted(self.collector.get_domains(), key=lambda dom: dom.name)
+
+        labels = {}
+        with self._labels_lock:
+            # Forget the labels of the VMs which are not running anymore
+            names = set(domain.name for domain in domains)
+            for name in set(self._labels) - names:
+                self._labels.pop(name, None)
+
+            for domain in domains:
+                try:
+                    labels[domain.name] = self._get_labels(domain)
+                except libvirt.libvirtError as err:
+                    logger.debug("Cannot read the metadata of %s: %s", domain.name, err)
+                    labels[domain.name] = [("name", domain.name)]
+
+        lines = []
+        host_labels = [("host", host.hostname)]
+        for name, metric_type, description, attribute in HOST_METRICS:
+            samples = [(host_labels, getattr(host, attribute))]
+            lines += format_metric(name, metric_type, description, samples)
+
+        for name, metric_type, description, func in DOMAIN_METRICS:
+            samples = [(labels[domain.name], func(domain)) for domain in domains]
+            lines += format_metric(name, metric_type, description, samples)
+
+        for name, description, devices, attribute in DEVICE_METRICS:
+            samples = []
+            for domain in domains:
+                for device in getattr(domain, devices).values():
+                    device_labels = labels[domain.name] + [("device", device.name)]
+                    samples.append((device_labels, getattr(device, attribute)))
+            lines += format_metric(name, "counter", description, samples)
+
+        lines += format_metric(
+            "ovm_exporter_render_seconds",
+            "gauge",
+            "Time spent to render the page",
+            [([], time.monotonic() - start)],
+        )
+        lines += format_metric(
+            "ovm_exporter_last_sample_timestamp_seconds",
+            "gauge",
+            "Time of the last sample of the stats",
+            [([], time.time())],
+        )
+
+        page = ("\n".join(lines) + "\n").encode("utf-8")
+        with self._lock:
+            self._page = page
+
+    def _on_metadata_change(self, connection, vir_domain, *args):
+        with self._labels_lock:
+            self._labels.pop(vir_domain.name(), None)
+
+    @staticmethod
+    def run_events():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    def serve(self, address, port):
+        self.collector.watch_events()
+        try:
+            self._connection.domainEventRegisterAny(
+                None,
+                libvirt.VIR_DOMAIN_EVENT_ID_METADATA_CHANGE,
+                self._on_metadata_change,
+                None,
+            )
+        except libvirt.libvirtError as err:
+            logger.debug("Cannot watch the metadata changes: %s", err)
+
+        for target, args in (
+            (self.run_events, ()),
+            (self.collector.run, (self.render,)),
+        ):
+            thread = threading.Thread(target=target, args=args)
+            thread.daemon = True
+            thread.start()
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                page = exporter.get_page()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                logger.debug("%s - %s", self.address_string(), format % args)
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        server.daemon_threads = True
+        logger.info("Serving the metrics on http://%s:%d/metrics", address, port)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
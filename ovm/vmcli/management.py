@@ -7,18 +7,18 @@ import libvirt
 import sys
 from concurrent.futures import ThreadPoolExecutor
 
+from ovm.configuration import Configuration
 from ovm.exceptions import OVMError
 from ovm.inventory import Inventory
+from ovm.inventory.cache import InventoryCache, InventoryWatcher
 from ovm.resources import Resources
-from ovm.templates.template import Template
 from ovm.utils.logger import logger
-from ovm.utils.printer import ColoredString, bcolors
+from ovm.utils.printer import ColoredString, RecordPrinter, bcolors
 from ovm.utils.printer import print_title, si_unit, default, print_table
 from ovm.utils.compat23 import Popen
-from ovm.vmcli.creation import VMCreation
-from ovm.vmcli.libvirt_console import Console
-from ovm.vmcli.vmtop import VMTop
-from ovm.inventory.ip_allocation import IpAllocation
+
+# The modules only needed by a few commands (curses, termios, yaml, sqlite3,
+# http.server...) are imported by these commands, to keep the startup fast.
 
 
 ###################################
@@ -26,15 +26,29 @@ from ovm.inventory.ip_allocation import IpAllocation
 ###################################
 
 
-def _get_domain(name):
+def _get_domain(name, cached=False):
     try:
-        domain = Inventory.get_domain(name)
+        domain = Inventory.get_domain(name, cached)
     except libvirt.libvirtError:
         raise OVMError('Cannot get the VM "%s".' % name)
     else:
         return domain
 
 
+def _collect(func, items, workers):
+    """Call func on each item with a pool of threads, keeping the order"""
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(func, items))
+
+
+def _iter_collect(func, items, workers):
+    """Like _collect, but yield the results as soon as they are ready"""
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
 def bulk_command(confirm=None):
     def decorated(func):
         def wrapper(*args, **kwargs):
@@ -49,7 +63,7 @@ def bulk_command(confirm=None):
                 return
 
             # Change patterns into domain name
-            domains = [d.get_name() for d in Inventory.get_domains()]
+            domains = Inventory.get_domain_names()
             selection = set()
             for pattern in patterns:
                 selection.update(fnmatch.filter(domains, pattern))
@@ -93,24 +107,87 @@ def bulk_command(confirm=None):
 ###################################
 
 
-def print_vm_info(domain):
-    print_title("Information about VM {0}".format(domain.get_name()))
-    print("OS name        : {0}".format(domain.get_os_string()))
-    print("State          : {0}".format(domain.get_state_text()))
-    print("vCPU number    : {0}".format(domain.get_vcpu_count()))
-    print("Current memory : {0}B".format(si_unit(domain.get_current_memory(), True)))
-    print("Maximum memory : {0}B".format(si_unit(domain.get_memory(), True)))
-    print("IP address     : {0}".format(domain.get_main_ipv4()))
-    print("Starting       : {0}".format("Auto" if domain.get_autostart() else "Manual"))
-    print("VNC port       : {0}".format(domain.get_vnc_info()["port"]))
+INFO_FIELDS = (
+    "name",
+    "os_name",
+    "state",
+    "vcpu",
+    "current_memory",
+    "memory",
+    "ipv4",
+    "autostart",
+    "vnc_port",
+    "interfaces",
+    "disks",
+    "metadata",
+)
+
+
+def _info_record(domain, workers=1):
+    def get_devices():
+        # All read from the same XML description
+        return domain.get_vnc_info(), domain.get_interfaces(), domain.get_disks()
+
+    # Each value needs its own call to libvirt: gather them concurrently
+    getters = (
+        domain.get_os_string,
+        domain.get_state_text,
+        domain.get_autostart,
+        get_devices,
+    )
+    os_string, state, autostart, devices = _collect(
+        lambda getter: getter(), getters, workers
+    )
+    vnc, interfaces, disks = devices
+    sizes = _collect(lambda vol: vol.size, disks, workers)
+
+    return {
+        "name": domain.get_name(),
+        "os_name": os_string,
+        "state": state,
+        "vcpu": domain.get_vcpu_count(),
+        "current_memory": domain.get_current_memory(),
+        "memory": domain.get_memory(),
+        "ipv4": domain.get_main_ipv4(),
+        "autostart": bool(autostart),
+        "vnc_port": vnc["port"],
+        "interfaces": [
+            {"mac": iface.mac, "bridge": iface.bridge, "vlans": iface.vlans}
+            for iface in interfaces
+        ],
+        "disks": [
+            {
+                "target": vol.guest_dev,
+                "path": vol.path,
+                "pool": vol.pool.name,
+                "size": size,
+            }
+            for vol, size in zip(disks, sizes)
+        ],
+        "metadata": dict(domain.metadata),
+    }
+
+
+def print_vm_info(domain, workers=1):
+    info = _info_record(domain, workers)
+
+    print_title("Information about VM {0}".format(info["name"]))
+    print("OS name        : {0}".format(info["os_name"]))
+    print("State          : {0}".format(info["state"]))
+    print("vCPU number    : {0}".format(info["vcpu"]))
+    print("Current memory : {0}B".format(si_unit(info["current_memory"], True)))
+    print("Maximum memory : {0}B".format(si_unit(info["memory"], True)))
+    print("IP address     : {0}".format(info["ipv4"]))
+    print("Starting       : {0}".format("Auto" if info["autostart"] else "Manual"))
+    print("VNC port       : {0}".format(info["vnc_port"]))
     print()
     print()
 
     print_title("Network")
     headers = ["MAC address", "Bridge", "VLAN"]
     rows = []
-    for iface in domain.get_interfaces():
-        rows.append((iface.mac, iface.bridge, ",".join(iface.vlans)))
+    for iface in info["interfaces"]:
+        rows.append((iface["mac"], iface["bridge"], ",".join(iface["vlans"])))
     print_table(headers, rows)
     print()
     print()
@@ -119,16 +196,21 @@ def print_vm_info(domain):
     headers = ["Target", "Path", "Pool", "Real size"]
     align = ("l", "l", "l", "l")
     rows = []
-    for vol in domain.get_disks():
+    for vol in info["disks"]:
         rows.append(
-            (vol.guest_dev, vol.path, vol.pool.name, "%sB" % si_unit(vol.size, True))
+            (
+                vol["target"],
+                vol["path"],
+                vol["pool"],
+                "%sB" % si_unit(vol["size"], True),
+            )
         )
     print_table(headers, rows, align)
     print()
     print()
 
     print_title("Metadata")
-    for name, value in domain.metadata:
+    for name, value in info["metadata"].items():
         print("{}={}".format(name, value))
     print()
 
@@ -142,52 +224,83 @@ def vm_autostart(args):
 
 
 def vm_info(args):
-    domain = _get_domain(args.name)
-    print_vm_info(domain)
+    domain = _get_domain(args.name, cached=True)
+    if args.format == "table":
+        print_vm_info(domain, args.fork)
+        return
+
+    with RecordPrinter(args.format, INFO_FIELDS) as printer:
+        printer.write(_info_record(domain, args.fork))
+
+
+LIST_FIELDS = (
+    "name",
+    "vcpu",
+    "current_memory",
+    "autostart",
+    "state",
+    "active",
+    "ipv4",
+    "os_name",
+)
+
+
+def _list_record(domain):
+    return {
+        "name": domain.get_name(),
+        "vcpu": domain.get_vcpu_count(),
+        "current_memory": domain.get_current_memory(),
+        "autostart": bool(domain.get_autostart()),
+        "state": domain.get_state_text(),
+        "active": bool(domain.is_active()),
+        "ipv4": domain.get_main_ipv4(),
+        "os_name": domain.get_os_string(),
+    }
+
+
+def _list_row(record):
+    # Color state in green if domain is active, red else
+    if record["active"]:
+        state = ColoredString(record["state"], bcolors.OKGREEN)
+    else:
+        state = ColoredString(record["state"], bcolors.FAIL)
+
+    return (
+        record["name"],
+        record["vcpu"],
+        "%sB" % si_unit(record["current_memory"], True),
+        "Auto" if record["autostart"] else "Manual",
+        state,
+        default(record["ipv4"], "-"),
+        default(record["os_name"], "-"),
+    )
 
 
 def vm_list(args):
     headers = ("Name", "vCPU", "Cur. memory", "Starting", "State", "IP", "OS name")
     align = ("l", "r", "r", "l", "l", "l", "l")
-    rows = []
 
     if args.active and args.inactive:
         logger.error("A VM cannot be active and inactive.")
         sys.exit(1)
 
-    for domain in Inventory.get_domains():
-        if (args.active and not domain.is_active()) or (
-            args.inactive and domain.is_active()
-        ):
-            continue
+    if args.short:
+        for name in sorted(Inventory.get_domain_names(args.active, args.inactive)):
+            print(name)
+        return
 
-        # Color state in green if domain is active, red else
-        state = domain.get_state_text()
-        if domain.is_active():
-            state = ColoredString(state, bcolors.OKGREEN)
-        else:
-            state = ColoredString(state, bcolors.FAIL)
+    snapshot = Inventory.get_snapshot(args.active, args.inactive, args.fork)
 
-        main_ip = domain.get_main_ipv4()
-        rows.append(
-            (
-                domain.get_name(),
-                domain.get_vcpu_count(),
-                "%sB" % si_unit(domain.get_current_memory(), True),
-                "Auto" if domain.get_autostart() else "Manual",
-                state,
-                default(main_ip, "-"),
-                default(domain.get_os_string(), "-"),
-            )
-        )
+    # Records are streamed in the order they are collected
+    if args.format != "table":
+        with RecordPrinter(args.format, LIST_FIELDS) as printer:
+            for record in _iter_collect(_list_record, snapshot, args.fork):
+                printer.write(record)
+        return
 
+    rows = [_list_row(r) for r in _collect(_list_record, snapshot, args.fork)]
     rows.sort(key=lambda e: e[0])
-
-    if args.short:
-        for line in rows:
-            print(line[0])
-    else:
-        print_table(headers, rows, align)
+    print_table(headers, rows, align)
 
 
 def vm_ping(args):
@@ -264,6 +377,8 @@ def vm_console(args):
         logger.error("Cannot connect on an inactive VM.")
         sys.exit(1)
 
+    from ovm.vmcli.libvirt_console import Console
+
     Console.open_console(domain.get_name())
 
 
@@ -359,8 +474,28 @@ def vm_stop(name, args):
         logger.info('VM "%s" stopped.', name)
 
 
-def vm_top(_):
-    VMTop()
+def vm_top(args):
+    from ovm.vmcli.vmtop import VMTop, VMTopBatch
+
+    if not args.batch:
+        VMTop()
+        return
+
+    top = VMTopBatch(args.interval, args.count, args.format)
+    try:
+        top.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def vm_exporter(args):
+    from ovm.vmcli.exporter import MetricsExporter
+
+    exporter = MetricsExporter(args.interval)
+    try:
+        exporter.serve(args.address, args.port)
+    except KeyboardInterrupt:
+        pass
 
 
 def vm_storage(args):
@@ -375,30 +510,110 @@ def vm_storage(args):
     print_table(headers, rows)
 
 
+def _get_image_caches(pool_name):
+    if pool_name:
+        pools = [Resources.get_storage_pool(pool_name)]
+    else:
+        pools = Resources.get_storage_pools()
+
+    caches = []
+    for pool in pools:
+        cache = pool.driver.get_image_cache()
+        if cache is not None:
+            caches.append((pool, cache))
+        elif pool_name:
+            raise OVMError('The storage pool "%s" has no image cache.' % pool.name)
+    return caches
+
+
+def storage_cache_list(args):
+    import time
+
+    headers = ("Pool", "Cached image", "Template image", "Size", "Disks", "Last use")
+    align = ("l", "l", "l", "r", "r", "l")
+    rows = []
+    for pool, cache in _get_image_caches(args.pool):
+        for name, entry in sorted(cache.get_entries().items()):
+            last_used = time.localtime(entry["last_used"])
+            rows.append(
+                (
+                    pool.name,
+                    name,
+                    entry["image"],
+                    "{}B".format(si_unit(entry["size"], True)),
+                    len(entry["users"]),
+                    time.strftime("%Y-%m-%d %H:%M", last_used),
+                )
+            )
+    print_table(headers, rows, align)
+
+
+def storage_cache_warm(args):
+    from ovm.templates.template import Template
+
+    pool, cache = _get_image_caches(args.pool)[0]
+    for uid in args.template:
+        image = Template.get_template(uid).main_disk["image"]
+        path = cache.acquire(image)
+        logger.info('The image of "%s" is cached in "%s".', uid, path)
+
+
+def storage_cache_purge(args):
+    for pool, cache in _get_image_caches(args.pool):
+        for name in cache.purge():
+            logger.info('"%s" is removed from the cache of "%s".', name, pool.name)
+
+
+def disk_flatten(args):
+    domain = _get_domain(args.name)
+    if domain.is_active():
+        logger.error("Cannot flatten the disks of an active VM.")
+        sys.exit(1)
+
+    for disk in domain.get_disks():
+        if disk.flatten():
+            logger.info('Disk "%s" is detached from its base image.', disk.path)
+
+
 def vm_create(args):
-    vmc = VMCreation(args)
-    vmc.start()
+    from ovm.vmcli.creation import VMCreation
+
+    VMCreation.create_all(args, args.names)
+
+
+TEMPLATE_FIELDS = ("uid", "name", "os_type", "os_name", "os_version")
 
 
 def vm_templates(args):
+    from ovm.templates.template import Template
+
     templates = list(Template.get_templates())
 
     if args.short:
         print("\n".join([tpl.uid for tpl in templates]))
         return
 
+    records = (
+        {
+            "uid": tpl.uid,
+            "name": tpl.name,
+            "os_type": tpl.get_os_type(),
+            "os_name": tpl.get_os_name(),
+            "os_version": tpl.get_os_version(),
+        }
+        for tpl in templates
+    )
+
+    if args.format != "table":
+        with RecordPrinter(args.format, TEMPLATE_FIELDS) as printer:
+            for record in records:
+                printer.write(record)
+        return
+
     headers = ("ID", "Name", "OS type", "OS name", "OS version")
     rows = []
-    for tpl in templates:
-        rows.append(
-            (
-                tpl.uid,
-                tpl.name,
-                default(tpl.get_os_type(), "-"),
-                default(tpl.get_os_name(), "-"),
-                default(tpl.get_os_version(), "-"),
-            )
-        )
+    for record in records:
+        rows.append([default(record[field], "-") for field in TEMPLATE_FIELDS])
     print_table(headers, rows)
 
 
@@ -417,6 +632,15 @@ def network_list(args):
 def network_ipv4_list(args):
     net = Resources.get_network(args.network)
     alloc = net.new_ipv4_allocation()
+
+    if args.format != "table":
+        with RecordPrinter(args.format, ("address", "domain")) as printer:
+            for allocation in alloc.get_allocations():
+                printer.write(
+                    {"address": allocation.address, "domain": allocation.domain}
+                )
+        return
+
     headers = ("IPv4", "Domain")
     rows = []
     for allocation in alloc.get_allocations():
@@ -425,6 +649,8 @@ def network_ipv4_list(args):
 
 
 def network_ipv4_flush(args):
+    from ovm.inventory.ip_allocation import IpAllocation
+
     IpAllocation.flush_network(args.network)
 
 
@@ -436,15 +662,51 @@ def network_ipv4_delete(args):
 
 
 def network_ipv4_add(args):
+    if args.count < 1:
+        logger.error("The count must be greater than 0.")
+        sys.exit(1)
+
+    if args.count > 1 and args.address:
+        logger.error("You cannot set an address with --count.")
+        sys.exit(1)
+
     net = Resources.get_network(args.network)
     alloc = net.new_ipv4_allocation()
     try:
-        alloc.hold_ip(args.domain, args.address)
+        if args.count > 1:
+            domains = ["%s-%d" % (args.domain, i) for i in range(1, args.count + 1)]
+            allocations = alloc.hold_ips(domains)
+        else:
+            alloc.hold_ip(args.domain, args.address)
+            alloc.domain = args.domain
+            allocations = [alloc]
     except OVMError as e:
         logger.error(e)
         sys.exit(1)
-    print(
-        "The IP address {} is now associated with {}.".format(
-            alloc.address, args.domain
+
+    for allocation in allocations:
+        print(
+            "The IP address {} is now associated with {}.".format(
+                allocation.address, allocation.domain
+            )
         )
-    )
+
+
+def inventory_watch(args):
+    from ovm.vmcli.completion import CompletionIndex
+
+    cache = InventoryCache(Configuration.INVENTORY_CACHE)
+    try:
+        InventoryWatcher(cache, CompletionIndex()).run()
+    except KeyboardInterrupt:
+        pass
+
+
+def inventory_refresh(args):
+    cache = InventoryCache(Configuration.INVENTORY_CACHE)
+    cache.refresh()
+    cache.save()
+
+
+def inventory_flush(args):
+    InventoryCache(Configuration.INVENTORY_CACHE).clear()
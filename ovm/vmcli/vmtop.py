@@ -2,18 +2,331 @@
 # -*- coding: utf-8 -*-
 
 import curses
+import fnmatch
+import heapq
 import libvirt
+import locale
+import sys
 import threading
 import time
+from array import array
+from collections import namedtuple
+from datetime import datetime
 
+from ovm.inventory import Inventory
 from ovm.lvconnect import LibvirtConnect
-from ovm.utils.printer import si_unit
+from ovm.utils.logger import logger
+from ovm.utils.printer import RecordPrinter, si_unit
 
 
 UPDATE_DATA_INTERVAL = 1
 REFRESH_INTERVAL = 0.5
 
-SORT_NAME, SORT_CPU, SORT_MEM = 0, 1, 3
+
+# Samples kept per metric, and the windows shown by the history columns
+HISTORY_SIZE = 900
+HISTORY_WINDOWS = (60, 300, 900)
+
+SPARKLINE_WIDTH = 20
+SPARKLINE_CHARS = "\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+
+TABLES_COLS = (
+    "{name:15}",
+    "{cpu_usage:>8}",
+    "{guest_mem:>10}",
+    "{host_mem:>10}",
+    "{net_rx:>10}",
+    "{net_tx:>10}",
+    "{block_rd:>10}",
+    "{block_wr:>10}",
+)
+
+# Attributes of DomainSample sorting the columns of TABLES_COLS
+SORT_COLUMNS = (
+    "name",
+    "cpu_usage",
+    "guest_mem",
+    "host_mem",
+    "net_rx_rate",
+    "net_tx_rate",
+    "block_rd_rate",
+    "block_wr_rate",
+)
+
+SORT_NAME = SORT_COLUMNS.index("name")
+SORT_CPU = SORT_COLUMNS.index("cpu_usage")
+SORT_MEM = SORT_COLUMNS.index("host_mem")
+
+COLS_NAME = dict(
+    name="NAME",
+    cpu_usage="%CPU",
+    guest_mem="MEM",
+    host_mem="HOST MEM",
+    net_rx="NET RX",
+    net_tx="NET TX",
+    block_rd="BLK RD",
+    block_wr="BLK WR",
+)
+
+HISTORY_COLS = (
+    "{hist_min:>10}",
+    "{hist_avg:>10}",
+    "{hist_max:>10}",
+    "  {sparkline:%d}" % SPARKLINE_WIDTH,
+)
+
+RECORD_FIELDS = (
+    "time",
+    "host",
+    "name",
+    "cpu_usage",
+    "guest_mem",
+    "host_mem",
+    "net_rx_rate",
+    "net_tx_rate",
+    "block_rd_rate",
+    "block_wr_rate",
+)
+
+# Immutable copies of the stats, shared between the collector and the UI
+DomainSample = namedtuple(
+    "DomainSample",
+    (
+        "name",
+        "cpu_usage",
+        "guest_mem",
+        "host_mem",
+        "net_rx_rate",
+        "net_tx_rate",
+        "block_rd_rate",
+        "block_wr_rate",
+        "interfaces",
+        "disks",
+    ),
+)
+
+HostSample = namedtuple(
+    "HostSample",
+    (
+        "hostname",
+        "cpu_count",
+        "cpu_freq",
+        "cpu_usage",
+        "mem_total",
+        "mem_os",
+        "mem_vms_total",
+        "mem_cached",
+        "domain_count",
+    ),
+)
+
+StatsSnapshot = namedtuple("StatsSnapshot", ("version", "host", "domains"))
+
+
+def format_memory(value):
+    return si_unit(value, True) + "B"
+
+
+def format_rate(value):
+    return "{0}bps".format(si_unit(value))
+
+
+# Metrics kept in the history: attribute of DomainStats, title and formatter
+HISTORY_METRICS = (
+    ("cpu_usage", "%CPU", round),
+    ("host_mem", "HOST MEM", format_memory),
+    ("net_rx_rate", "NET RX", format_rate),
+    ("net_tx_rate", "NET TX", format_rate),
+    ("block_rd_rate", "BLK RD", format_rate),
+    ("block_wr_rate", "BLK WR", format_rate),
+)
+
+
+def sparkline(values, width=SPARKLINE_WIDTH):
+    """Draw the values with at most width characters, scaled on their max"""
+    count = len(values)
+    width = min(width, count)
+    buckets = []
+    for i in range(width):
+        chunk = values[i * count // width : (i + 1) * count // width]
+        buckets.append(sum(chunk) / len(chunk))
+
+    top = max(buckets, default=0)
+    last = len(SPARKLINE_CHARS) - 1
+    if top <= 0:
+        return SPARKLINE_CHARS[0] * len(buckets)
+    return "".join(SPARKLINE_CHARS[round(value / top * last)] for value in buckets)
+
+
+def format_sample(sample, pattern, history_metric=None, history=None):
+    """Format a DomainSample
+
+    history is the (summary, values) of history_metric, if one is given.
+    """
+    stats = {
+        "name": sample.name,
+        "cpu_usage": round(sample.cpu_usage),
+        "guest_mem": format_memory(sample.guest_mem),
+        "host_mem": format_memory(sample.host_mem),
+        "net_rx": format_rate(sample.net_rx_rate),
+        "net_tx": format_rate(sample.net_tx_rate),
+        "block_rd": format_rate(sample.block_rd_rate),
+        "block_wr": format_rate(sample.block_wr_rate),
+    }
+
+    if history_metric is not None:
+        _, _, formatter = history_metric
+        summary, values = history or ((0, 0, 0), ())
+        stats.update(
+            zip(("hist_min", "hist_avg", "hist_max"), map(formatter, summary)),
+            sparkline=sparkline(values),
+        )
+
+    return pattern.format(**stats)
+
+
+def format_devices(sample, pattern):
+    """Format one line per network interface and per disk of a DomainSample"""
+    empty = dict.fromkeys(
+        ("cpu_usage", "guest_mem", "host_mem", "net_rx", "net_tx"), ""
+    )
+    empty.update(block_rd="", block_wr="")
+
+    lines = []
+    for name, rx_rate, tx_rate in sample.interfaces:
+        stats = dict(
+            empty,
+            name="  " + name,
+            net_rx=format_rate(rx_rate),
+            net_tx=format_rate(tx_rate),
+        )
+        lines.append(pattern.format(**stats))
+    for name, rd_rate, wr_rate in sample.disks:
+        stats = dict(
+            empty,
+            name="  " + name,
+            block_rd=format_rate(rd_rate),
+            block_wr=format_rate(wr_rate),
+        )
+        lines.append(pattern.format(**stats))
+    return lines
+
+
+def sort_samples(samples, column, reverse=False, top=None):
+    """Sort DomainSamples on a column of TABLES_COLS
+
+    Names are in ascending order and values in descending order, unless
+    reverse is set. With top, only the first top samples are returned, which
+    is cheaper than sorting all of them.
+    """
+    field = SORT_COLUMNS[column]
+    if field == "name":
+        descending = reverse
+
+        def key(sample):
+            return sample.name
+
+    else:
+        descending = False
+        sign = 1 if reverse else -1
+
+        def key(sample):
+            return (sign * getattr(sample, field), sample.name)
+
+    if top is None:
+        return sorted(samples, key=key, reverse=descending)
+    if descending:
+        return heapq.nlargest(top, samples, key=key)
+    return heapq.nsmallest(top, samples, key=key)
+
+
+class DomainFilter:
+    """Select domains with a glob on their name or on a metadata entry
+
+    "web-*" selects the domains by name and "os_name=Debian*" by metadata.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        key, sep, pattern = text.partition("=")
+        if sep:
+            self.key = key.strip().lower()
+            self.pattern = pattern.strip()
+        else:
+            self.key = None
+            self.pattern = text
+
+    def needs_metadata(self):
+        return self.key is not None
+
+    def match(self, name, metadata=None):
+        if self.key is None:
+            return fnmatch.fnmatchcase(name, self.pattern)
+
+        value = (metadata or {}).get(self.key)
+        return value is not None and fnmatch.fnmatchcase(value, self.pattern)
+
+
+class MetricHistory:
+    """Last values of a metric in a fixed-size ring buffer
+
+    Values are stored as 32-bit floats, so the memory used does not grow
+    with the time vmtop runs.
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self._values = array("f", [0]) * size
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._values[self._next] = value
+        self._next = (self._next + 1) % len(self._values)
+        self._count = min(self._count + 1, len(self._values))
+
+    def get_values(self, window=None):
+        """Return the last values, from the oldest to the newest"""
+        size = len(self._values)
+        count = self._count if window is None else min(window, self._count)
+        start = (self._next - count) % size
+        if start + count <= size:
+            return self._values[start : start + count]
+        return self._values[start:] + self._values[: self._next]
+
+    def get_summary(self, window=None):
+        """Return the min, the average and the max of the last values"""
+        values = self.get_values(window)
+        if not values:
+            return 0, 0, 0
+        return min(values), sum(values) / len(values), max(values)
+
+
+class DeviceStats:
+    """Throughput of one network interface or one disk of a domain
+
+    For a disk, the received and transmitted bytes are the read and written
+    ones.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+        self.rx_bytes = self.tx_bytes = 0
+        self.rx_rate = self.tx_rate = 0
+
+    def update(self, rx_bytes, tx_bytes, elapsed):
+        # A counter going backwards means that the device was replaced
+        if 0 < self.rx_bytes <= rx_bytes:
+            self.rx_rate = (rx_bytes - self.rx_bytes) * 8 / elapsed
+
+        if 0 < self.tx_bytes <= tx_bytes:
+            self.tx_rate = (tx_bytes - self.tx_bytes) * 8 / elapsed
+
+        self.rx_bytes = rx_bytes
+        self.tx_bytes = tx_bytes
 
 
 class DomainStats:
@@ -31,94 +344,129 @@ class DomainStats:
         self.host_mem = self.guest_mem = 0
 
         # Network
-        self.net_rx_bytes = self.net_tx_bytes = 0
+        self.interfaces = {}
         self.net_rx_rate = self.net_tx_rate = 0
 
         # Storage
-        self.block_rd_bytes = self.block_wr_bytes = 0
+        self.disks = {}
         self.block_rd_rate = self.block_wr_rate = 0
 
+        self.history = {name: MetricHistory() for name, _, _ in HISTORY_METRICS}
+
     @staticmethod
-    def compute_cpu_usage(prev, cur, cpu_count):
-        return min((cur - prev) / (UPDATE_DATA_INTERVAL * cpu_count * 10**7), 100)
+    def compute_cpu_usage(prev, cur, cpu_count, elapsed):
+        return min((cur - prev) / (elapsed * cpu_count * 10**7), 100)
 
-    def update_cpu(self, stats):
+    def update_cpu(self, stats, elapsed):
         previous_cpu_time = self.cpu_time
-        domain_cpu_count = stats.get("vcpu.current", 1)
 
-        sum_time = 0
-        for i in range(domain_cpu_count):
-            sum_time += stats.get("vcpu.0.time", 0)
-        current_cpu_time = sum_time / domain_cpu_count
+        # Offline vCPUs have no entry, so look for all the possible ones
+        domain_cpu_count = stats.get("vcpu.maximum", stats.get("vcpu.current", 0))
+        current_cpu_time = sum(
+            stats.get("vcpu.%d.time" % i, 0) for i in range(domain_cpu_count)
+        )
 
-        if previous_cpu_time > 0:
+        if 0 < previous_cpu_time <= current_cpu_time:
             self.cpu_usage = self.compute_cpu_usage(
-                previous_cpu_time, current_cpu_time, self.host_stats.cpu_count
+                previous_cpu_time,
+                current_cpu_time,
+                self.host_stats.cpu_count,
+                elapsed,
             )
 
         self.cpu_time = current_cpu_time
 
-    def update_memory(self, stats):
+    def update_memory(self, stats, elapsed):
         # Current memory allocated on the host
-        self.host_mem = self.domain.memoryStats().get("rss", 0) * 1024
+        self.host_mem = stats.get("balloon.rss", 0) * 1024
 
         # guest current max memory
         self.guest_mem = stats.get("balloon.maximum", 0) * 1024
 
-    def update_network(self, stats):
-        current_rx_bytes = stats.get("net.0.rx.bytes", 0)
-        current_tx_bytes = stats.get("net.0.tx.bytes", 0)
-        previous_rx_bytes = self.net_rx_bytes
-        previous_tx_bytes = self.net_tx_bytes
-
-        if previous_rx_bytes > 0:
-            self.net_rx_rate = (
-                (current_rx_bytes - previous_rx_bytes) * 8 / UPDATE_DATA_INTERVAL
+    @staticmethod
+    def update_devices(devices, stats, prefix, counters, elapsed):
+        """Update the stats of the devices and forget the removed ones"""
+        rx_key, tx_key = counters
+        current = {}
+        for i in range(stats.get("%s.count" % prefix, 0)):
+            key = "%s.%d." % (prefix, i)
+            name = stats.get(key + "name", str(i))
+            device = devices.get(name) or DeviceStats(name)
+            device.update(
+                stats.get(key + rx_key, 0), stats.get(key + tx_key, 0), elapsed
             )
+            current[name] = device
+        return current
 
-        if previous_tx_bytes > 0:
-            self.net_tx_rate = (
-                (current_tx_bytes - previous_tx_bytes) * 8 / UPDATE_DATA_INTERVAL
-            )
+    def update_network(self, stats, elapsed):
+        self.interfaces = self.update_devices(
+            self.interfaces, stats, "net", ("rx.bytes", "tx.bytes"), elapsed
+        )
+        self.net_rx_rate = sum(i.rx_rate for i in self.interfaces.values())
+        self.net_tx_rate = sum(i.tx_rate for i in self.interfaces.values())
 
-        self.net_rx_bytes = current_rx_bytes
-        self.net_tx_bytes = current_tx_bytes
+    def update_storage(self, stats, elapsed):
+        self.disks = self.update_devices(
+            self.disks, stats, "block", ("rd.bytes", "wr.bytes"), elapsed
+        )
+        self.block_rd_rate = sum(d.rx_rate for d in self.disks.values())
+        self.block_wr_rate = sum(d.tx_rate for d in self.disks.values())
 
-    def update_storage(self, stats):
-        current_rd_bytes = stats.get("block.0.rd.bytes", 0)
-        current_wd_bytes = stats.get("block.0.wr.bytes", 0)
-        previous_rd_bytes = self.block_rd_bytes
-        previous_wd_bytes = self.block_wr_bytes
+    def update(self, stats, elapsed=UPDATE_DATA_INTERVAL):
+        for name in ("cpu", "memory", "network", "storage"):
+            getattr(self, "update_%s" % name)(stats, elapsed)
 
-        if previous_rd_bytes > 0:
-            self.block_rd_rate = (
-                (current_rd_bytes - previous_rd_bytes) * 8 / UPDATE_DATA_INTERVAL
-            )
+        for name, history in self.history.items():
+            history.append(getattr(self, name))
 
-        if previous_wd_bytes > 0:
-            self.block_wr_rate = (
-                (current_wd_bytes - previous_wd_bytes) * 8 / UPDATE_DATA_INTERVAL
+    def get_sample(self):
+        def devices(devices):
+            return tuple(
+                (device.name, device.rx_rate, device.tx_rate)
+                for device in sorted(devices.values(), key=lambda d: d.name)
             )
 
-        self.block_rd_bytes = current_rd_bytes
-        self.block_wr_bytes = current_wd_bytes
-
-    def update(self, stats):
-        for name in ("cpu", "memory", "network", "storage"):
-            getattr(self, "update_%s" % name)(stats)
+        return DomainSample(
+            self.name,
+            self.cpu_usage,
+            self.guest_mem,
+            self.host_mem,
+            self.net_rx_rate,
+            self.net_tx_rate,
+            self.block_rd_rate,
+            self.block_wr_rate,
+            devices(self.interfaces),
+            devices(self.disks),
+        )
 
-    def format(self, pattern):
-        stats = {
+    def get_history(self, name, window=None):
+        """Return the summary and the values of a metric on a window"""
+        history = self.history[name]
+        return history.get_summary(window), history.get_values(window)
+
+    def format(self, pattern, history_metric=None, window=None):
+        """Format the stats, with the history of a metric if one is given"""
+        history = None
+        if history_metric is not None:
+            history = self.get_history(history_metric[0], window)
+        return format_sample(self.get_sample(), pattern, history_metric, history)
+
+    def get_record(self):
+        """Return the raw values of the stats, rates are in bits per second"""
+        return {
             "name": self.name,
-            "cpu_usage": round(self.cpu_usage),
-            "guest_mem": si_unit(self.guest_mem, True) + "B",
-            "host_mem": si_unit(self.host_mem, True) + "B",
-            "net_rx": "{0}bps".format(si_unit(self.net_rx_rate)),
-            "net_tx": "{0}bps".format(si_unit(self.net_tx_rate)),
-            "block_rd": "{0}bps".format(si_unit(self.block_rd_rate)),
-            "block_wr": "{0}bps".format(si_unit(self.block_wr_rate)),
+            "cpu_usage": round(self.cpu_usage, 2),
+            "guest_mem": self.guest_mem,
+            "host_mem": self.host_mem,
+            "net_rx_rate": round(self.net_rx_rate),
+            "net_tx_rate": round(self.net_tx_rate),
+            "block_rd_rate": round(self.block_rd_rate),
+            "block_wr_rate": round(self.block_wr_rate),
         }
-        return pattern.format(**stats)
+
+    def format_devices(self, pattern):
+        """Format one line per network interface and per disk"""
+        return format_devices(self.get_sample(), pattern)
 
 
 class HostStats:
@@ -140,7 +488,10 @@ class HostStats:
 
         self.domain_count = 0
 
-    def update(self, total_mem_domain, domain_count):
+    def get_sample(self):
+        return HostSample(*(getattr(self, field) for field in HostSample._fields))
+
+    def update(self, total_mem_domain, domain_count, elapsed=UPDATE_DATA_INTERVAL):
         self.domain_count = domain_count
 
         host_info = self._connection.getInfo()
@@ -153,9 +504,7 @@ class HostStats:
         )
 
         if self.cpu_time > 0:
-            self.cpu_usage = min(
-                1, ((cpu_time - self.cpu_time) / (UPDATE_DATA_INTERVAL * 10**9))
-            )
+            self.cpu_usage = min(1, ((cpu_time - self.cpu_time) / (elapsed * 10**9)))
         self.cpu_time = cpu_time
 
         mem_stats = self._connection.getMemoryStats(
@@ -173,16 +522,170 @@ class HostStats:
         self.mem_cached = (mem_stats["cached"] - mem_stats["buffers"]) * 1024
 
 
-class VMTop:
-    def __init__(self):
+class StatsCollector:
+    """Collect the stats of all the running domains in one bulk call
+
+    The rates are computed from the time actually elapsed between two
+    samples. Domains started or stopped are taken into account as soon as
+    libvirt sends the lifecycle event, without waiting for the next sample.
+    """
+
+    STATS = (
+        libvirt.VIR_DOMAIN_STATS_STATE
+        | libvirt.VIR_DOMAIN_STATS_BALLOON
+        | libvirt.VIR_DOMAIN_STATS_VCPU
+        | libvirt.VIR_DOMAIN_STATS_INTERFACE
+        | libvirt.VIR_DOMAIN_STATS_BLOCK
+    )
+
+    REMOVED_EVENTS = (
+        libvirt.VIR_DOMAIN_EVENT_UNDEFINED,
+        libvirt.VIR_DOMAIN_EVENT_SHUTDOWN,
+        libvirt.VIR_DOMAIN_EVENT_STOPPED,
+    )
+
+    def __init__(self, connection, interval=UPDATE_DATA_INTERVAL):
+        self._connection = connection
+        self.interval = interval
+
+        self.host_stats = HostStats(connection)
+
         self._domains = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._last_sample = None
+        self._snapshot = StatsSnapshot(0, self.host_stats.get_sample(), ())
+
+    def get_domains(self):
+        """Return the DomainStats, to use in the thread running the collector"""
+        with self._lock:
+            return list(self._domains.values())
+
+    def get_snapshot(self):
+        """Return the last StatsSnapshot, which can be used from any thread"""
+        with self._lock:
+            return self._snapshot
+
+    def get_histories(self, names, metric, window=None):
+        """Return the history of a metric for some domains, by name"""
+        with self._lock:
+            return {
+                name: self._domains[name].get_history(metric, window)
+                for name in names
+                if name in self._domains
+            }
+
+    def _publish(self):
+        # Must be called with the lock held
+        self._snapshot = StatsSnapshot(
+            self._snapshot.version + 1,
+            self.host_stats.get_sample(),
+            tuple(domain.get_sample() for domain in self._domains.values()),
+        )
 
-        self.libvirt_conn = LibvirtConnect.get_connection()
+    def collect(self):
+        now = time.monotonic()
+        if self._last_sample is None:
+            elapsed = self.interval
+        else:
+            elapsed = now - self._last_sample
+        self._last_sample = now
 
-        self._sort_on = SORT_NAME
+        all_stats = self._connection.getAllDomainStats(
+            self.STATS, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING
+        )
+
+        domains = {}
+        total_mem_domain = 0
+        with self._lock:
+            for domain, libvirt_stats in all_stats:
+                name = domain.name()
+                domain_stats = self._domains.get(name)
+                if domain_stats is None:
+                    domain_stats = DomainStats(domain, self.host_stats)
+                domain_stats.update(libvirt_stats, elapsed)
+                total_mem_domain += domain_stats.host_mem
+                domains[name] = domain_stats
+
+            # Domains not in the stats are not running anymore
+            self._domains = domains
+
+        self.host_stats.update(total_mem_domain, len(domains), elapsed)
+
+        with self._lock:
+            self._publish()
+
+    def run(self, on_sample=None):
+        """Collect the stats forever, on_sample is called after each sample"""
+        while True:
+            self._wakeup.clear()
+            try:
+                self.collect()
+            except libvirt.libvirtError as err:
+                logger.warning("Cannot collect the stats: %s", err)
+            else:
+                if on_sample is not None:
+                    on_sample()
+            self._wakeup.wait(self.interval)
+
+    def watch_events(self):
+        """Sample again as soon as a domain is started or stopped
 
-        self.host_stats = HostStats(self.libvirt_conn)
+        The libvirt event loop must be registered before the connection is
+        opened, and run by the caller.
+        """
+        try:
+            self._connection.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_lifecycle, None
+            )
+        except libvirt.libvirtError as err:
+            logger.debug("Cannot watch the domain events: %s", err)
+
+    def _on_lifecycle(self, connection, vir_domain, event, detail, opaque):
+        if event in self.REMOVED_EVENTS:
+            with self._lock:
+                if self._domains.pop(vir_domain.name(), None) is not None:
+                    self._publish()
+        self._wakeup.set()
+
+
+class VMTop:
+    """Show the stats in a curses interface
+
+    The interface is drawn from the immutable snapshots of the collector, in
+    the thread reading the keys. Only the visible rows are formatted, and
+    only the lines which changed since the last frame are drawn again.
+    """
+
+    # Lines above the table of the domains
+    TOP_LINES = 5
+
+    def __init__(self):
+        # The event loop must be registered before opening the connection
+        libvirt.virEventRegisterDefaultImpl()
+        self.libvirt_conn = LibvirtConnect.get_connection()
 
+        self._sort_on = SORT_NAME
+        self._sort_reverse = False
+        self._filter = None
+        self._top = None
+        self._show_devices = False
+        self._history_metric = 0
+        self._history_window = 0
+        self._scroll = 0
+        self._page_size = 1
+
+        # Metadata of the domains, read when a filter needs it
+        self._metadata = {}
+
+        # Lines on the screen and the state they were drawn from
+        self._drawn = {}
+        self._drawn_state = None
+
+        self.collector = StatsCollector(self.libvirt_conn)
+
+        # Needed by curses to draw the sparklines
+        locale.setlocale(locale.LC_ALL, "")
         self.screen = curses.initscr()
         self.init_terminal()
 
@@ -208,15 +711,24 @@ class VMTop:
             self.reset_terminal()
 
     def main(self):
-        refresh_thread = threading.Thread(target=self.refresh)
-        refresh_thread.daemon = True
-        refresh_thread.start()
-
-        update_data_thread = threading.Thread(target=self.update_data)
+        update_data_thread = threading.Thread(target=self.collector.run)
         update_data_thread.daemon = True
         update_data_thread.start()
 
+        self.collector.watch_events()
+        events_thread = threading.Thread(target=self.run_events)
+        events_thread.daemon = True
+        events_thread.start()
+
+        # Wait for a key at most until the next refresh
+        self.screen.timeout(int(REFRESH_INTERVAL * 1000))
+
         while True:
+            try:
+                self.refresh_interface()
+            except curses.error:
+                pass
+
             event = self.screen.getch()
             if event == ord("c"):
                 self._sort_on = SORT_CPU
@@ -224,6 +736,38 @@ class VMTop:
                 self._sort_on = SORT_NAME
             elif event == ord("m"):
                 self._sort_on = SORT_MEM
+            elif event in (ord("<"), curses.KEY_LEFT):
+                self._sort_on = (self._sort_on - 1) % len(SORT_COLUMNS)
+            elif event in (ord(">"), curses.KEY_RIGHT):
+                self._sort_on = (self._sort_on + 1) % len(SORT_COLUMNS)
+            elif event == ord("r"):
+                self._sort_reverse = not self._sort_reverse
+            elif event == ord("/"):
+                self.set_filter(self.prompt("Filter (name glob or key=glob): "))
+            elif event == ord("t"):
+                self.set_top(self.prompt("Show the top N VMs: "))
+            elif event == ord("d"):
+                self._show_devices = not self._show_devices
+            elif event == ord("h"):
+                self._history_metric += 1
+                self._history_metric %= len(HISTORY_METRICS)
+            elif event == ord("w"):
+                self._history_window += 1
+                self._history_window %= len(HISTORY_WINDOWS)
+            elif event == curses.KEY_UP:
+                self._scroll -= 1
+            elif event == curses.KEY_DOWN:
+                self._scroll += 1
+            elif event == curses.KEY_PPAGE:
+                self._scroll -= self._page_size
+            elif event == curses.KEY_NPAGE:
+                self._scroll += self._page_size
+            elif event == curses.KEY_HOME:
+                self._scroll = 0
+            elif event == curses.KEY_END:
+                self._scroll = sys.maxsize
+            elif event == curses.KEY_RESIZE:
+                self.resize()
             elif event == ord("q"):
                 break
 
@@ -242,39 +786,79 @@ class VMTop:
         curses.echo()
         curses.endwin()
 
-    def update_data(self):
-        while True:
-            self._update_data()
-            time.sleep(UPDATE_DATA_INTERVAL)
+    def prompt(self, text):
+        """Read a line typed on the status line"""
+        y = self.TOP_LINES - 1
+        width = self.screen.getmaxyx()[1]
 
-    def _update_data(self):
-        total_mem_domain = 0
+        self.screen.timeout(-1)
+        curses.echo()
+        curses.curs_set(1)
+        try:
+            self.screen.move(y, 0)
+            self.screen.clrtoeol()
+            self.screen.addstr(y, 1, text)
+            value = self.screen.getstr(y, len(text) + 1, width - len(text) - 2)
+        finally:
+            curses.noecho()
+            curses.curs_set(0)
+            self.screen.timeout(int(REFRESH_INTERVAL * 1000))
+            self._drawn.pop(y, None)
+            self._drawn_state = None
 
-        domains = self.libvirt_conn.getAllDomainStats(
-            flags=libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING
-        )
+        return value.decode("utf-8", "replace").strip()
 
-        current_domains = set()
-        for domain, libvirt_stats in domains:
-            name = domain.name()
-            current_domains.add(name)
-            if name not in self._domains:
-                self._domains[name] = DomainStats(domain, self.host_stats)
+    def set_filter(self, text):
+        self._filter = DomainFilter(text) if text else None
+        self._metadata = {}
+        self._scroll = 0
 
-            self._domains[name].update(libvirt_stats)
-            total_mem_domain += self._domains[name].host_mem
+    def set_top(self, text):
+        try:
+            self._top = max(int(text), 1) if text else None
+        except ValueError:
+            curses.beep()
+        self._scroll = 0
 
-        # Delete all domains not active in domain stats list
-        deleted_domains = set(self._domains.keys()) - current_domains
-        list(map(self._domains.pop, deleted_domains))
+    def get_metadata(self, name):
+        if name not in self._metadata:
+            try:
+                self._metadata[name] = dict(
+                    Inventory.get_domain(name, cached=True).metadata
+                )
+            except libvirt.libvirtError:
+                self._metadata[name] = {}
+        return self._metadata[name]
+
+    def select_domains(self, domains):
+        """Filter and sort the DomainSamples to show"""
+        if self._filter is not None:
+            if self._filter.needs_metadata():
+                domains = [
+                    sample
+                    for sample in domains
+                    if self._filter.match(sample.name, self.get_metadata(sample.name))
+                ]
+            else:
+                domains = [
+                    sample for sample in domains if self._filter.match(sample.name)
+                ]
 
-        domain_count = len(current_domains)
+        return sort_samples(domains, self._sort_on, self._sort_reverse, self._top)
 
-        self.host_stats.update(total_mem_domain, domain_count)
+    def resize(self):
+        # Draw everything again on the next refresh
+        curses.update_lines_cols()
+        self.screen.clear()
+        self._drawn = {}
+        self._drawn_state = None
 
-    def draw_host_bar(self, line):
-        style = self.CYAN_ON_BLACK
+    @staticmethod
+    def run_events():
+        while True:
+            libvirt.virEventRunDefaultImpl()
 
+    def format_host_bar(self, host):
         bar_format = "  ::  ".join(
             (
                 "{hostname}",
@@ -285,169 +869,257 @@ class VMTop:
         )
 
         text = bar_format.format(
-            hostname=self.host_stats.hostname,
-            cpu_count=self.host_stats.cpu_count,
-            cpu_freq=int(self.host_stats.cpu_freq / 10**6),
-            mem_total=si_unit(self.host_stats.mem_total),
-            domain_count=self.host_stats.domain_count,
+            hostname=host.hostname,
+            cpu_count=host.cpu_count,
+            cpu_freq=int(host.cpu_freq / 10**6),
+            mem_total=si_unit(host.mem_total),
+            domain_count=host.domain_count,
         )
 
-        self.screen.addstr(line, 0, text, style)
-        self.screen.clrtoeol()
+        return [(text, self.CYAN_ON_BLACK)]
 
-    def draw_cpu_bar(self, line):
+    def format_cpu_bar(self, host):
         # Some params
         bar_graph_width = 40
 
-        # Inialize the line
-        self.screen.move(line, 0)
-        self.screen.clrtoeol()
+        pipe_count = int(round(host.cpu_usage * bar_graph_width))
+
+        return [
+            (" CPU", self.CYAN_ON_BLACK),
+            ("  [", 0),
+            ("|" * pipe_count, self.RED_ON_BLACK),
+            (" " * (bar_graph_width - pipe_count) + "]  ", 0),
+            ("{0} %".format(round(host.cpu_usage * 100)), 0),
+        ]
 
-        # Show 'CPU'
-        self.screen.move(line, 1)
-        self.screen.addstr("CPU", self.CYAN_ON_BLACK)
+    def format_memory_bar(self, host):
+        # Some params
+        bar_graph_width = 40
 
-        # Print the left side of the bar graph
-        self.screen.addstr("  [")
+        segments = [(" Mem", self.CYAN_ON_BLACK), ("  [", 0)]
 
-        # Print the memory take by OS
-        pipe_count = int(round(self.host_stats.cpu_usage * bar_graph_width))
-        self.screen.addstr("|" * pipe_count, self.RED_ON_BLACK)
+        # Print the memory taken by OS, by VMs and the memory cached
+        current_bar_size = 0
+        if host.mem_total > 0:
+            for value, color in (
+                (host.mem_os, self.RED_ON_BLACK),
+                (host.mem_vms_total, self.GREEN_ON_BLACK),
+                (host.mem_cached, self.YELLOW_ON_BLACK),
+            ):
+                size = int(round(value / host.mem_total * bar_graph_width))
+                segments.append(("|" * size, color))
+                current_bar_size += size
+
+        segments += [
+            (" " * (bar_graph_width - current_bar_size) + "]  ", 0),
+            ("{0}B".format(si_unit(host.mem_os, True)), self.RED_ON_BLACK),
+            (" / ", 0),
+            ("{0}B".format(si_unit(host.mem_vms_total, True)), self.GREEN_ON_BLACK),
+            (" / {0}B".format(si_unit(host.mem_total, True)), 0),
+        ]
+        return segments
+
+    def format_header(self, width):
+        segments = []
+        for i, pattern in enumerate(TABLES_COLS):
+            if self._sort_on == i:
+                color = self.TABLE_HEADER_SELECTED
+            else:
+                color = self.TABLE_HEADER
+            segments.append((pattern.format(**COLS_NAME), color))
 
-        # Print the right side of the bar graph
-        _, x = self.screen.getyx()
-        self.screen.move(line, x + bar_graph_width - pipe_count)
-        self.screen.addstr("]  ")
+        history_metric = HISTORY_METRICS[self._history_metric]
+        window = HISTORY_WINDOWS[self._history_window]
+        title = "{0} {1}s".format(history_metric[1], window * UPDATE_DATA_INTERVAL)
+        text = "".join(HISTORY_COLS).format(
+            hist_min="MIN", hist_avg="AVG", hist_max="MAX", sparkline=title
+        )
+        segments.append((text, self.TABLE_HEADER_SELECTED))
 
-        self.screen.addstr("{0} %".format(round(self.host_stats.cpu_usage * 100)))
+        # Fill the rest of the line with the color of the header
+        used = sum(len(text) for text, _ in segments)
+        segments.append((" " * max(width - used, 0), self.TABLE_HEADER))
+        return segments
 
-    def draw_memory_bar(self, line):
-        current_bar_size = 0
+    def format_domains(self, domains, height):
+        """Format the rows of the domains visible from the scroll position
 
-        # Some params
-        bar_graph_width = 40
+        Return the number of domains shown and the lines.
+        """
+        history_metric = HISTORY_METRICS[self._history_metric]
+        window = HISTORY_WINDOWS[self._history_window]
 
-        # Inialize the line
-        self.screen.move(line, 0)
-        self.screen.clrtoeol()
+        shown = []
+        line_count = 0
+        for sample in domains[self._scroll :]:
+            if line_count >= height:
+                break
+            shown.append(sample)
+            line_count += 1
+            if self._show_devices:
+                line_count += len(sample.interfaces) + len(sample.disks)
 
-        # Show 'Mem'
-        self.screen.move(line, 1)
-        self.screen.addstr("Mem", self.CYAN_ON_BLACK)
-
-        # Print the left side of the bar graph
-        self.screen.addstr("  [")
-
-        # Print the memory take by OS
-        if self.host_stats.mem_total > 0:
-            ratio = self.host_stats.mem_os / self.host_stats.mem_total
-            mem_os_size = int(round(ratio * bar_graph_width))
-            self.screen.addstr("|" * mem_os_size, self.RED_ON_BLACK)
-            current_bar_size += mem_os_size
-
-        # Print the memory take by VMs
-        if self.host_stats.mem_total > 0:
-            ratio = self.host_stats.mem_vms_total / self.host_stats.mem_total
-            mem_vms_size = int(round(ratio * bar_graph_width))
-            self.screen.addstr("|" * mem_vms_size, self.GREEN_ON_BLACK)
-            current_bar_size += mem_vms_size
-
-        # Print the memory cached
-        if self.host_stats.mem_total > 0:
-            ratio = self.host_stats.mem_cached / self.host_stats.mem_total
-            mem_cached_size = int(round(ratio * bar_graph_width))
-            self.screen.addstr("|" * mem_cached_size, self.YELLOW_ON_BLACK)
-            current_bar_size += mem_cached_size
-
-        # Print the right side of the bar graph
-        _, x = self.screen.getyx()
-        self.screen.move(line, x + bar_graph_width - current_bar_size)
-        self.screen.addstr("]  ")
-
-        # Print the text aside
-        self.screen.addstr(
-            "{0}B".format(si_unit(self.host_stats.mem_os, True)), self.RED_ON_BLACK
+        histories = self.collector.get_histories(
+            [sample.name for sample in shown], history_metric[0], window
         )
 
-        self.screen.addstr(" / ")
+        pattern = "".join(TABLES_COLS)
+        history_pattern = pattern + "".join(HISTORY_COLS)
+        lines = []
+        for sample in shown:
+            text = format_sample(
+                sample, history_pattern, history_metric, histories.get(sample.name)
+            )
+            lines.append([(text, 0)])
+            if self._show_devices:
+                lines += [[(text, 0)] for text in format_devices(sample, pattern)]
+        return len(shown), lines[:height]
+
+    def draw_line(self, y, segments, width):
+        self.screen.move(y, 0)
+
+        # Never write on the last column, curses fails on the last line
+        x = 0
+        for text, color in segments:
+            text = text[: width - 1 - x]
+            if text:
+                self.screen.addstr(text, color)
+                x += len(text)
+        self.screen.clrtoeol()
 
-        self.screen.addstr(
-            "{0}B".format(si_unit(self.host_stats.mem_vms_total, True)),
-            self.GREEN_ON_BLACK,
+    def refresh_interface(self):
+        snapshot = self.collector.get_snapshot()
+        height, width = self.screen.getmaxyx()
+
+        # Nothing to draw if neither the stats nor the display changed
+        state = (
+            snapshot.version,
+            height,
+            width,
+            self._sort_on,
+            self._sort_reverse,
+            self._filter and self._filter.text,
+            self._top,
+            self._show_devices,
+            self._history_metric,
+            self._history_window,
+            self._scroll,
         )
+        if state == self._drawn_state:
+            return
 
-        self.screen.addstr(" / {0}B".format(si_unit(self.host_stats.mem_total, True)))
-
-    def draw_domains(self, line):
-        # Initialize columns
-        TABLES_COLS = (
-            "{name:15}",
-            "{cpu_usage:>8}",
-            "{guest_mem:>10}",
-            "{host_mem:>10}",
-            "{net_rx:>10}",
-            "{net_tx:>10}",
-            "{block_rd:>10}",
-            "{block_wr:>10}",
-        )
+        domains = self.select_domains(snapshot.domains)
 
-        # Prepare table header
-        COLS_NAME = dict(
-            name="NAME",
-            cpu_usage="%CPU",
-            guest_mem="MEM",
-            host_mem="HOST MEM",
-            net_rx="NET RX",
-            net_tx="NET TX",
-            block_rd="BLK RD",
-            block_wr="BLK WR",
+        self._page_size = max(height - self.TOP_LINES - 1, 1)
+        self._scroll = max(min(self._scroll, len(domains) - self._page_size), 0)
+
+        shown, rows = self.format_domains(domains, self._page_size)
+        status = "VMs {0}-{1} of {2}".format(
+            min(self._scroll + 1, len(domains)),
+            self._scroll + shown,
+            len(domains),
         )
+        if self._filter is not None:
+            status += "  ::  Filter: {0}".format(self._filter.text)
+        if self._top is not None:
+            status += "  ::  Top {0}".format(self._top)
+
+        lines = [
+            self.format_host_bar(snapshot.host),
+            [],
+            self.format_cpu_bar(snapshot.host),
+            self.format_memory_bar(snapshot.host),
+            [(" " + status, 0)],
+            self.format_header(width),
+        ] + rows
+
+        for y in range(height):
+            segments = lines[y] if y < len(lines) else []
+            if self._drawn.get(y) != segments:
+                self.draw_line(y, segments, width)
+                self._drawn[y] = segments
 
-        # Draw the header
-        self.screen.move(line, 0)
+        self.screen.refresh()
+        self._drawn_state = state[:-1] + (self._scroll,)
 
-        for i, pattern in enumerate(TABLES_COLS):
-            if self._sort_on == i:
-                color = self.TABLE_HEADER_SELECTED
-            else:
-                color = self.TABLE_HEADER
-            text = pattern.format(**COLS_NAME)
-            self.screen.addstr(text, color)
 
-        self.screen.addstr(
-            " " * (self.screen.getmaxyx()[1] - self.screen.getyx()[1]),
-            self.TABLE_HEADER,
-        )
+class VMTopBatch:
+    """Print samples of the stats without curses, like top -b
 
-        domains = list(self._domains.values())
-        domains.sort(key=lambda dom: dom.name)
+    The first sample is only used to compute the rates of the next ones.
+    """
 
-        if self._sort_on == SORT_CPU:
-            domains.sort(key=lambda dom: dom.cpu_usage, reverse=True)
-        elif self._sort_on == SORT_MEM:
-            domains.sort(key=lambda dom: dom.host_mem, reverse=True)
+    def __init__(
+        self,
+        interval=UPDATE_DATA_INTERVAL,
+        count=None,
+        output_format="table",
+        output=None,
+    ):
+        self.interval = interval
+        self.count = count
+        self.format = output_format
+        self.output = output or sys.stdout
 
-        for domain in domains:
-            self.screen.addstr(domain.format("".join(TABLES_COLS)))
-            self.screen.clrtoeol()
-            self.screen.addch("\n")
-        self.screen.clrtobot()
+        self.collector = StatsCollector(LibvirtConnect.get_connection(), interval)
+        self.host_stats = self.collector.host_stats
 
-    def refresh_interface(self):
-        self.draw_host_bar(0)
-        self.draw_cpu_bar(2)
-        self.draw_memory_bar(3)
-        self.draw_domains(5)
-        self.screen.refresh()
+    def run(self):
+        printer = None
+        if self.format != "table":
+            printer = RecordPrinter(self.format, RECORD_FIELDS, self.output)
 
-    def refresh(self):
-        while True:
-            try:
-                self.refresh_interface()
-            except curses.error:
-                pass
-            finally:
-                time.sleep(REFRESH_INTERVAL)
+        try:
+            self.collector.collect()
+            next_sample = time.monotonic()
+            sample = 0
+            while self.count is None or sample < self.count:
+                next_sample += self.interval
+                time.sleep(max(0, next_sample - time.monotonic()))
+                self.collector.collect()
+
+                if printer is None:
+                    self.print_table()
+                else:
+                    self.print_records(printer)
+                sample += 1
+        finally:
+            if printer is not None:
+                printer.close()
+
+    def print_records(self, printer):
+        now = datetime.now().isoformat(timespec="seconds")
+        domains = self.collector.get_domains()
+        for domain in sorted(domains, key=lambda dom: dom.name):
+            record = domain.get_record()
+            record.update(time=now, host=self.host_stats.hostname)
+            printer.write(record)
+
+    def print_table(self):
+        host = self.host_stats
+        lines = [
+            "  ::  ".join(
+                (
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    host.hostname,
+                    "CPU: {0} %".format(round(host.cpu_usage * 100)),
+                    "Memory: {0}B / {1}B / {2}B".format(
+                        si_unit(host.mem_os, True),
+                        si_unit(host.mem_vms_total, True),
+                        si_unit(host.mem_total, True),
+                    ),
+                    "Domains: {0}".format(host.domain_count),
+                )
+            ),
+            "".join(TABLES_COLS).format(**COLS_NAME),
+        ]
+
+        domains = self.collector.get_domains()
+        for domain in sorted(domains, key=lambda dom: dom.name):
+            lines.append(domain.format("".join(TABLES_COLS)))
+
+        self.output.write("\n".join(lines) + "\n\n")
+        self.output.flush()
 
 
 if __name__ == "__main__":
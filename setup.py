@@ -17,7 +17,13 @@ setup(
     install_requires=["pyaml==5.4.1", "sphinx=7.2.6"],
     packages=find_packages(),
     data_files=[("bash_completion.d", ["bin/vm-completion"])],
-    entry_points={"console_scripts": ["vm = ovm.vmcli.__main__:main"]},
+    entry_points={
+        "console_scripts": [
+            "vm = ovm.vmcli.__main__:main",
+            "ovmd = ovm.vmcli.daemon:main",
+            "vm-complete = ovm.vmcli.completion:main",
+        ]
+    },
 )
 
 if not os.path.exists(Configuration.ETC):
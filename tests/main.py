@@ -12,9 +12,24 @@ sys.path.insert(1, ROOT)
 
 from test_driver_loader import TestDriverLoader  # noqa
 from test_resource_loader import TestResourceLoader  # noqa
-from test_template import TestTemplate  # noqa
+from test_template import TestTemplate, TestTemplateCache  # noqa
+from test_template import TestConvertOptions  # noqa
 from test_ip_allocation import TestIpAllocation  # noqa
+from test_creation import TestVMCreation  # noqa
+from test_ip_index import TestFreeIpIndex  # noqa
+from test_ip_allocation_concurrency import TestIpAllocationConcurrency  # noqa
 from test_network import TestNetwork  # noqa
+from test_printer import TestRecordPrinter  # noqa
+from test_startup import TestStartup  # noqa
+from test_domain_stats import TestDomainStats, TestMetricHistory  # noqa
+from test_domain_stats import TestDomainSelection  # noqa
+from test_exporter import TestExporter  # noqa
+from test_daemon import TestDaemon  # noqa
+from test_completion import TestCompletionIndex  # noqa
+from test_inventory_cache import TestInventoryCache, TestInventoryWatcher  # noqa
+from test_image_cache import TestImageCache  # noqa
+from test_fastcopy import TestFastCopy  # noqa
+from test_lvm import TestLvmDriver  # noqa
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ovm.configuration import Configuration
+from ovm.templates.template import Template
+from ovm.vmcli.completion import CompletionIndex
+
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+TEMPLATES_PATH = os.path.abspath(os.path.join(ROOT, "../etc/templates/examples"))
+
+RESOURCES = """
+storage:
+  {storage}:
+    driver: file
+    root: /tmp
+networks:
+  lan:
+    driver: bridge
+"""
+
+
+class ListingIndex(CompletionIndex):
+    """Index listing fake domains instead of calling libvirt"""
+
+    listed = {"vm-listed": True}
+
+    @classmethod
+    def list_domains(cls, connection=None):
+        return dict(cls.listed)
+
+
+class TestCompletionIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self._tmpdir, "completion-index")
+        self._saved = (
+            Configuration.RESOURCE_CONFIG,
+            Configuration.ETC_TEMPLATES,
+            Template.TEMPLATES_PATH,
+            Template.CACHE_PATH,
+        )
+        Configuration.RESOURCE_CONFIG = os.path.join(self._tmpdir, "resources.yml")
+        Configuration.ETC_TEMPLATES = TEMPLATES_PATH
+        Template.TEMPLATES_PATH = TEMPLATES_PATH
+        Template.CACHE_PATH = os.path.join(self._tmpdir, "templates-cache.pickle")
+
+    def tearDown(self):
+        (
+            Configuration.RESOURCE_CONFIG,
+            Configuration.ETC_TEMPLATES,
+            Template.TEMPLATES_PATH,
+            Template.CACHE_PATH,
+        ) = self._saved
+        Template.invalidate()
+        shutil.rmtree(self._tmpdir)
+
+    def write_resources(self, storage):
+        with open(Configuration.RESOURCE_CONFIG, "w") as fd:
+            fd.write(RESOURCES.format(storage=storage))
+
+    def write_watched(self, domains):
+        index = CompletionIndex(self.path)
+        index.set_domains(domains, watched=True)
+        index.save()
+
+    def expire_watch(self):
+        index = CompletionIndex(self.path)
+        index._update({"watched_at": time.time() - CompletionIndex.WATCH_TIMEOUT - 1})
+        index.save()
+
+    def test_watched_domains(self):
+        """watched domains should be read from the index"""
+        self.write_watched({"vm1": True, "vm2": False, "vm3": True})
+        index = ListingIndex(self.path)
+        self.assertEqual(index.get_names("domains"), ["vm1", "vm2", "vm3"])
+        self.assertEqual(index.get_names("active"), ["vm1", "vm3"])
+        self.assertEqual(index.get_names("inactive"), ["vm2"])
+
+    def test_unwatched_domains(self):
+        """domains should be listed again once the watcher is gone"""
+        self.write_watched({"vm1": True})
+        self.expire_watch()
+        self.assertEqual(ListingIndex(self.path).get_names("domains"), ["vm-listed"])
+
+    def test_resources(self):
+        """resources should be read again when their file changes"""
+        self.write_resources("pool")
+        index = ListingIndex(self.path)
+        self.assertEqual(index.get_names("storage"), ["pool"])
+        self.assertEqual(index.get_names("networks"), ["lan"])
+        index.save()
+
+        self.write_resources("other-pool")
+        index = ListingIndex(self.path)
+        self.assertEqual(index.get_names("storage"), ["other-pool"])
+
+    def test_templates(self):
+        """the index should give the uid of all the templates"""
+        uids = sorted(t.uid for t in Template.get_templates())
+        self.assertEqual(ListingIndex(self.path).get_names("templates"), uids)
+
+    def test_config_update_does_not_trust_domains(self):
+        """a helper writing the index should not renew the watched domains"""
+        self.write_watched({"vm1": True})
+        self.expire_watch()
+        self.write_resources("pool")
+        index = ListingIndex(self.path)
+        index.get_names("storage")
+        index.save()
+        self.assertEqual(ListingIndex(self.path).get_names("domains"), ["vm-listed"])
+
+    def test_heartbeat_keeps_config(self):
+        """the heartbeat of the watcher should keep the names the helpers read"""
+        watcher = CompletionIndex(self.path)
+        watcher.set_domains({"vm1": True}, watched=True)
+        watcher.save()
+
+        calls = []
+        for _ in range(3):
+            index = ListingIndex(self.path)
+            index._load_templates = lambda: calls.append(1) or {"templates": []}
+            index.get_names("templates")
+            self.assertEqual(index.get_names("domains"), ["vm1"])
+            index.save()
+            watcher.heartbeat()
+        self.assertEqual(len(calls), 1)
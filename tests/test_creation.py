@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from ovm.configuration import Configuration
+from ovm.exceptions import OVMError
+from ovm.inventory.ip_allocation import IpAllocation
+from ovm.resources.resources import Resources
+from ovm.vmcli.creation import VMCreation
+
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+CONFIG = os.path.join(ROOT, "files", "resources.yml")
+
+
+class NetworkCreation(VMCreation):
+    """Only take the address of the VM, and fail for the names in failing"""
+
+    STEPS = ("process_network_args", "record_address")
+
+    addresses = {}
+    failing = ()
+
+    def record_address(self, args):
+        if args.name in self.failing:
+            raise OVMError("failed")
+        self.addresses[args.name] = self._alloc.address
+
+
+def creation_args(**kwargs):
+    return argparse.Namespace(network="labs", ip=None, **kwargs)
+
+
+class TestVMCreation(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._saved_database = Configuration.IP_DATABASE
+        Configuration.IP_DATABASE = os.path.join(self._tmpdir, "ipdatabase.db")
+        Resources(CONFIG)
+        NetworkCreation.addresses = {}
+        NetworkCreation.failing = ()
+
+    def tearDown(self):
+        Configuration.IP_DATABASE = self._saved_database
+        shutil.rmtree(self._tmpdir)
+
+    def held_addresses(self):
+        cursor = IpAllocation.get_connection().execute(
+            "SELECT domain, address FROM ipv4 WHERE network='labs'"
+        )
+        return dict(cursor)
+
+    def test_reserved_addresses(self):
+        """the VMs should be given the addresses reserved for them"""
+        names = ["vm-1", "vm-2", "vm-3"]
+        NetworkCreation.create_all(creation_args(), names)
+        self.assertEqual(NetworkCreation.addresses, self.held_addresses())
+        self.assertEqual(sorted(NetworkCreation.addresses), names)
+
+    def test_failure_releases_next_addresses(self):
+        """the addresses of the VMs not created should be released"""
+        NetworkCreation.failing = ("vm-2",)
+        with self.assertRaises(SystemExit):
+            NetworkCreation.create_all(creation_args(), ["vm-1", "vm-2", "vm-3"])
+        self.assertEqual(list(self.held_addresses()), ["vm-1"])
+
+    def test_address_of_another_vm(self):
+        """an address reserved for another name should be refused"""
+        alloc = VMCreation.reserve_ips("labs", ["vm-1"])["vm-1"]
+        self.assertRaises(OVMError, VMCreation, creation_args(name="vm-2"), alloc)
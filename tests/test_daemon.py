@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import libvirt
+
+from ovm.lvconnect import LibvirtConnect
+from ovm.utils.logger import logger
+from ovm.vmcli.daemon import Daemon, forward, is_forwardable
+
+
+# Handlers run by the daemon of the tests
+
+
+def echo(args):
+    print(args.text)
+    logger.debug("debug message")
+
+
+def fail(args):
+    logger.error("failed")
+    sys.exit(3)
+
+
+def crash(args):
+    raise ValueError("unexpected")
+
+
+def reconnect(args):
+    # Fails while the connection of libvirtd restarted before is still used
+    connection = LibvirtConnect.get_connection()
+    if not connection.isAlive():
+        raise libvirt.libvirtError("End of file while reading data")
+    print("connected")
+
+
+def lose(args):
+    # libvirtd restarts while the command runs
+    print("partial")
+    LibvirtConnect.get_connection().alive = False
+    lose.calls += 1
+    raise libvirt.libvirtError("End of file while reading data")
+
+
+lose.calls = 0
+
+
+HANDLERS = frozenset(("echo", "fail", "crash", "reconnect", "lose"))
+
+
+class FakeConnection:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+
+    def isAlive(self):
+        if self.closed:
+            raise libvirt.libvirtError("invalid connection pointer")
+        return self.alive
+
+    def close(self):
+        self.closed = True
+
+
+def command(func, **kwargs):
+    return argparse.Namespace(func=func, verbose=False, fork=4, **kwargs)
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self._tmpdir, "ovmd.sock")
+        self.daemon = Daemon(self.path, handlers_module=__name__, handlers=HANDLERS)
+        self._thread = threading.Thread(target=self.daemon.serve)
+        self._thread.start()
+        while not os.path.exists(self.path):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self._thread.join()
+        shutil.rmtree(self._tmpdir)
+
+    def forward(self, args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = forward(args, self.path)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_output(self):
+        """the output of the command should be printed by the client"""
+        status, stdout, stderr = self.forward(command("echo", text="hello"))
+        self.assertEqual(status, 0)
+        self.assertEqual(stdout, "hello\n")
+        self.assertEqual(stderr, "")
+
+    def test_verbose(self):
+        """the logs should follow the verbosity of the client"""
+        args = command("echo", text="hello")
+        args.verbose = True
+        status, stdout, stderr = self.forward(args)
+        self.assertIn("debug message", stderr)
+
+    def test_exit_status(self):
+        """the exit status and the logs of the command should be returned"""
+        status, stdout, stderr = self.forward(command("fail"))
+        self.assertEqual(status, 3)
+        self.assertIn("failed", stderr)
+
+    def test_exception(self):
+        """an unhandled exception should be printed and fail the command"""
+        status, stdout, stderr = self.forward(command("crash"))
+        self.assertEqual(status, 1)
+        self.assertIn("ValueError: unexpected", stderr)
+
+    def test_consecutive_commands(self):
+        """the daemon should serve many commands"""
+        for i in range(10):
+            status, stdout, _ = self.forward(command("echo", text=str(i)))
+            self.assertEqual((status, stdout), (0, "%d\n" % i))
+
+    def test_no_daemon(self):
+        """the client should fall back when no daemon is listening"""
+        path = os.path.join(self._tmpdir, "missing.sock")
+        self.assertIsNone(forward(command("echo", text="hello"), path))
+
+    def test_forwardable(self):
+        """interactive commands should run in the client"""
+        self.assertTrue(is_forwardable(command("vm_list")))
+        self.assertFalse(is_forwardable(command("vm_console")))
+        self.assertFalse(is_forwardable(command("vm_remove", force=False)))
+        self.assertTrue(is_forwardable(command("vm_remove", force=True)))
+
+    def test_handler_not_allowed(self):
+        """the daemon should only run the handlers it forwards"""
+        for func in ("forward", "vm_console"):
+            status, stdout, stderr = self.forward(command(func))
+            self.assertEqual(status, 1)
+            self.assertIn("ovmd does not run", stderr)
+
+    def test_reconnect(self):
+        """a connection lost with libvirtd should be opened again"""
+        saved = LibvirtConnect._conn, libvirt.open
+        LibvirtConnect._conn = FakeConnection(alive=False)
+        libvirt.open = lambda uri: FakeConnection()
+        try:
+            status, stdout, _ = self.forward(command("reconnect"))
+        finally:
+            LibvirtConnect._conn, libvirt.open = saved
+        self.assertEqual((status, stdout), (0, "connected\n"))
+
+    def test_not_run_again(self):
+        """a command failing with the connection should not be run again"""
+        saved = LibvirtConnect._conn, libvirt.open
+        LibvirtConnect._conn = FakeConnection()
+        libvirt.open = lambda uri: FakeConnection()
+        lose.calls = 0
+        try:
+            status, stdout, stderr = self.forward(command("lose"))
+            self.assertEqual((status, stdout), (1, "partial\n"))
+            self.assertIn("End of file", stderr)
+            self.assertEqual(lose.calls, 1)
+
+            # The next command opens a new connection
+            status, stdout, _ = self.forward(command("reconnect"))
+        finally:
+            LibvirtConnect._conn, libvirt.open = saved
+        self.assertEqual((status, stdout), (0, "connected\n"))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ovm.vmcli.vmtop import HISTORY_METRICS, SORT_COLUMNS, SORT_CPU, SORT_NAME
+from ovm.vmcli.vmtop import DomainFilter, DomainStats, MetricHistory
+from ovm.vmcli.vmtop import sort_samples, sparkline
+
+
+class FakeDomain:
+    def name(self):
+        return "vm1"
+
+
+class FakeHostStats:
+    cpu_count = 4
+
+
+def libvirt_stats(cpu_times, net_bytes, block_bytes):
+    """Build a dict as returned by getAllDomainStats for one domain"""
+    stats = {
+        "vcpu.current": len(cpu_times),
+        "vcpu.maximum": len(cpu_times),
+        "net.count": len(net_bytes),
+        "block.count": len(block_bytes),
+        "balloon.maximum": 1048576,
+        "balloon.rss": 524288,
+    }
+    for i, cpu_time in enumerate(cpu_times):
+        stats["vcpu.%d.time" % i] = cpu_time
+    for i, (name, rx, tx) in enumerate(net_bytes):
+        stats["net.%d.name" % i] = name
+        stats["net.%d.rx.bytes" % i] = rx
+        stats["net.%d.tx.bytes" % i] = tx
+    for i, (name, rd, wr) in enumerate(block_bytes):
+        stats["block.%d.name" % i] = name
+        stats["block.%d.rd.bytes" % i] = rd
+        stats["block.%d.wr.bytes" % i] = wr
+    return stats
+
+
+class TestDomainStats(unittest.TestCase):
+    def setUp(self):
+        self.stats = DomainStats(FakeDomain(), FakeHostStats())
+
+    def test_cpu_usage_of_all_vcpus(self):
+        """the CPU usage should sum the time of each vCPU"""
+        self.stats.update(libvirt_stats([10**9, 10**9], [], []), 1)
+        self.stats.update(libvirt_stats([2 * 10**9, 3 * 10**9], [], []), 1)
+        # 3 seconds of CPU time during 1 second on 4 host CPUs
+        self.assertEqual(self.stats.cpu_usage, 75)
+
+    def test_offline_vcpu(self):
+        """a vCPU without time should not break the CPU usage"""
+        stats = libvirt_stats([10**9, 10**9], [], [])
+        self.stats.update(stats, 1)
+        stats = libvirt_stats([2 * 10**9, 10**9], [], [])
+        del stats["vcpu.1.time"]
+        stats["vcpu.current"] = 1
+        self.stats.update(stats, 1)
+        self.assertEqual(self.stats.cpu_usage, 0)
+
+    def test_rates_of_all_devices(self):
+        """the rates should sum the traffic of all the devices"""
+        net = [("vnet0", 1000, 1000), ("vnet1", 1000, 1000)]
+        block = [("vda", 1000, 1000), ("vdb", 1000, 1000)]
+        self.stats.update(libvirt_stats([], net, block), 2)
+
+        net = [("vnet0", 2000, 1000), ("vnet1", 3000, 1500)]
+        block = [("vda", 1000, 1000), ("vdb", 9000, 5000)]
+        self.stats.update(libvirt_stats([], net, block), 2)
+
+        self.assertEqual(self.stats.net_rx_rate, 3000 * 8 / 2)
+        self.assertEqual(self.stats.net_tx_rate, 500 * 8 / 2)
+        self.assertEqual(self.stats.block_rd_rate, 8000 * 8 / 2)
+        self.assertEqual(self.stats.block_wr_rate, 4000 * 8 / 2)
+
+    def test_device_drill_down(self):
+        """each disk should have its own rates"""
+        self.stats.update(libvirt_stats([], [], [("vda", 10, 10), ("vdb", 10, 10)]))
+        self.stats.update(libvirt_stats([], [], [("vda", 10, 10), ("vdb", 20, 40)]))
+
+        self.assertEqual(self.stats.disks["vda"].tx_rate, 0)
+        self.assertEqual(self.stats.disks["vdb"].rx_rate, 80)
+        self.assertEqual(self.stats.disks["vdb"].tx_rate, 240)
+
+        lines = self.stats.format_devices("{name:8}{block_rd:>8}{block_wr:>8}")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("  vdb"))
+
+    def test_removed_device(self):
+        """an unplugged device should be forgotten"""
+        self.stats.update(libvirt_stats([], [("vnet0", 1, 1), ("vnet1", 1, 1)], []))
+        self.stats.update(libvirt_stats([], [("vnet1", 9, 9)], []))
+        self.assertEqual(list(self.stats.interfaces), ["vnet1"])
+        self.assertEqual(self.stats.net_rx_rate, 64)
+
+    def test_memory_from_bulk_stats(self):
+        """the host memory should come from balloon.rss"""
+        self.stats.update(libvirt_stats([], [], []))
+        self.assertEqual(self.stats.host_mem, 524288 * 1024)
+        self.assertEqual(self.stats.guest_mem, 1048576 * 1024)
+
+    def test_record(self):
+        """the record should hold the raw values of the stats"""
+        self.stats.update(libvirt_stats([], [("vnet0", 1, 1)], []))
+        self.stats.update(libvirt_stats([], [("vnet0", 3, 1)], []))
+        record = self.stats.get_record()
+        self.assertEqual(record["name"], "vm1")
+        self.assertEqual(record["net_rx_rate"], 16)
+        self.assertEqual(record["host_mem"], 524288 * 1024)
+
+
+class TestMetricHistory(unittest.TestCase):
+    def test_values_before_wrapping(self):
+        """get_values should return the values in order"""
+        history = MetricHistory(4)
+        for value in (1, 2, 3):
+            history.append(value)
+        self.assertEqual(list(history.get_values()), [1, 2, 3])
+        self.assertEqual(list(history.get_values(2)), [2, 3])
+
+    def test_bounded_size(self):
+        """the oldest values should be overwritten"""
+        history = MetricHistory(4)
+        for value in range(10):
+            history.append(value)
+        self.assertEqual(len(history), 4)
+        self.assertEqual(list(history.get_values()), [6, 7, 8, 9])
+        self.assertEqual(history.get_summary(2), (8, 8.5, 9))
+
+    def test_empty_summary(self):
+        """the summary of an empty history should be zeros"""
+        self.assertEqual(MetricHistory(4).get_summary(), (0, 0, 0))
+
+    def test_sparkline(self):
+        """the sparkline should be scaled on the max and fit the width"""
+        self.assertEqual(sparkline([0, 2, 14], 10), "▁▂█")
+        self.assertEqual(len(sparkline(list(range(100)), 10)), 10)
+        self.assertEqual(sparkline([0, 0]), "▁▁")
+        self.assertEqual(sparkline([]), "")
+
+    def test_domain_history(self):
+        """each update should add a value to the history of the metrics"""
+        stats = DomainStats(FakeDomain(), FakeHostStats())
+        for i in range(3):
+            stats.update(libvirt_stats([], [], []))
+        self.assertEqual(len(stats.history["host_mem"]), 3)
+        line = stats.format("{hist_max} {sparkline}", HISTORY_METRICS[1], 60)
+        self.assertEqual(line, "512 MiB ███")
+
+
+class TestDomainSelection(unittest.TestCase):
+    def setUp(self):
+        self.samples = []
+        for name, cpu_usage, block_wr_rate in (
+            ("web-1", 10, 300),
+            ("web-2", 50, 100),
+            ("db-1", 50, 900),
+            ("db-2", 5, 0),
+        ):
+            stats = DomainStats(FakeDomain(), FakeHostStats())
+            stats.name = name
+            stats.cpu_usage = cpu_usage
+            stats.block_wr_rate = block_wr_rate
+            self.samples.append(stats.get_sample())
+
+    def names(self, samples):
+        return [sample.name for sample in samples]
+
+    def test_sort_by_name(self):
+        """names should be sorted in ascending order"""
+        samples = sort_samples(self.samples, SORT_NAME)
+        self.assertEqual(self.names(samples), ["db-1", "db-2", "web-1", "web-2"])
+
+    def test_sort_by_value(self):
+        """values should be sorted in descending order, then by name"""
+        samples = sort_samples(self.samples, SORT_CPU)
+        self.assertEqual(self.names(samples), ["db-1", "web-2", "web-1", "db-2"])
+
+        samples = sort_samples(self.samples, SORT_CPU, reverse=True)
+        self.assertEqual(self.names(samples), ["db-2", "web-1", "db-1", "web-2"])
+
+    def test_sort_on_all_columns(self):
+        """every column should be sortable"""
+        column = SORT_COLUMNS.index("block_wr_rate")
+        samples = sort_samples(self.samples, column, top=2)
+        self.assertEqual(self.names(samples), ["db-1", "web-1"])
+
+        for column in range(len(SORT_COLUMNS)):
+            self.assertEqual(len(sort_samples(self.samples, column)), 4)
+
+    def test_top(self):
+        """top should keep only the first samples"""
+        samples = sort_samples(self.samples, SORT_NAME, reverse=True, top=3)
+        self.assertEqual(self.names(samples), ["web-2", "web-1", "db-2"])
+
+    def test_filter_by_name(self):
+        """a filter without = should match the names"""
+        domain_filter = DomainFilter("web-*")
+        self.assertFalse(domain_filter.needs_metadata())
+        self.assertTrue(domain_filter.match("web-1"))
+        self.assertFalse(domain_filter.match("db-1"))
+
+    def test_filter_by_metadata(self):
+        """a filter with = should match a metadata entry"""
+        domain_filter = DomainFilter("os_name=Debian*")
+        self.assertTrue(domain_filter.needs_metadata())
+        self.assertTrue(domain_filter.match("db-1", {"os_name": "Debian 12"}))
+        self.assertFalse(domain_filter.match("db-1", {"os_name": "Ubuntu"}))
+        self.assertFalse(domain_filter.match("db-1", {}))
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ovm.vmcli.exporter import format_labels, format_metric
+
+
+class TestExporter(unittest.TestCase):
+    def test_escape_labels(self):
+        """label values should be escaped"""
+        labels = [("name", "vm1"), ("os_name", 'De"bi\\an\n')]
+        self.assertEqual(
+            format_labels(labels), '{name="vm1",os_name="De\\"bi\\\\an\\n"}'
+        )
+
+    def test_no_labels(self):
+        """a sample without label should have no braces"""
+        self.assertEqual(format_labels([]), "")
+
+    def test_format_metric(self):
+        """a metric should have its help, its type and one line per sample"""
+        lines = format_metric(
+            "ovm_test_total",
+            "counter",
+            "Test metric",
+            [([("name", "vm1")], 1), ([("name", "vm2")], 2.5)],
+        )
+        self.assertEqual(
+            lines,
+            [
+                "# HELP ovm_test_total Test metric",
+                "# TYPE ovm_test_total counter",
+                'ovm_test_total{name="vm1"} 1.0',
+                'ovm_test_total{name="vm2"} 2.5',
+            ],
+        )
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ovm.drivers.storage.file import FileDriver
+from ovm.utils import fastcopy
+
+
+BLOCK = 1024**2
+
+
+class FakeImage:
+    """Raw image whose conversion is only counted"""
+
+    format = "raw"
+
+    def __init__(self, path):
+        self.path = path
+        self.conversions = 0
+
+    def copy_on_device(self, dest, dest_format, options=None):
+        shutil.copyfile(self.path, dest)
+        self.conversions += 1
+
+
+class TestFastCopy(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.source = os.path.join(self.root, "source.raw")
+        self.dest = os.path.join(self.root, "dest.raw")
+        # Data, hole, data, then a hole until the end of the file
+        self.data = [(0, os.urandom(BLOCK)), (3 * BLOCK, os.urandom(BLOCK))]
+        with open(self.source, "wb") as fd:
+            for offset, data in self.data:
+                fd.seek(offset)
+                fd.write(data)
+            fd.truncate(8 * BLOCK)
+        open(self.dest, "wb").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def assertSameContent(self, source, dest):
+        with open(source, "rb") as src, open(dest, "rb") as dst:
+            self.assertEqual(src.read(), dst.read())
+
+    def test_data_segments(self):
+        with open(self.source, "rb") as fd:
+            segments = list(fastcopy.data_segments(fd.fileno(), 8 * BLOCK))
+
+        # Some file systems report no holes, the data must be covered anyway
+        for offset, data in self.data:
+            self.assertTrue(
+                any(
+                    start <= offset and offset + len(data) <= start + length
+                    for start, length in segments
+                )
+            )
+
+    def test_copy_methods(self):
+        for method in fastcopy.COPY_METHODS:
+            if not hasattr(os, method):
+                continue
+            with self.subTest(method=method):
+                # The old content of the destination must not be kept
+                with open(self.dest, "wb") as fd:
+                    fd.write(b"\xff" * 16 * BLOCK)
+
+                with open(self.source, "rb") as src, open(self.dest, "r+b") as dst:
+                    fastcopy.copy_sparse(src.fileno(), dst.fileno(), method)
+                self.assertSameContent(self.source, self.dest)
+                self.assertLessEqual(
+                    os.stat(self.dest).st_blocks, os.stat(self.source).st_blocks
+                )
+
+    def test_clone_file(self):
+        method = fastcopy.clone_file(self.source, self.dest)
+        self.assertIn(method, ("reflink", None) + fastcopy.COPY_METHODS)
+        if method is not None:
+            self.assertSameContent(self.source, self.dest)
+
+    def test_clone_file_missing_dest(self):
+        os.remove(self.dest)
+        self.assertRaises(OSError, fastcopy.clone_file, self.source, self.dest)
+
+    def test_import_image_same_format(self):
+        if fastcopy.clone_file(self.source, self.dest) is None:
+            self.skipTest("no fast copy on this file system")
+        driver = FileDriver()
+        driver.set_params(root=self.root, disk_format="raw")
+        image = FakeImage(self.source)
+
+        path = driver.import_image(image, "vm-disk.raw")
+        self.assertEqual(image.conversions, 0)
+        self.assertSameContent(self.source, path)
+
+    def test_import_image_other_format(self):
+        driver = FileDriver()
+        driver.set_params(root=self.root, disk_format="raw")
+        image = FakeImage(self.source)
+        image.format = "qcow2"
+
+        path = driver.import_image(image, "vm-disk.raw")
+        self.assertEqual(image.conversions, 1)
+        self.assertSameContent(self.source, path)
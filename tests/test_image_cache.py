@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import fcntl
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from ovm.drivers.storage.file import FileDriver
+from ovm.drivers.storage.image_cache import ImageCache
+from ovm.exceptions import DriverError
+
+
+class FakeImage:
+    """Image copied as is instead of being converted by qemu-img"""
+
+    def __init__(self, path, size=4096):
+        self.path = path
+        self.copies = 0
+        with open(path, "wb") as fd:
+            fd.write(os.urandom(size))
+
+    def copy_on_device(self, dest, dest_format, options=None):
+        shutil.copyfile(self.path, dest)
+        self.copies += 1
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ImageCache(self.root, "qcow2")
+        self.image = self.new_image("debian")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def new_image(self, name, size=4096):
+        return FakeImage(os.path.join(self.root, name + ".qcow2"), size)
+
+    def overlay(self, name):
+        return os.path.join(self.root, name)
+
+    def test_shared_entry(self):
+        """overlays of the same image should share one read-only entry"""
+        base = self.cache.acquire(self.image, self.overlay("vm1"))
+        self.assertEqual(self.cache.acquire(self.image, self.overlay("vm2")), base)
+        self.assertEqual(self.image.copies, 1)
+        self.assertFalse(os.stat(base).st_mode & stat.S_IWUSR)
+        self.assertEqual(self.cache.get_entry_path(self.overlay("vm2")), base)
+
+    def test_entry_kept_while_used(self):
+        """an entry should only be evicted once no overlay uses it"""
+        base = self.cache.acquire(self.image, self.overlay("vm1"))
+        self.cache.acquire(self.image, self.overlay("vm2"))
+
+        self.cache.release(self.overlay("vm1"))
+        self.assertTrue(os.path.exists(base))
+        self.assertEqual(self.cache.purge(), [])
+        self.assertIsNone(self.cache.get_entry_path(self.overlay("vm1")))
+
+        self.cache.release(self.overlay("vm2"))
+        self.assertFalse(os.path.exists(base))
+        self.assertEqual(self.cache.get_entries(), {})
+
+    def test_changed_image(self):
+        """a new entry should be made when the image changes"""
+        old_base = self.cache.acquire(self.image, self.overlay("vm1"))
+        with open(self.image.path, "ab") as fd:
+            fd.write(b"v2")
+        new_base = self.cache.acquire(self.image, self.overlay("vm2"))
+        self.assertNotEqual(old_base, new_base)
+        self.assertTrue(os.path.exists(old_base))
+
+    def test_target_format(self):
+        """the images of each disk format should have their own entries"""
+        raw_cache = ImageCache(self.root, "raw")
+        self.assertNotEqual(
+            self.cache.acquire(self.image), raw_cache.acquire(self.image)
+        )
+
+    def test_lru_eviction(self):
+        """the least recently used entries should be evicted over the limit"""
+        images = [self.new_image("image%d" % i, 64 * 1024) for i in range(3)]
+        cache = ImageCache(self.root, "qcow2", size_limit=1024**3)
+        paths = [cache.acquire(image) for image in images[:2]]
+
+        # Use the first image again, the second is now the oldest
+        cache.acquire(images[0])
+        size = sum(entry["size"] for entry in cache.get_entries().values())
+        cache.size_limit = size
+        paths.append(cache.acquire(images[2]))
+
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertFalse(os.path.exists(paths[1]))
+        self.assertTrue(os.path.exists(paths[2]))
+
+    def test_purge(self):
+        """purge should remove the entries no overlay uses"""
+        used = self.cache.acquire(self.image, self.overlay("vm1"))
+        unused = self.cache.acquire(self.new_image("unused"))
+        self.assertEqual(self.cache.purge(), [os.path.basename(unused)])
+        self.assertTrue(os.path.exists(used))
+        self.assertFalse(os.path.exists(unused))
+
+    def test_convert_without_lock(self):
+        """the pool should not be locked while an image is converted"""
+        locked = []
+
+        def copy_on_device(dest, dest_format, options=None):
+            with open(self.cache._lock_path, "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    locked.append(dest)
+            shutil.copyfile(self.image.path, dest)
+
+        self.image.copy_on_device = copy_on_device
+        self.cache.acquire(self.image)
+        self.assertEqual(locked, [])
+
+    def test_entry_kept_while_copied(self):
+        """the entry a disk is copied from should not be evicted meanwhile"""
+        driver = FileDriver()
+        driver.set_params(root=self.root, cache_size=0)
+        self.image.format = "qcow2"
+        cache = driver.get_image_cache()
+
+        def clone(source, disk_format, dest):
+            self.assertEqual(cache.purge(), [])
+            shutil.copyfile(source, dest)
+
+        driver._clone = clone
+        path = driver.import_image(self.image, "vm1.qcow2")
+        self.assertTrue(os.path.getsize(path))
+        # Released once copied, then evicted over the size of 0
+        self.assertEqual(cache.get_entries(), {})
+
+    def test_file_driver_cache(self):
+        """file pools should only have a cache for overlays or with a size"""
+        driver = FileDriver()
+        driver.set_params(root=self.root)
+        self.assertIsNone(driver.get_image_cache())
+
+        driver.set_params(cache_size=2)
+        self.assertEqual(driver.get_image_cache().size_limit, 2 * 1024**3)
+
+        driver = FileDriver()
+        driver.set_params(root=self.root, clone_mode="overlay")
+        self.assertEqual(driver.get_image_cache().size_limit, 0)
+
+    def test_overlay_needs_qcow2(self):
+        """the overlay clone mode should refuse raw disks"""
+        driver = FileDriver()
+        driver.set_params(root=self.root, clone_mode="overlay")
+        self.assertRaises(
+            DriverError, driver.set_params, root=self.root, disk_format="raw"
+        )
+        self.assertRaises(DriverError, driver.set_params, clone_mode="hardlink")
+        self.assertRaises(DriverError, driver.set_params, cache_size="big")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import libvirt
+
+from ovm.inventory.cache import InventoryCache, InventoryWatcher
+from ovm.inventory.domain import Domain
+from ovm.lvconnect import LibvirtConnect
+
+
+DOMAIN_XML = """<domain type="kvm">
+  <name>{name}</name>
+  <memory unit="KiB">1048576</memory>
+  <currentMemory unit="KiB">524288</currentMemory>
+  <vcpu>2</vcpu>
+  <devices>{devices}</devices>
+</domain>"""
+
+DISK_XML = '<disk type="file" device="disk"><source file="{}"/></disk>'
+
+VNC_XML = '<graphics type="vnc" port="{}" autoport="yes"/>'
+
+
+class FakeDomain:
+    def __init__(self, num, active=False):
+        self.num = num
+        self.active = active
+        self.disks = ["/pool/vm%d.qcow2" % num]
+        self.plugged = []
+        self.calls = []
+
+    def name(self):
+        return "vm%d" % self.num
+
+    def UUIDString(self):
+        return "00000000-0000-0000-0000-%012d" % self.num
+
+    def isActive(self):
+        self.calls.append("isActive")
+        return self.active
+
+    def XMLDesc(self, flags=0):
+        self.calls.append("XMLDesc")
+        disks = list(self.disks)
+        port = -1
+        if self.active and not flags & libvirt.VIR_DOMAIN_XML_INACTIVE:
+            disks += self.plugged
+            port = 5900 + self.num
+        devices = "".join(DISK_XML.format(path) for path in disks)
+        devices += VNC_XML.format(port)
+        return DOMAIN_XML.format(name=self.name(), devices=devices)
+
+
+class FakeConnection:
+    def __init__(self, domains=()):
+        self.domains = list(domains)
+        self.alive = True
+        self.closed = False
+        self.events = []
+
+    def listAllDomains(self, flags=0):
+        return self.domains
+
+    def domainEventRegisterAny(self, dom, event_id, callback, opaque):
+        self.events.append(event_id)
+
+    def isAlive(self):
+        # Like libvirt-python, once the connection was closed
+        if self.closed:
+            raise libvirt.libvirtError("invalid connection pointer")
+        return self.alive
+
+    def close(self):
+        self.closed = True
+
+
+class TestInventoryCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self._tmpdir, "inventory-cache.json")
+        self._saved_conn = LibvirtConnect._conn
+        LibvirtConnect._conn = object()
+
+    def tearDown(self):
+        LibvirtConnect._conn = self._saved_conn
+        shutil.rmtree(self._tmpdir)
+
+    def test_hot_plugged_disk(self):
+        """the disks of a running domain should be the live ones"""
+        domain = FakeDomain(1, active=True)
+        cache = InventoryCache(self.path)
+        self.assertEqual(len(cache.get_facts(domain)["disks"]), 1)
+
+        domain.plugged.append("/pool/data.qcow2")
+        self.assertEqual(len(cache.get_facts(domain)["disks"]), 2)
+
+    def read_info(self, domain):
+        # The disks would need the pools of the resources
+        return domain.get_vnc_info(), domain.get_interfaces(), domain.get_memory()
+
+    def test_cached_domain(self):
+        """the cache should not read more of libvirt than the domain alone"""
+        vir_domain = FakeDomain(1, active=True)
+        self.read_info(Domain(vir_domain))
+        calls = list(vir_domain.calls)
+
+        cache = InventoryCache(self.path)
+        cache.get_facts(FakeDomain(1, active=True))
+        cache.save()
+        vir_domain.calls = []
+        domain = InventoryCache(self.path).get_domain(vir_domain)
+        vnc, interfaces, memory = self.read_info(domain)
+        self.assertEqual(vir_domain.calls, calls)
+        self.assertEqual((vnc["port"], interfaces, memory), (5901, [], 1024**3))
+
+        # Nothing is read while the cache is watched
+        cache = InventoryCache(self.path)
+        cache.heartbeat()
+        vir_domain.calls = []
+        self.read_info(cache.get_domain(vir_domain))
+        self.assertEqual(vir_domain.calls, [])
+
+    def test_vnc_port(self):
+        """a stopped domain should have no VNC port"""
+        for domain in (
+            Domain(FakeDomain(1)),
+            InventoryCache(self.path).get_domain(FakeDomain(1)),
+        ):
+            self.assertEqual(domain.get_vnc_info(), {"port": None})
+
+    def test_readers_merge_their_entries(self):
+        """two processes saving the cache should keep the entries of both"""
+        first, second = InventoryCache(self.path), InventoryCache(self.path)
+        first.get_facts(FakeDomain(1))
+        second.get_facts(FakeDomain(2))
+        first.save()
+        second.save()
+
+        cache = InventoryCache(self.path)
+        self.assertEqual(
+            sorted(cache._entries),
+            [FakeDomain(1).UUIDString(), FakeDomain(2).UUIDString()],
+        )
+
+    def test_reader_leaves_cache_to_watcher(self):
+        """a reader should not save the cache while a watcher runs"""
+        reader = InventoryCache(self.path)
+        reader.get_facts(FakeDomain(1))
+
+        watcher = InventoryCache(self.path)
+        watcher.watching = True
+        domain = FakeDomain(1)
+        domain.disks.append("/pool/data.qcow2")
+        watcher.update(domain)
+        watcher.save()
+        watcher.heartbeat()
+
+        reader.save()
+        cache = InventoryCache(self.path)
+        self.assertEqual(len(cache.get_facts(FakeDomain(1))["disks"]), 2)
+
+
+class TestInventoryWatcher(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.cache = InventoryCache(os.path.join(self._tmpdir, "inventory-cache.json"))
+        self.watcher = InventoryWatcher(self.cache)
+        self._saved = LibvirtConnect._conn, libvirt.open
+        self.connections = []
+        libvirt.open = self.open
+        LibvirtConnect._conn = None
+        self.watcher._follow(LibvirtConnect.get_connection())
+
+    def tearDown(self):
+        LibvirtConnect._conn, libvirt.open = self._saved
+        shutil.rmtree(self._tmpdir)
+
+    def open(self, uri):
+        connection = FakeConnection([FakeDomain(len(self.connections))])
+        self.connections.append(connection)
+        return connection
+
+    def test_closed_connection(self):
+        """a connection closed by another user should be replaced"""
+        LibvirtConnect.reset()
+        self.watcher._on_timeout(None, None)
+        self.assertEqual(len(self.connections), 2)
+        self.assertIs(self.watcher._connection, self.connections[1])
+        self.assertEqual(len(self.connections[1].events), len(InventoryWatcher.EVENTS))
+
+    def test_replaced_connection(self):
+        """the watcher should follow the connection opened by another user"""
+        LibvirtConnect.reset()
+        connection = LibvirtConnect.get_connection()
+        self.watcher._on_timeout(None, None)
+        self.assertIs(self.watcher._connection, connection)
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(sorted(self.cache._entries), [FakeDomain(1).UUIDString()])
+
+    def test_reconnect_retried(self):
+        """a failed reconnection should be tried again on the next tick"""
+        self.connections[0].alive = False
+
+        def fail(uri):
+            raise libvirt.libvirtError("Failed to connect socket")
+
+        libvirt.open = fail
+        self.watcher._on_timeout(None, None)
+        self.assertIsNone(self.watcher._connection)
+
+        libvirt.open = self.open
+        self.watcher._on_timeout(None, None)
+        self.assertIs(self.watcher._connection, self.connections[1])
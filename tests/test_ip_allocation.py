@@ -45,3 +45,15 @@ class TestIpAllocation(unittest.TestCase):
         alloc2.hold_ip("domtest")
 
         self.assertEqual(alloc1.address, alloc2.address)
+
+    def test_to_hold_several_ips(self):
+        """hold_ips should return distinct addresses in the domains order"""
+        network = Resources.get_network("labs")
+        domains = ["bulk-%d" % i for i in range(10)]
+
+        allocations = network.new_ipv4_allocation().hold_ips(domains)
+        self.assertEqual([a.domain for a in allocations], domains)
+        self.assertEqual(len(set(a.address for a in allocations)), len(domains))
+
+        for domain in domains:
+            network.new_ipv4_allocation().release_ips(domain)
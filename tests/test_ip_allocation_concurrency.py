@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from ovm.configuration import Configuration
+from ovm.drivers.network.bridge import BridgeDriver
+from ovm.exceptions import OVMError
+from ovm.inventory.ip_allocation import iprange
+from ovm.resources.network import Network
+
+
+POOL = {"ip_start": "10.42.3.1", "ip_end": "10.42.3.32"}
+PROCESSES = 8
+ALLOCATIONS_PER_PROCESS = 6
+
+
+def _new_network():
+    return Network("stress", BridgeDriver, ipv4_pool=POOL, ipv4_allocation="static")
+
+
+def _allocate(path, count, start, queue):
+    Configuration.IP_DATABASE = path
+    network = _new_network()
+
+    # Start all the workers at the same time to maximize conflicts
+    start.wait()
+
+    addresses = []
+    for i in range(count):
+        alloc = network.new_ipv4_allocation()
+        try:
+            alloc.hold_ip("stress-%d-%d" % (os.getpid(), i))
+        except OVMError:
+            break
+        addresses.append(alloc.address)
+    queue.put(addresses)
+
+
+class TestIpAllocationConcurrency(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._database = os.path.join(self._tmpdir, "ipdatabase.db")
+        self._saved_database = Configuration.IP_DATABASE
+
+    def tearDown(self):
+        Configuration.IP_DATABASE = self._saved_database
+        shutil.rmtree(self._tmpdir)
+
+    def test_parallel_allocations_are_unique(self):
+        """processes filling one pool concurrently should never share an IP"""
+        ctx = multiprocessing.get_context("fork")
+        queue = ctx.Queue()
+        start = ctx.Event()
+
+        workers = [
+            ctx.Process(
+                target=_allocate,
+                args=(self._database, ALLOCATIONS_PER_PROCESS, start, queue),
+            )
+            for _ in range(PROCESSES)
+        ]
+        for worker in workers:
+            worker.start()
+
+        start.set()
+        addresses = []
+        for _ in workers:
+            addresses += queue.get(timeout=60)
+
+        for worker in workers:
+            worker.join()
+
+        pool = set(iprange(POOL["ip_start"], POOL["ip_end"]))
+        self.assertEqual(len(addresses), len(set(addresses)))
+        self.assertEqual(set(addresses), pool)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from ovm.inventory.ip_allocation import int_to_ip, ip_to_int
+from ovm.inventory.ip_index import FreeIpIndex
+
+
+class TestFreeIpIndex(unittest.TestCase):
+    def test_to_convert_an_ip(self):
+        """ip_to_int and int_to_ip should be reciprocal"""
+        self.assertEqual(ip_to_int("10.42.2.10"), 0x0A2A020A)
+        self.assertEqual(int_to_ip(0x0A2A020A), "10.42.2.10")
+
+    def test_first_free_on_empty_pool(self):
+        """first_free should return the start of the pool"""
+        index = FreeIpIndex(10, 20)
+        self.assertEqual(index.first_free(), 10)
+
+    def test_first_free_skips_used_addresses(self):
+        """first_free should return the first hole"""
+        index = FreeIpIndex(10, 20, [10, 11, 12, 14, 30])
+        self.assertEqual(index.first_free(), 13)
+        self.assertTrue(12 in index)
+        self.assertFalse(13 in index)
+        self.assertEqual(index.used_count(), 4)
+
+    def test_full_pool(self):
+        """first_free should return None when all addresses are used"""
+        index = FreeIpIndex(10, 12, [11, 10, 12])
+        self.assertIsNone(index.first_free())
+        self.assertIsNone(index.take())
+
+    def test_add_and_remove(self):
+        """add and remove should merge and split intervals"""
+        index = FreeIpIndex(0, 100, [1, 3])
+        index.add(2)
+        index.add(0)
+        self.assertEqual(index.first_free(), 4)
+        index.remove(2)
+        self.assertEqual(index.first_free(), 2)
+        self.assertTrue(3 in index)
+        self.assertEqual(index.take(), 2)
+        self.assertEqual(index.free_count(), 97)
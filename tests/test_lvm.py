@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ovm.drivers.storage.lvm import GoldenVolumes, LvmDriver
+from ovm.exceptions import DriverError
+
+
+class FakeImage:
+    def __init__(self, path):
+        self.path = path
+        self.size = 10
+        self.copies = []
+        open(path, "w").close()
+
+    def copy_on_device(self, dest, dest_format, options=None):
+        self.copies.append(dest)
+
+
+class FakeDisk:
+    def __init__(self, path):
+        self.path = path
+
+
+class RecordingLvmDriver(LvmDriver):
+    """Record the LVM commands and play them on a fake volume group"""
+
+    def __init__(self, output=""):
+        super(RecordingLvmDriver, self).__init__()
+        self.commands = []
+        self.volumes = {}
+        self.output = output
+        self.failing = ()
+
+    def _lvm(self, *args):
+        self.commands.append(args)
+        if args[0] in self.failing:
+            raise DriverError("%s failed" % args[0])
+
+        name = os.path.basename(args[-1])
+        if args[0] == "lvcreate":
+            origin = name if "--snapshot" in args else ""
+            new_name = args[args.index("--name") + 1]
+            self.volumes[new_name] = {"origin": origin, "tags": []}
+        elif args[0] == "lvrename":
+            if args[3] in self.volumes:
+                raise DriverError("already exists")
+            self.volumes[args[3]] = self.volumes.pop(args[2])
+        elif args[0] == "lvremove":
+            del self.volumes[name]
+        elif args[0] == "lvchange" and args[1] == "--addtag":
+            self.volumes[name]["tags"].append(args[2])
+        elif args[0] == "lvs" and "--separator" in args:
+            return "".join(
+                "  {}|{}|1073741824|25.00|{}|1700000000\n".format(
+                    lv, volume["origin"], ",".join(volume["tags"])
+                )
+                for lv, volume in self.volumes.items()
+            )
+        elif args[0] == "lvs" and "origin" in args:
+            if name not in self.volumes:
+                raise DriverError("not found")
+            return "  %s\n" % self.volumes[name]["origin"]
+        elif args[0] == "lvs" and len(args) == 2:
+            if name not in self.volumes:
+                raise DriverError("not found")
+        return self.output
+
+
+class TestLvmDriver(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.image = FakeImage(os.path.join(self.root, "debian.qcow2"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def new_driver(self, thin_pool=None, **kwargs):
+        driver = RecordingLvmDriver(**kwargs)
+        driver.set_params(root="/dev/vg", volume_group="vg")
+        if thin_pool:
+            driver.set_params(thin_pool=thin_pool)
+        return driver
+
+    def change_image(self):
+        with open(self.image.path, "a") as fd:
+            fd.write("new content")
+
+    def test_failed_command_raises(self):
+        driver = LvmDriver()
+        self.assertRaises(DriverError, driver._lvm, "false")
+
+    def test_volume_group_required(self):
+        driver = RecordingLvmDriver()
+        self.assertRaises(DriverError, driver._create_logical_volume, "vm", 10)
+
+    def test_thin_volume(self):
+        driver = self.new_driver("pool")
+        driver._create_logical_volume("vm", 10)
+        self.assertEqual(
+            driver.commands[0],
+            ("lvcreate", "--thin", "--virtualsize", "10G", "--name", "vm", "vg/pool"),
+        )
+
+    def test_no_golden_volumes_without_thin_pool(self):
+        self.assertIsNone(self.new_driver().get_image_cache())
+
+    def test_import_builds_golden_once(self):
+        driver = self.new_driver("pool")
+        golden = driver.get_image_cache().get_name(self.image.path)
+        self.assertTrue(golden.startswith(GoldenVolumes.PREFIX))
+
+        self.assertEqual(driver.import_image(self.image, "vm1"), "/dev/vg/vm1")
+        driver.import_image(self.image, "vm2")
+        self.assertEqual(len(self.image.copies), 1)
+        self.assertEqual(driver.volumes["vm2"]["origin"], golden)
+
+        entry = driver.get_image_cache().get_entries()[golden]
+        self.assertEqual(entry["image"], self.image.path)
+        self.assertEqual(sorted(entry["users"]), ["vm1", "vm2"])
+        self.assertEqual(entry["size"], 1024**3 // 4)
+
+    def test_golden_built_concurrently(self):
+        driver = self.new_driver("pool")
+        volumes = driver.get_image_cache()
+        golden = volumes.get_name(self.image.path)
+        volumes._create(self.image, golden)
+
+        # Another process renamed its copy first: ours is removed
+        volumes._create(self.image, golden)
+        self.assertEqual(list(driver.volumes), [golden])
+
+    def test_cleanup_failure_keeps_error(self):
+        """a failed cleanup should not hide the error of the conversion"""
+        driver = self.new_driver("pool")
+        driver.failing = ("lvchange", "lvremove")
+        volumes = driver.get_image_cache()
+        with self.assertRaisesRegex(DriverError, "lvchange failed"):
+            volumes._create(self.image, volumes.get_name(self.image.path))
+
+    def test_stale_golden_removed_with_last_disk(self):
+        """the golden LV of an old image should go with its last snapshot"""
+        driver = self.new_driver("pool")
+        driver.import_image(self.image, "vm1")
+        old = driver.volumes["vm1"]["origin"]
+
+        self.change_image()
+        driver.import_image(self.image, "vm2")
+        self.assertIn(old, driver.volumes)
+
+        driver.remove_disk(FakeDisk("/dev/vg/vm1"))
+        self.assertNotIn(old, driver.volumes)
+        self.assertIn(driver.volumes["vm2"]["origin"], driver.volumes)
+
+    def test_stale_golden_removed_on_update(self):
+        """an unused golden LV should be removed when its image changes"""
+        driver = self.new_driver("pool")
+        driver.import_image(self.image, "vm1")
+        old = driver.volumes["vm1"]["origin"]
+        driver.remove_disk(FakeDisk("/dev/vg/vm1"))
+        self.assertIn(old, driver.volumes)
+
+        self.change_image()
+        driver.import_image(self.image, "vm2")
+        self.assertNotIn(old, driver.volumes)
+
+    def test_purge(self):
+        driver = self.new_driver("pool")
+        driver.import_image(self.image, "vm1")
+        volumes = driver.get_image_cache()
+        self.assertEqual(volumes.purge(), [])
+
+        driver.remove_disk(FakeDisk("/dev/vg/vm1"))
+        self.assertEqual(volumes.purge(), [volumes.get_name(self.image.path)])
+        self.assertEqual(driver.volumes, {})
+
+    def test_real_size_of_thin_volume(self):
+        driver = self.new_driver("pool", output="  10737418240 12.50\n")
+        self.assertEqual(driver.disk_real_size(FakeDisk("/dev/vg/vm")), 1342177280)
+
+    def test_real_size_without_data_percent(self):
+        driver = self.new_driver("pool", output="  10737418240\n")
+        path = os.path.join(self.root, "disk")
+        with open(path, "wb") as fd:
+            fd.truncate(4096)
+        self.assertEqual(driver.disk_real_size(FakeDisk(path)), 4096)
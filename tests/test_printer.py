@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import unittest
+
+from ovm.utils.printer import RecordPrinter
+
+
+RECORDS = [{"name": "vm1", "vcpu": 2}, {"name": "vm2", "vcpu": None}]
+
+
+def print_records(output_format):
+    output = io.StringIO()
+    with RecordPrinter(output_format, ("name", "vcpu"), output) as printer:
+        for record in RECORDS:
+            printer.write(record)
+    return output.getvalue()
+
+
+class TestRecordPrinter(unittest.TestCase):
+    def test_json(self):
+        """json should print a valid list of records"""
+        self.assertEqual(json.loads(print_records("json")), RECORDS)
+
+    def test_empty_json(self):
+        """json should print an empty list when there is no record"""
+        output = io.StringIO()
+        RecordPrinter("json", ("name",), output).close()
+        self.assertEqual(json.loads(output.getvalue()), [])
+
+    def test_jsonl(self):
+        """jsonl should print one record per line"""
+        lines = print_records("jsonl").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], RECORDS)
+
+    def test_csv(self):
+        """csv should print a header then one line per record"""
+        lines = print_records("csv").splitlines()
+        self.assertEqual(lines, ["name,vcpu", "vm1,2", "vm2,"])
+
+    def test_unknown_format(self):
+        """an unknown format should raise a ValueError"""
+        with self.assertRaises(ValueError):
+            RecordPrinter("xml", ("name",))
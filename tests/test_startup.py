@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Modules only needed by some commands, which must not slow down the others
+HEAVY_MODULES = (
+    "curses",
+    "termios",
+    "sqlite3",
+    "yaml",
+    "libvirt",
+    "http.server",
+    "ovm.vmcli.management",
+)
+
+
+def imported_modules(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        env=env,
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:"):
+            modules.add(line.split("|")[-1].strip())
+    return result.returncode, modules
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_of_the_cli(self):
+        """importing the CLI should not import the dependencies of commands"""
+        returncode, modules = imported_modules(["-c", "import ovm.vmcli.__main__"])
+        self.assertEqual(returncode, 0)
+        self.assertIn("ovm.vmcli.__main__", modules)
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, modules)
+
+    def test_help(self):
+        """vm --help should not import the dependencies of commands"""
+        returncode, modules = imported_modules(["-m", "ovm.vmcli", "--help"])
+        self.assertEqual(returncode, 0)
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, modules)
@@ -3,9 +3,17 @@
 
 import glob
 import os.path
+import pickle
+import shutil
+import tempfile
 import unittest
 
-from ovm.exceptions import OVMError
+from ovm.drivers.storage import file as file_driver
+from ovm.drivers.storage.file import FileDriver
+from ovm.drivers.storage.lvm import LvmDriver
+from ovm.exceptions import DriverError, OVMError
+from ovm.templates.image_template import ImageTemplate, get_convert_args
+from ovm.templates.image_template import get_default_convert_options
 from ovm.templates.template import Template
 
 
@@ -17,6 +25,16 @@ TEMPLATES_PATH = os.path.abspath(os.path.join(ROOT, "../etc/templates/examples")
 Template.TEMPLATES_PATH = TEMPLATES_PATH
 
 
+def setUpModule():
+    global CACHE_DIR
+    CACHE_DIR = tempfile.mkdtemp()
+    Template.CACHE_PATH = os.path.join(CACHE_DIR, "templates-cache.pickle")
+
+
+def tearDownModule():
+    shutil.rmtree(CACHE_DIR)
+
+
 class TestTemplate(unittest.TestCase):
     def test_get_templates(self):
         """get_tempaltes should load all templates and return them all"""
@@ -35,3 +53,187 @@ class TestTemplate(unittest.TestCase):
         """get_template should raise an OVMError"""
         with self.assertRaises(OVMError):
             Template.get_template("an-unknown-template")
+
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._templates = os.path.join(self._tmpdir, "templates")
+        shutil.copytree(TEMPLATES_PATH, self._templates)
+
+        self._saved = (Template.TEMPLATES_PATH, Template.CACHE_PATH, Template._parse)
+        Template.TEMPLATES_PATH = self._templates
+        Template.CACHE_PATH = os.path.join(self._tmpdir, "templates-cache.pickle")
+
+        # Count the files parsed
+        self.parsed = []
+        parse = Template._parse
+
+        def counting_parse(path):
+            self.parsed.append(os.path.basename(path))
+            return parse(path)
+
+        Template._parse = staticmethod(counting_parse)
+
+    def tearDown(self):
+        Template.TEMPLATES_PATH, Template.CACHE_PATH, parse = self._saved
+        Template._parse = staticmethod(parse)
+        Template._templates_cache = None
+        shutil.rmtree(self._tmpdir)
+
+    def load(self):
+        Template._templates_cache = None
+        self.parsed = []
+        return Template.get_templates()
+
+    def test_templates_are_parsed_once(self):
+        """a second load should read the templates from the cache"""
+        first = self.load()
+        self.assertEqual(len(self.parsed), len(first))
+        self.assertTrue(os.path.exists(Template.CACHE_PATH))
+
+        second = self.load()
+        self.assertEqual(self.parsed, [])
+        self.assertEqual(sorted(t.uid for t in first), sorted(t.uid for t in second))
+
+    def test_changed_template_is_parsed_again(self):
+        """only a modified template should be parsed again"""
+        self.load()
+        path = os.path.join(self._templates, "debian-8.yml")
+        with open(path, "a") as fd:
+            fd.write("vcpu: 4\n")
+
+        self.load()
+        self.assertEqual(self.parsed, ["debian-8.yml"])
+        self.assertEqual(Template.get_template("debian-8").vcpu, 4)
+
+    def test_removed_template(self):
+        """a removed template should not be returned from the cache"""
+        count = len(self.load())
+        os.remove(os.path.join(self._templates, "debian-8.yml"))
+
+        self.assertEqual(len(self.load()), count - 1)
+        with self.assertRaises(OVMError):
+            Template.get_template("debian-8")
+
+    def test_corrupted_cache(self):
+        """a corrupted cache should be ignored"""
+        count = len(self.load())
+        with open(Template.CACHE_PATH, "wb") as fd:
+            fd.write(b"garbage")
+
+        self.assertEqual(len(self.load()), count)
+        self.assertEqual(len(self.parsed), count)
+
+    def test_damaged_cache(self):
+        """a truncated cache or one without entries should be ignored"""
+        count = len(self.load())
+        with open(Template.CACHE_PATH, "rb") as fd:
+            content = fd.read()
+        damaged = (
+            content[: len(content) // 2],
+            pickle.dumps({"version": Template.CACHE_VERSION}),
+            pickle.dumps({"version": Template.CACHE_VERSION, "entries": []}),
+        )
+        for data in damaged:
+            with open(Template.CACHE_PATH, "wb") as fd:
+                fd.write(data)
+            self.assertEqual(len(self.load()), count)
+
+
+class TestConvertOptions(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dest = os.path.join(self.root, "disk")
+        open(self.dest, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def new_image(self, **convert_options):
+        path = os.path.join(self.root, "image.qcow2")
+        open(path, "w").close()
+        config = {"path": path, "format": "qcow2", "size": 8}
+        config["convert_options"] = convert_options
+        return ImageTemplate(config)
+
+    def test_args(self):
+        options = {
+            "coroutines": 16,
+            "out_of_order": True,
+            "cache": "none",
+            "source_cache": None,
+            "sparse_size": 0,
+        }
+        self.assertEqual(
+            get_convert_args(options, False),
+            ["-t", "none", "-m", "16", "-W", "-S", "0"],
+        )
+
+    def test_target_is_zero_only_on_block_devices(self):
+        options = {"target_is_zero": True}
+        self.assertEqual(get_convert_args(options, False), [])
+        self.assertEqual(get_convert_args(options, True), ["-n", "--target-is-zero"])
+
+    def test_unknown_option(self):
+        self.assertRaises(OVMError, self.new_image, threads=4)
+
+    def test_defaults_of_files(self):
+        self.assertEqual(get_default_convert_options(self.dest, "qcow2"), {})
+        self.assertIn("coroutines", get_default_convert_options(self.dest, "raw"))
+
+    def run_qemu_img(self, func, *args):
+        """Call func with a qemu-img recording its arguments, return them"""
+        args_path = os.path.join(self.root, "args")
+        qemu_img = os.path.join(self.root, "qemu-img")
+        with open(qemu_img, "w") as fd:
+            fd.write('#!/bin/sh\necho "$@" > {}\n'.format(args_path))
+        os.chmod(qemu_img, 0o755)
+
+        path = os.environ["PATH"]
+        os.environ["PATH"] = self.root + os.pathsep + path
+        try:
+            func(*args)
+        finally:
+            os.environ["PATH"] = path
+
+        with open(args_path) as fd:
+            return fd.read().split()
+
+    def test_null_options(self):
+        config = {"path": self.dest, "format": "raw", "size": 8}
+        config["convert_options"] = None
+        self.assertEqual(ImageTemplate(config).convert_options, {})
+
+    def test_pool_options_checked(self):
+        """a typo in the options of a pool should fail with its configuration"""
+        for driver in (FileDriver(), LvmDriver()):
+            with self.subTest(driver=type(driver).__name__):
+                self.assertRaises(
+                    DriverError, driver.set_params, convert_options={"threads": 4}
+                )
+                self.assertRaises(
+                    DriverError, driver.set_params, convert_options="-m 16"
+                )
+
+    def test_pool_options_of_clone(self):
+        """qemu-img copying a disk should be given the options of the pool"""
+        driver = FileDriver()
+        driver.set_params(root=self.root, convert_options={"coroutines": 2})
+        # No way to share or copy the extents on this file system
+        saved = file_driver.clone_file
+        file_driver.clone_file = lambda source, dest: None
+        try:
+            args = self.run_qemu_img(driver._clone, self.dest, "raw", self.dest)
+        finally:
+            file_driver.clone_file = saved
+        self.assertEqual(args[args.index("-m") + 1], "2")
+
+    def test_template_options_override_pool(self):
+        image = self.new_image(coroutines=4)
+        args = self.run_qemu_img(
+            image.copy_on_device, self.dest, "raw", {"coroutines": 2, "cache": "none"}
+        )
+        self.assertEqual(args[args.index("-m") + 1], "4")
+        self.assertEqual(args[args.index("-t") + 1], "none")
+        self.assertEqual(args[-2:], [image.path, self.dest])